@@ -2,18 +2,31 @@
 from flask import Flask
 from flask_cors import CORS
 from .config import Config
+from .jsonprovider import FastJSONProvider
 from .models import db
+from .querycount import init_query_counter
+from . import graph_index, ioc_index, sigma
+from .rollups import start_reconciler
 
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.json = FastJSONProvider(app)
 
     db.init_app(app)
     CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
     with app.app_context():
         db.create_all()
+        init_query_counter(app, db.engine)
         from . import routes  # noqa: F401
 
+    if app.config['GRAPH_INDEX_ENABLED']:
+        graph_index.start(app)
+    if app.config['IOC_INDEX_ENABLED']:
+        ioc_index.start(app)
+    sigma.start(app)
+    start_reconciler(app)
+
     return app
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""Fan-out of new alerts to Server-Sent Events subscribers.
+
+`_create_alert` calls `broker.publish` after each commit. Subscribers sleep on
+a condition variable and only touch the database (a primary-key range read
+of `alerts.id > last_id`) when a new alert has actually been written.
+
+On PostgreSQL the alert id is also sent with NOTIFY (see pubsub), so
+streams served by one worker see alerts created by another.
+"""
+import threading
+
+from . import pubsub
+
+ALERTS_CHANNEL = 'klev_alerts'
+
+
+class AlertBroker:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._latest_id = 0
+
+    @property
+    def latest_id(self):
+        return self._latest_id
+
+    def publish(self, alert_id):
+        with self._cond:
+            if alert_id > self._latest_id:
+                self._latest_id = alert_id
+            self._cond.notify_all()
+
+    def wait(self, last_id, timeout):
+        """Block until an alert newer than `last_id` is announced or `timeout` passes."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._latest_id > last_id, timeout=timeout)
+
+    def _on_notify(self, payload):
+        try:
+            self.publish(int(payload))
+        except ValueError:
+            pass
+
+    def ensure_listener(self, engine):
+        """Relay alerts committed by other processes (PostgreSQL only)."""
+        pubsub.listener.subscribe(ALERTS_CHANNEL, self._on_notify)
+        pubsub.listener.ensure_started(engine)
+
+
+broker = AlertBroker()
+
+
+def send_alert_notify(session, alert_id):
+    """Queue a NOTIFY for `alert_id`; delivered when `session` commits."""
+    pubsub.notify(session, ALERTS_CHANNEL, str(alert_id))
+
+
+def format_sse(data, event_id=None, event=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.extend(f'data: {line}' for line in data.splitlines() or [''])
+    return '\n'.join(lines) + '\n\n'
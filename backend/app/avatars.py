@@ -0,0 +1,79 @@
+"""Content-addressed avatar storage.
+
+Uploaded images are decoded once, cropped to a square and rendered as PNG
+thumbnails in the configured sizes. Each thumbnail is stored in
+`avatar_blobs` under the SHA-256 of the uploaded bytes. Because a
+(hash, size) pair never changes, /api/avatars/<hash> can be cached
+forever by browsers and proxies.
+"""
+import base64
+import binascii
+import hashlib
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, AvatarBlob
+
+THUMBNAIL_FORMAT = 'PNG'
+THUMBNAIL_CONTENT_TYPE = 'image/png'
+
+
+class AvatarError(ValueError):
+    pass
+
+
+def decode_avatar(value, max_bytes):
+    """Accept a data: URL or bare base64 string and return the raw bytes."""
+    if not isinstance(value, str):
+        raise AvatarError('avatar must be a base64 string')
+    if value.startswith('data:'):
+        _, _, value = value.partition(',')
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise AvatarError('avatar is not valid base64')
+    if not raw:
+        raise AvatarError('avatar is empty')
+    if len(raw) > max_bytes:
+        raise AvatarError(f'avatar is larger than {max_bytes} bytes')
+    return raw
+
+
+def make_thumbnails(raw, sizes):
+    """Render square PNG thumbnails of `raw`; returns {size: bytes}."""
+    try:
+        image = Image.open(io.BytesIO(raw))
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise AvatarError('avatar is not a supported image')
+
+    image = ImageOps.exif_transpose(image).convert('RGBA')
+    thumbs = {}
+    for size in sizes:
+        thumb = ImageOps.fit(image, (size, size), method=Image.LANCZOS)
+        out = io.BytesIO()
+        thumb.save(out, THUMBNAIL_FORMAT, optimize=True)
+        thumbs[size] = out.getvalue()
+    return thumbs
+
+
+def store_avatar(raw, sizes):
+    """Store thumbnails of `raw` (if not already present) and return its hash."""
+    digest = hashlib.sha256(raw).hexdigest()
+    existing = {
+        size for (size,) in db.session.query(AvatarBlob.size).filter(AvatarBlob.hash == digest)
+    }
+    missing = [s for s in sizes if s not in existing]
+    if missing:
+        rows = [
+            {'hash': digest, 'size': size, 'content_type': THUMBNAIL_CONTENT_TYPE, 'data': data}
+            for size, data in make_thumbnails(raw, missing).items()
+        ]
+        db.session.execute(pg_insert(AvatarBlob.__table__).values(rows).on_conflict_do_nothing())
+    return digest
+
+
+def get_thumbnail(avatar_hash, size):
+    return db.session.get(AvatarBlob, (avatar_hash, size))
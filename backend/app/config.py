@@ -7,4 +7,63 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Rows per INSERT ... ON CONFLICT statement for /api/iocs/bulk
+    IOC_BULK_CHUNK_SIZE = int(os.environ.get('IOC_BULK_CHUNK_SIZE', 1000))
+    # Upper bound for ?limit= on paginated collection endpoints
+    PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', 1000))
+    # Entity counters are recounted with COUNT(*) in the background when older than this (0 = only by rebuild_stats.py)
+    COUNTERS_RECONCILE_SECONDS = int(os.environ.get('COUNTERS_RECONCILE_SECONDS', 3600))
+    # VirusTotal result cache: seconds to keep found / "not found" answers
+    VT_CACHE_TTL = int(os.environ.get('VT_CACHE_TTL', 24 * 3600))
+    VT_CACHE_NEGATIVE_TTL = int(os.environ.get('VT_CACHE_NEGATIVE_TTL', 3600))
+    VT_CACHE_MEMORY_ENTRIES = int(os.environ.get('VT_CACHE_MEMORY_ENTRIES', 4096))
+    # VirusTotal upstream: base URL (point at a local stand-in for testing),
+    # per-minute request quota of the API key (0 = unlimited) and batch fan-out
+    VT_BASE_URL = os.environ.get('VT_BASE_URL', 'https://www.virustotal.com/api/v3')
+    VT_RATE_PER_MINUTE = int(os.environ.get('VT_RATE_PER_MINUTE', 4))
+    VT_BATCH_CONCURRENCY = int(os.environ.get('VT_BATCH_CONCURRENCY', 4))
+    VT_BATCH_MAX = int(os.environ.get('VT_BATCH_MAX', 500))
+    # Seconds an interactive /api/virustotal/scan waits for quota before answering 429
+    VT_SCAN_WAIT = float(os.environ.get('VT_SCAN_WAIT', 5))
+    # Avatar thumbnails (px) rendered on upload; the largest one is served by default
+    AVATAR_SIZES = tuple(int(s) for s in os.environ.get('AVATAR_SIZES', '64,256').split(','))
+    AVATAR_MAX_BYTES = int(os.environ.get('AVATAR_MAX_BYTES', 5 * 1024 * 1024))
+    # Expose the per-request SQL statement count as X-Query-Count (tests / profiling)
+    QUERY_COUNT_HEADER = os.environ.get('QUERY_COUNT_HEADER', '').lower() in ('1', 'true')
+    # Fail requests that exceed their query budget instead of logging (always on when app.testing)
+    QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', '').lower() in ('1', 'true')
+    # Limits for /api/graph neighbourhood queries
+    GRAPH_MAX_DEPTH = int(os.environ.get('GRAPH_MAX_DEPTH', 4))
+    GRAPH_MAX_NODES = int(os.environ.get('GRAPH_MAX_NODES', 2000))
+    GRAPH_MAX_EDGES = int(os.environ.get('GRAPH_MAX_EDGES', 5000))
+    # In-memory adjacency index for /api/graph/pivot, loaded from / saved to a snapshot
+    GRAPH_INDEX_ENABLED = os.environ.get('GRAPH_INDEX_ENABLED', '1').lower() in ('1', 'true')
+    GRAPH_SNAPSHOT_PATH = os.environ.get('GRAPH_SNAPSHOT_PATH', 'graph_index.snapshot')
+    GRAPH_SNAPSHOT_MAX_AGE = int(os.environ.get('GRAPH_SNAPSHOT_MAX_AGE', 3600))
+    # Report full-text indicator extraction (backfill: extract_report_iocs.py)
+    EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', 0))  # 0 = one per CPU
+    EXTRACT_BATCH_SIZE = int(os.environ.get('EXTRACT_BATCH_SIZE', 500))
+    # POST /api/sigma/match batch limit
+    SIGMA_MATCH_MAX_EVENTS = int(os.environ.get('SIGMA_MATCH_MAX_EVENTS', 10000))
+    # Sigma retro-hunts over local JSONL logs (paths are relative to RETRO_HUNT_ROOT)
+    RETRO_HUNT_ROOT = os.environ.get('RETRO_HUNT_ROOT', 'logs')
+    RETRO_HUNT_WORKERS = int(os.environ.get('RETRO_HUNT_WORKERS', 0))  # 0 = one per CPU
+    RETRO_HUNT_CHUNK_MB = int(os.environ.get('RETRO_HUNT_CHUNK_MB', 64))
+    RETRO_HUNT_MAX_HITS = int(os.environ.get('RETRO_HUNT_MAX_HITS', 100000))
+    # POST /api/sigma-rules/bulk: upload size limit, unpacked size limit and parser processes (0 = one per CPU)
+    SIGMA_IMPORT_UPLOAD_MAX_MB = int(os.environ.get('SIGMA_IMPORT_UPLOAD_MAX_MB', 50))
+    SIGMA_IMPORT_MAX_MB = int(os.environ.get('SIGMA_IMPORT_MAX_MB', 200))
+    SIGMA_IMPORT_WORKERS = int(os.environ.get('SIGMA_IMPORT_WORKERS', 0))
+    # POST /api/malware/lookup-hashes batch limit
+    MALWARE_HASH_LOOKUP_MAX = int(os.environ.get('MALWARE_HASH_LOOKUP_MAX', 10000))
+    # In-memory IOC matchers (/api/iocs/match-*), built from iocs at startup
+    IOC_INDEX_ENABLED = os.environ.get('IOC_INDEX_ENABLED', '1').lower() in ('1', 'true')
+    IOC_MATCH_MAX = int(os.environ.get('IOC_MATCH_MAX', 100000))
+    # POST /api/iocs/scan-text: input beyond this is not read
+    IOC_SCAN_MAX_MB = int(os.environ.get('IOC_SCAN_MAX_MB', 256))
+    # Binary IOC snapshots for sensors (/api/iocs/snapshot, build_ioc_snapshot.py)
+    IOC_SNAPSHOT_DIR = os.environ.get('IOC_SNAPSHOT_DIR', 'snapshots')
+    IOC_SNAPSHOT_KEEP = int(os.environ.get('IOC_SNAPSHOT_KEEP', 5))
+    # POST /api/iocs/snapshot refuses to build within this many seconds of the newest snapshot
+    IOC_SNAPSHOT_MIN_INTERVAL = int(os.environ.get('IOC_SNAPSHOT_MIN_INTERVAL', 300))
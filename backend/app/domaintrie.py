@@ -0,0 +1,131 @@
+"""Subdomain matching of hostnames against domain IOCs.
+
+DomainSuffixTrie is keyed by DNS labels from right to left, so
+`evil.example` is stored on the path example -> evil. A hostname is
+lowercased, split once, and walked from its last label inward. Each
+label costs one dict lookup, and every node on the path that carries IOCs
+is a match: `cdn.a.evil.example` hits both `evil.example` and
+`a.evil.example` if both are listed.
+
+DomainMatcher is the IOC index engine around the trie; see ioc_index.
+"""
+import re
+
+DOMAIN_TYPES = frozenset(('domain', 'hostname', 'fqdn'))
+
+_LABEL = r'[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?'
+_DOMAIN = re.compile(rf'(?:{_LABEL}\.)*{_LABEL}')
+
+
+def split_domain(value):
+    """Labels of `value` from the TLD inward, or None if it is not a domain name."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower().rstrip('.')
+    if value.startswith('*.'):
+        value = value[2:]
+    if len(value) > 253 or not _DOMAIN.fullmatch(value):
+        return None
+    labels = value.split('.')
+    labels.reverse()
+    return labels
+
+
+class _Node:
+    __slots__ = ('children', 'iocs')
+
+    def __init__(self):
+        self.children = {}
+        self.iocs = None
+
+
+class DomainSuffixTrie:
+    def __init__(self):
+        self.root = _Node()
+        self.domains = 0
+
+    def insert(self, labels, ioc_id, payload):
+        """Store `ioc_id` under the reversed labels; False if it was already there."""
+        node = self.root
+        for label in labels:
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        if node.iocs is None:
+            node.iocs = {}
+            self.domains += 1
+        new = ioc_id not in node.iocs
+        node.iocs[ioc_id] = payload
+        return new
+
+    def remove(self, labels, ioc_id):
+        """Drop `ioc_id` from the domain, pruning nodes left empty. Returns whether it was there."""
+        path = [self.root]
+        for label in labels:
+            child = path[-1].children.get(label)
+            if child is None:
+                return False
+            path.append(child)
+        node = path[-1]
+        if not node.iocs or node.iocs.pop(ioc_id, None) is None:
+            return False
+        if not node.iocs:
+            node.iocs = None
+            self.domains -= 1
+            for parent, label in zip(reversed(path[:-1]), reversed(labels)):
+                child = parent.children[label]
+                if child.iocs or child.children:
+                    break
+                del parent.children[label]
+        return True
+
+    def suffix_matches(self, labels):
+        """(depth, iocs) for every listed domain that `labels` equals or is a subdomain of."""
+        found = []
+        node = self.root
+        depth = 0
+        for label in labels:
+            node = node.children.get(label)
+            if node is None:
+                break
+            depth += 1
+            if node.iocs:
+                found.append((depth, node.iocs))
+        return found
+
+
+class DomainMatcher:
+    def __init__(self):
+        self.trie = DomainSuffixTrie()
+        self.iocs = 0
+
+    def add(self, ioc_id, ioc_type, value):
+        if (ioc_type or '').lower() not in DOMAIN_TYPES:
+            return
+        labels = split_domain(value)
+        if labels is not None and self.trie.insert(labels, ioc_id, (ioc_type, value)):
+            self.iocs += 1
+
+    def remove(self, ioc_id, ioc_type, value):
+        if (ioc_type or '').lower() not in DOMAIN_TYPES:
+            return
+        labels = split_domain(value)
+        if labels is not None and self.trie.remove(labels, ioc_id):
+            self.iocs -= 1
+
+    def finish(self):
+        pass
+
+    def match(self, hostname):
+        """[(ioc_id, type, value)] most specific first, [] for no match, or None if invalid."""
+        labels = split_domain(hostname)
+        if labels is None:
+            return None
+        matches = []
+        for _, iocs in reversed(self.trie.suffix_matches(labels)):
+            matches += [(ioc_id, ioc_type, value) for ioc_id, (ioc_type, value) in sorted(iocs.items())]
+        return matches
+
+    def stats(self):
+        return {'iocs': self.iocs, 'domains': self.trie.domains}
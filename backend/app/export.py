@@ -0,0 +1,80 @@
+"""Streaming NDJSON/CSV export of whole tables.
+
+Rows are read through a server-side cursor (`yield_per`) and written out
+in small chunks, so memory use does not depend on table size and the
+first bytes go out as soon as the first chunk is fetched.
+"""
+import csv
+import io
+from datetime import date
+
+from .jsonprovider import dumps
+from .models import db, Malware, IOC, Report, APTGroup
+from .projection import projected_query, row_to_dict
+
+EXPORT_MODELS = {
+    'malware': Malware,
+    'iocs': IOC,
+    'reports': Report,
+    'apt-groups': APTGroup,
+}
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+FETCH_SIZE = 1000
+FLUSH_ROWS = 500
+
+
+def _iter_dicts(model):
+    fields = list(model.API_FIELDS)
+    query = projected_query(model, fields).order_by(model.id).execution_options(yield_per=FETCH_SIZE)
+    for row in query:
+        yield row_to_dict(row, fields)
+
+
+def _csv_cell(value):
+    if isinstance(value, (list, tuple)):
+        return ';'.join('' if v is None else str(v) for v in value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def iter_ndjson(model):
+    buf = []
+    for item in _iter_dicts(model):
+        buf.append(dumps(item))
+        if len(buf) >= FLUSH_ROWS:
+            yield '\n'.join(buf) + '\n'
+            buf.clear()
+    if buf:
+        yield '\n'.join(buf) + '\n'
+
+
+def iter_csv(model):
+    out = io.StringIO()
+    writer = None
+    rows = 0
+    for item in _iter_dicts(model):
+        if writer is None:
+            writer = csv.DictWriter(out, fieldnames=list(item))
+            writer.writeheader()
+        writer.writerow({k: _csv_cell(v) for k, v in item.items()})
+        rows += 1
+        if rows % FLUSH_ROWS == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue()
+
+
+def iter_export(model, fmt):
+    try:
+        yield from (iter_csv(model) if fmt == 'csv' else iter_ndjson(model))
+    finally:
+        # release the server-side cursor and its connection right away
+        db.session.close()
@@ -0,0 +1,221 @@
+"""Indicator extraction from report full text.
+
+`extract_indicators` refangs the text (hxxp://, example[.]com, ...) and
+runs a handful of precompiled regexes over it. Candidates are then
+filtered, since whatever is found is upserted into the shared `iocs`
+table: domains must end in a real TLD (tlds.txt, from the Public Suffix
+List), so `os.path.join` or `window.location.href` are not domains;
+unspecified and loopback addresses are dropped, and so are dotted quads
+that read as version numbers ("version 1.2.3.4", "1.2.3.4.5"). `link_report` upserts what
+was found into `iocs`/`vulnerabilities` and links it to the report via
+`report_ioc` and, for CVEs, to the report's malware via `malware_vuln`.
+Links are only ever added, so manual links survive a re-extraction.
+
+Single reports are handled inline by the create/PATCH routes; `backfill`
+walks every report and fans the regex work out to a process pool.
+"""
+import ipaddress
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .graph_index import index as graph_index, publish_events
+from .ioc_index import index as ioc_index, publish_events as publish_ioc_events
+from .ioc_ingest import upsert_iocs
+from .models import db, IOC, Report, Vulnerability, report_ioc, report_malware, malware_vuln
+from .normalize import LOOKUP_VALUE, normalize_value, refang
+from .rollups import track_insert
+
+_URL = re.compile(r'\b(?:https?|ftp)://[^\s<>"\'`]+', re.IGNORECASE)
+_IPV4 = re.compile(r'(?<!\d\.)\b(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\b(?!\.\d)')
+# candidates only; ipaddress decides what is really an IPv6 address
+_IPV6 = re.compile(r'(?<![\w:])(?:[0-9a-f]{0,4}:){2,7}[0-9a-f]{0,4}(?![\w:])', re.IGNORECASE)
+_DOMAIN = re.compile(r'\b(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}\b', re.IGNORECASE)
+_HASH = re.compile(r'\b(?:[a-f0-9]{64}|[a-f0-9]{40}|[a-f0-9]{32})\b', re.IGNORECASE)
+_CVE = re.compile(r'\bCVE-\d{4}-\d{4,7}\b', re.IGNORECASE)
+# what comes right before a dotted quad that is a version number, not an address
+_VERSION_CONTEXT = re.compile(
+    r'(?:\bv|\bver\.?|\bversion|\bbuild|\brelease|\bupdate|\bpatch|\bfirmware)\s*[:=#]?\s*$', re.IGNORECASE
+)
+
+
+def _load_tlds():
+    with open(os.path.join(os.path.dirname(__file__), 'tlds.txt'), encoding='ascii') as f:
+        return frozenset(line.strip() for line in f if line.strip() and not line.startswith('#'))
+
+
+TLDS = _load_tlds()
+
+_HASH_TYPES = {32: 'md5', 40: 'sha1', 64: 'sha256'}
+
+# "dropper.exe" looks like a domain to the regex above
+_FILE_SUFFIXES = frozenset((
+    'exe', 'dll', 'sys', 'bin', 'dat', 'tmp', 'log', 'txt', 'ini', 'cfg', 'lnk',
+    'bat', 'cmd', 'ps1', 'vbs', 'js', 'jar', 'py', 'sh', 'elf', 'so', 'msi',
+    'doc', 'docx', 'docm', 'xls', 'xlsx', 'xlsm', 'ppt', 'pptx', 'pdf', 'rtf',
+    'zip', 'rar', '7z', 'gz', 'tar', 'iso', 'img', 'png', 'jpg', 'gif', 'json',
+    'xml', 'html', 'htm', 'php', 'asp', 'aspx', 'yml', 'yaml', 'csv',
+))
+
+IOC_TYPES = ('url', 'domain', 'ipv4', 'ipv6', 'md5', 'sha1', 'sha256')
+
+
+def extract_indicators(text):
+    """{type: sorted values} for every indicator type found in `text`; CVEs under 'cve'."""
+    found = {kind: set() for kind in IOC_TYPES + ('cve',)}
+    if not text:
+        return {}
+    text = refang(text)
+
+    for m in _URL.finditer(text):
+        found['url'].add(m.group(0).rstrip('.,;:)]}'))
+    for m in _IPV4.finditer(text):
+        if _VERSION_CONTEXT.search(text, max(m.start() - 24, 0), m.start()):
+            continue
+        address = ipaddress.IPv4Address(m.group(0))
+        if not (address.is_unspecified or address.is_loopback):
+            found['ipv4'].add(m.group(0))
+    for m in _IPV6.finditer(text):
+        candidate = m.group(0)
+        if candidate.count(':') < 2:
+            continue
+        try:
+            address = ipaddress.IPv6Address(candidate)
+        except ValueError:
+            continue
+        if not (address.is_unspecified or address.is_loopback):
+            found['ipv6'].add(str(address))
+    for m in _DOMAIN.finditer(text):
+        domain = m.group(0).lower()
+        tld = domain.rsplit('.', 1)[1]
+        if tld in TLDS and tld not in _FILE_SUFFIXES:
+            found['domain'].add(domain)
+    for m in _HASH.finditer(text):
+        value = m.group(0).lower()
+        found[_HASH_TYPES[len(value)]].add(value)
+    found['cve'].update(m.group(0).upper() for m in _CVE.finditer(text))
+
+    return {kind: sorted(values) for kind, values in found.items() if values}
+
+
+def _extract_job(item):
+    report_id, text = item
+    return report_id, extract_indicators(text), len(text.encode('utf-8')) if text else 0
+
+
+def link_report(report_id, indicators):
+    """Upsert and link the output of `extract_indicators` in the current transaction.
+
+    Returns (counts, graph_events, ioc_events): the new edges for the graph
+    index and the new IOCs for the IOC index.
+    """
+    counts = {'iocs_inserted': 0, 'report_ioc': 0, 'malware_vuln': 0}
+    events = []
+    created = []
+
+    rows = [
+        {'type': kind, 'value': value, 'first_seen': None, 'last_seen': None,
+         'confidence': None, 'source': None}
+        for kind in IOC_TYPES for value in indicators.get(kind, ())
+    ]
+    if rows:
+        inserted, _ = upsert_iocs(rows, created)
+        track_insert('iocs', inserted)
+        counts['iocs_inserted'] = inserted
+        ioc_ids = db.session.execute(
+            select(IOC.id).where(LOOKUP_VALUE.in_({normalize_value(r['value'], r['type']) for r in rows}))
+        ).scalars().all()
+        stmt = pg_insert(report_ioc).values(
+            [{'report_id': report_id, 'ioc_id': ioc_id} for ioc_id in ioc_ids]
+        ).on_conflict_do_nothing().returning(report_ioc.c.ioc_id)
+        linked = db.session.execute(stmt).scalars().all()
+        counts['report_ioc'] = len(linked)
+        events += [('add', 'report_ioc', report_id, ioc_id) for ioc_id in linked]
+
+    cves = indicators.get('cve')
+    if cves:
+        db.session.execute(
+            pg_insert(Vulnerability.__table__)
+            .values([{'cve_id': cve} for cve in cves])
+            .on_conflict_do_nothing(index_elements=[Vulnerability.__table__.c.cve_id])
+        )
+        vuln_ids = db.session.execute(
+            select(Vulnerability.id).where(Vulnerability.cve_id.in_(cves))
+        ).scalars().all()
+        malware_ids = db.session.execute(
+            select(report_malware.c.malware_id).where(report_malware.c.report_id == report_id)
+        ).scalars().all()
+        pairs = [{'malware_id': m, 'vuln_id': v} for m in malware_ids for v in vuln_ids]
+        if pairs:
+            stmt = pg_insert(malware_vuln).values(pairs).on_conflict_do_nothing().returning(
+                malware_vuln.c.malware_id, malware_vuln.c.vuln_id
+            )
+            linked = db.session.execute(stmt).all()
+            counts['malware_vuln'] = len(linked)
+            events += [('add', 'malware_vuln', m, v) for m, v in linked]
+
+    return counts, events, [('add', *row) for row in created]
+
+
+def backfill(workers=None, batch_size=500, on_batch=None):
+    """Extract and link indicators for every report with full text.
+
+    Reports are read in id order, `batch_size` at a time; the regex work of
+    each batch is spread over `workers` processes while the parent does the
+    database writes and commits per batch. `on_batch(stats)` is called after
+    each commit. Returns the final stats, including text throughput.
+    """
+    workers = workers or os.cpu_count() or 1
+    stats = {'reports': 0, 'bytes': 0, 'iocs_inserted': 0, 'report_ioc': 0, 'malware_vuln': 0,
+             'extract_seconds': 0.0, 'elapsed_seconds': 0.0, 'mb_per_second': 0.0}
+    started = time.perf_counter()
+    last_id = 0
+
+    # spawn, not fork: the parent holds pooled DB connections and listener threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        while True:
+            batch = db.session.execute(
+                select(Report.id, Report.full_text)
+                .where(Report.id > last_id, Report.full_text.isnot(None))
+                .order_by(Report.id)
+                .limit(batch_size)
+            ).all()
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            t0 = time.perf_counter()
+            chunksize = max(1, len(batch) // (workers * 4))
+            results = list(pool.map(_extract_job, [tuple(row) for row in batch], chunksize=chunksize))
+            stats['extract_seconds'] += time.perf_counter() - t0
+
+            events, new_iocs = [], []
+            for report_id, indicators, nbytes in results:
+                stats['reports'] += 1
+                stats['bytes'] += nbytes
+                if indicators:
+                    counts, edges, iocs = link_report(report_id, indicators)
+                    for key, value in counts.items():
+                        stats[key] += value
+                    events += edges
+                    new_iocs += iocs
+            publish_events(db.session, events)
+            publish_ioc_events(db.session, new_iocs)
+            db.session.commit()
+            graph_index.apply_events(events)
+            ioc_index.apply_events(new_iocs)
+
+            stats['elapsed_seconds'] = time.perf_counter() - started
+            stats['mb_per_second'] = stats['bytes'] / 1e6 / stats['elapsed_seconds']
+            if on_batch:
+                on_batch(dict(stats))
+
+    stats['elapsed_seconds'] = time.perf_counter() - started
+    if stats['elapsed_seconds']:
+        stats['mb_per_second'] = stats['bytes'] / 1e6 / stats['elapsed_seconds']
+    return stats
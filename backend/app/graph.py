@@ -0,0 +1,167 @@
+"""Entity relationship graph over the many-to-many association tables.
+
+The neighbourhood of a node is found by batched frontier expansion. Each
+hop runs one query per (association table, direction) touching a kind
+present in the frontier, and each query is an index range scan: the
+primary key covers the first column and ix_<table>_<second> the other.
+A three-hop pivot therefore costs a few dozen indexed queries, however
+many edges the tables hold.
+"""
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from .models import (
+    db,
+    APTGroup,
+    Malware,
+    IOC,
+    Report,
+    Campaign,
+    Vulnerability,
+    apt_malware,
+    malware_ioc,
+    report_apt,
+    report_malware,
+    report_ioc,
+    campaign_apt,
+    campaign_malware,
+    campaign_reports,
+    malware_vuln,
+    apt_vuln,
+)
+
+# kind -> (model, label column)
+NODE_KINDS = {
+    'apt': (APTGroup, APTGroup.name),
+    'malware': (Malware, Malware.name),
+    'ioc': (IOC, IOC.value),
+    'report': (Report, Report.title),
+    'campaign': (Campaign, Campaign.name),
+    'vuln': (Vulnerability, Vulnerability.cve_id),
+}
+
+# URL spellings accepted by /api/graph/<entity>/<id>
+ENTITY_ALIASES = {
+    'apt': 'apt', 'apt-groups': 'apt',
+    'malware': 'malware',
+    'ioc': 'ioc', 'iocs': 'ioc',
+    'report': 'report', 'reports': 'report',
+    'campaign': 'campaign', 'campaigns': 'campaign',
+    'vuln': 'vuln', 'vulnerabilities': 'vuln', 'cve': 'vuln',
+}
+
+# (edge type, table, (kind, column), (kind, column))
+EDGE_TYPES = (
+    ('apt_malware', apt_malware, ('apt', 'apt_id'), ('malware', 'malware_id')),
+    ('malware_ioc', malware_ioc, ('malware', 'malware_id'), ('ioc', 'ioc_id')),
+    ('report_apt', report_apt, ('report', 'report_id'), ('apt', 'apt_id')),
+    ('report_malware', report_malware, ('report', 'report_id'), ('malware', 'malware_id')),
+    ('report_ioc', report_ioc, ('report', 'report_id'), ('ioc', 'ioc_id')),
+    ('campaign_apt', campaign_apt, ('campaign', 'campaign_id'), ('apt', 'apt_id')),
+    ('campaign_malware', campaign_malware, ('campaign', 'campaign_id'), ('malware', 'malware_id')),
+    ('campaign_reports', campaign_reports, ('campaign', 'campaign_id'), ('report', 'report_id')),
+    ('malware_vuln', malware_vuln, ('malware', 'malware_id'), ('vuln', 'vuln_id')),
+    ('apt_vuln', apt_vuln, ('apt', 'apt_id'), ('vuln', 'vuln_id')),
+)
+
+
+def node_key(kind, entity_id):
+    return f'{kind}:{entity_id}'
+
+
+def _labels(nodes):
+    by_kind = defaultdict(list)
+    for kind, entity_id in nodes:
+        by_kind[kind].append(entity_id)
+    labels = {}
+    for kind, ids in by_kind.items():
+        model, label = NODE_KINDS[kind]
+        for entity_id, text in db.session.execute(select(model.id, label).where(model.id.in_(ids))):
+            labels[(kind, entity_id)] = text
+    return labels
+
+
+def neighborhood(kind, entity_id, depth, max_nodes, max_edges):
+    """Nodes and edges within `depth` hops of (kind, entity_id).
+
+    Returns None when the root does not exist. `truncated` is set when a
+    node or edge limit stopped the expansion early.
+    """
+    model, _ = NODE_KINDS[kind]
+    if db.session.get(model, entity_id) is None:
+        return None
+
+    root = (kind, entity_id)
+    depth_of = {root: 0}
+    frontier = {kind: {entity_id}}
+    edges = set()
+    truncated = False
+
+    for hop in range(1, depth + 1):
+        next_frontier = defaultdict(set)
+        for edge_type, table, side_a, side_b in EDGE_TYPES:
+            for (src_kind, src_col), (dst_kind, dst_col) in ((side_a, side_b), (side_b, side_a)):
+                ids = frontier.get(src_kind)
+                if not ids or truncated:
+                    continue
+                src, dst = table.c[src_col], table.c[dst_col]
+                remaining = max_edges - len(edges)
+                rows = db.session.execute(
+                    select(src, dst).where(src.in_(list(ids))).limit(remaining + 1)
+                ).all()
+                for src_id, dst_id in rows:
+                    target = (dst_kind, dst_id)
+                    if target not in depth_of:
+                        if len(depth_of) >= max_nodes:
+                            truncated = True
+                            continue
+                        depth_of[target] = hop
+                        next_frontier[dst_kind].add(dst_id)
+                    a, b = ((src_kind, src_id), target)
+                    if src_kind != side_a[0]:
+                        a, b = b, a
+                    edges.add((edge_type, a, b))
+                    if len(edges) >= max_edges:
+                        truncated = True
+                        break
+        frontier = next_frontier
+        if not frontier or truncated:
+            break
+
+    labels = _labels(depth_of)
+    return {
+        'root': node_key(*root),
+        'nodes': [
+            {
+                'id': node_key(k, i),
+                'kind': k,
+                'entity_id': i,
+                'label': labels.get((k, i)),
+                'depth': d,
+            }
+            for (k, i), d in sorted(depth_of.items(), key=lambda item: (item[1], item[0]))
+        ],
+        'edges': [
+            {'source': node_key(*a), 'target': node_key(*b), 'type': edge_type}
+            for edge_type, a, b in sorted(edges)
+        ],
+        'truncated': truncated,
+    }
+
+
+def sql_pivot(start_kind, start_ids, path):
+    """Same contract as AdjacencyIndex.pivot, answered with one query per step and table."""
+    current_kind, current = start_kind, set(start_ids)
+    for next_kind in path:
+        step = set()
+        for _, table, side_a, side_b in EDGE_TYPES:
+            for (src_kind, src_col), (dst_kind, dst_col) in ((side_a, side_b), (side_b, side_a)):
+                if src_kind != current_kind or dst_kind != next_kind or not current:
+                    continue
+                rows = db.session.execute(
+                    select(table.c[dst_col]).where(table.c[src_col].in_(list(current))).distinct()
+                )
+                step.update(x for (x,) in rows)
+        current_kind, current = next_kind, step
+    return current
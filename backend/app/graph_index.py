@@ -0,0 +1,395 @@
+"""Process-resident adjacency index over the association tables.
+
+Every edge type in graph.EDGE_TYPES is stored twice (a -> b and b -> a)
+in CSR form: `indptr` (array of offsets indexed by entity id) and
+`indices` (array of neighbour ids). A neighbour lookup is then two array
+reads and a slice. Writes made after the CSR arrays were built sit in a
+small overlay of added/removed edges. The overlay is folded back into the
+arrays once it grows past COMPACT_THRESHOLD.
+
+At startup a fresh snapshot file, if there is one, is loaded so queries
+can be served at once; the index is then rebuilt from the database in the
+background, since edges written after the snapshot are not in it. Events
+applied while a rebuild reads the tables are replayed onto the new arrays,
+so no write is lost. The snapshot is rewritten after every rebuild and
+compaction. It holds the CSR arrays as they sit in memory, little-endian,
+so loading is a few `array.fromfile` calls:
+
+    header    8s magic b'KLEVGRF1' | u32 format | u32 sections | f64 built_at (unix)
+    section   32s edge type | u8 reverse | 7 pad | u64 indptr length | u64 indices length
+              followed by indptr (i64 x length) and indices (i32 x length)
+
+The index is kept current by `apply_events`, which the write routes call
+locally and which also receives the same events from other processes over
+pubsub.
+"""
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from . import pubsub
+from .graph import EDGE_TYPES
+from .models import db
+
+GRAPH_CHANNEL = 'klev_graph'
+SNAPSHOT_MAGIC = b'KLEVGRF1'
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_HEADER = struct.Struct('<8sIId')
+SNAPSHOT_SECTION = struct.Struct('<32sB7xQQ')
+COMPACT_THRESHOLD = 10000
+FETCH_SIZE = 50000
+
+EDGE_KINDS = {edge_type: (side_a[0], side_b[0]) for edge_type, _, side_a, side_b in EDGE_TYPES}
+
+
+class CSR:
+    __slots__ = ('indptr', 'indices')
+
+    def __init__(self, indptr=None, indices=None):
+        self.indptr = indptr if indptr is not None else array('q', [0])
+        self.indices = indices if indices is not None else array('i')
+
+    @classmethod
+    def from_pairs(cls, src, dst):
+        """Build from parallel arrays of (src, dst) ids with a counting sort."""
+        size = (max(src) + 2) if src else 1
+        indptr = array('q', bytes(8 * size))
+        for s in src:
+            indptr[s + 1] += 1
+        for i in range(1, size):
+            indptr[i] += indptr[i - 1]
+        indices = array('i', bytes(4 * len(src)))
+        fill = array('q', indptr)
+        for s, d in zip(src, dst):
+            indices[fill[s]] = d
+            fill[s] += 1
+        return cls(indptr, indices)
+
+    def neighbors(self, node):
+        if node < 0 or node + 1 >= len(self.indptr):
+            return self.indices[0:0]
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def pairs(self):
+        indptr, indices = self.indptr, self.indices
+        for node in range(len(indptr) - 1):
+            for i in range(indptr[node], indptr[node + 1]):
+                yield node, indices[i]
+
+    @property
+    def nbytes(self):
+        return self.indptr.itemsize * len(self.indptr) + self.indices.itemsize * len(self.indices)
+
+
+class AdjacencyIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # (edge_type, reverse) -> CSR
+        self._csr = {}
+        # (edge_type, reverse) -> {src: {dst}}
+        self._added = defaultdict(lambda: defaultdict(set))
+        # {(edge_type, a, b)} removed since the CSR arrays were built
+        self._removed = set()
+        self._overlay_size = 0
+        # events applied while build_from_db reads the tables, replayed after the swap
+        self._pending = None
+        self._saving = threading.Lock()
+        self.snapshot_path = None
+        self.built_at = None
+        self.ready = False
+
+    # ---- building / snapshots -------------------------------------------------
+    @staticmethod
+    def _build_csr(pairs_by_type):
+        csr = {}
+        for edge_type, (src, dst) in pairs_by_type.items():
+            csr[(edge_type, False)] = CSR.from_pairs(src, dst)
+            csr[(edge_type, True)] = CSR.from_pairs(dst, src)
+        return csr
+
+    def _install(self, pairs_by_type, built_at):
+        self._swap(self._build_csr(pairs_by_type), built_at)
+
+    def _swap(self, csr, built_at):
+        with self._lock:
+            self._csr = csr
+            self._added.clear()
+            self._removed.clear()
+            self._overlay_size = 0
+            self.built_at = built_at
+            self.ready = True
+
+    def build_from_db(self):
+        with self._lock:
+            self._pending = []
+        built_at = time.time()
+        pairs_by_type = {}
+        for edge_type, table, (_, col_a), (_, col_b) in EDGE_TYPES:
+            src, dst = array('i'), array('i')
+            result = db.session.execute(
+                select(table.c[col_a], table.c[col_b]).execution_options(yield_per=FETCH_SIZE)
+            )
+            for a, b in result:
+                src.append(a)
+                dst.append(b)
+            pairs_by_type[edge_type] = (src, dst)
+        db.session.close()
+        csr = self._build_csr(pairs_by_type)
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._swap(csr, built_at)
+            self._apply(pending)
+
+    def save_snapshot(self, path):
+        with self._lock:
+            if self._overlay_size:
+                self._compact(save=False)
+            csr, built_at = dict(self._csr), self.built_at
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, len(csr), built_at))
+            for (edge_type, reverse), arrays in csr.items():
+                f.write(SNAPSHOT_SECTION.pack(edge_type.encode('ascii'), reverse,
+                                              len(arrays.indptr), len(arrays.indices)))
+                for data in (arrays.indptr, arrays.indices):
+                    if sys.byteorder != 'little':
+                        data = array(data.typecode, data)
+                        data.byteswap()
+                    data.tofile(f)
+        os.replace(tmp, path)
+
+    def load_snapshot(self, path, max_age):
+        """Load `path` if it is a snapshot of this format newer than `max_age` seconds."""
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            header = f.read(SNAPSHOT_HEADER.size)
+            if len(header) != SNAPSHOT_HEADER.size:
+                return False
+            magic, fmt, sections, built_at = SNAPSHOT_HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC or fmt != SNAPSHOT_FORMAT:
+                return False
+            if max_age and time.time() - built_at > max_age:
+                return False
+            csr = {}
+            try:
+                for _ in range(sections):
+                    name, reverse, indptr_len, indices_len = SNAPSHOT_SECTION.unpack(f.read(SNAPSHOT_SECTION.size))
+                    indptr, indices = array('q'), array('i')
+                    indptr.fromfile(f, indptr_len)
+                    indices.fromfile(f, indices_len)
+                    if sys.byteorder != 'little':
+                        indptr.byteswap()
+                        indices.byteswap()
+                    edge_type = name.rstrip(b'\0').decode('ascii')
+                    if edge_type in EDGE_KINDS:
+                        csr[(edge_type, bool(reverse))] = CSR(indptr, indices)
+            except (EOFError, ValueError, struct.error):
+                return False  # truncated or corrupt: rebuild from the database
+        if len(csr) != 2 * len(EDGE_KINDS):
+            return False  # written before an edge type was added
+        self._swap(csr, built_at)
+        return True
+
+    # ---- incremental updates ----------------------------------------------------
+    def apply_events(self, events):
+        """Apply ('add' | 'remove', edge_type, a, b) events; idempotent."""
+        with self._lock:
+            self._apply(events)
+            if self._pending is not None:
+                self._pending.extend(events)
+
+    def _apply(self, events):
+        for op, edge_type, a, b in events:
+            if edge_type not in EDGE_KINDS:
+                continue
+            if op == 'add':
+                self._removed.discard((edge_type, a, b))
+                if b not in self._csr_neighbors(edge_type, False, a):
+                    self._added[(edge_type, False)][a].add(b)
+                    self._added[(edge_type, True)][b].add(a)
+            elif op == 'remove':
+                self._added[(edge_type, False)].get(a, set()).discard(b)
+                self._added[(edge_type, True)].get(b, set()).discard(a)
+                self._removed.add((edge_type, a, b))
+            self._overlay_size += 1
+        if self._overlay_size > COMPACT_THRESHOLD:
+            self._compact()
+
+    def node_removal_events(self, kind, node_id):
+        """Events that drop every edge touching (kind, node_id), read from the database.
+
+        Call before the row (and its association rows) are deleted.
+        """
+        events = []
+        for edge_type, table, (kind_a, col_a), (kind_b, col_b) in EDGE_TYPES:
+            if kind_a == kind:
+                rows = db.session.execute(select(table.c[col_b]).where(table.c[col_a] == node_id))
+                events += [('remove', edge_type, node_id, b) for (b,) in rows]
+            if kind_b == kind:
+                rows = db.session.execute(select(table.c[col_a]).where(table.c[col_b] == node_id))
+                events += [('remove', edge_type, a, node_id) for (a,) in rows]
+        return events
+
+    def _compact(self, save=True):
+        pairs_by_type = {}
+        for edge_type in EDGE_KINDS:
+            src, dst = array('i'), array('i')
+            for a, b in self._iter_edges(edge_type):
+                src.append(a)
+                dst.append(b)
+            pairs_by_type[edge_type] = (src, dst)
+        self._install(pairs_by_type, self.built_at)
+        if save and self.snapshot_path:
+            threading.Thread(target=self._save_quietly, name='graph-index-snapshot', daemon=True).start()
+
+    def _save_quietly(self):
+        if not self._saving.acquire(blocking=False):
+            return  # another save is writing the same state
+        try:
+            self.save_snapshot(self.snapshot_path)
+        except Exception as e:
+            print(f"Error saving graph index snapshot: {e}")
+        finally:
+            self._saving.release()
+
+    # ---- queries ------------------------------------------------------------------
+    def _csr_neighbors(self, edge_type, reverse, node):
+        csr = self._csr.get((edge_type, reverse))
+        return csr.neighbors(node) if csr is not None else ()
+
+    def _neighbor_ids(self, edge_type, reverse, node):
+        base = self._csr_neighbors(edge_type, reverse, node)
+        added = self._added[(edge_type, reverse)].get(node)
+        if not self._removed and not added:
+            return base
+        if reverse:
+            result = [a for a in base if (edge_type, a, node) not in self._removed]
+        else:
+            result = [b for b in base if (edge_type, node, b) not in self._removed]
+        if added:
+            result.extend(added)
+        return result
+
+    def _iter_edges(self, edge_type):
+        csr = self._csr.get((edge_type, False))
+        if csr is not None:
+            for a, b in csr.pairs():
+                if (edge_type, a, b) not in self._removed:
+                    yield a, b
+        for a, targets in self._added[(edge_type, False)].items():
+            for b in targets:
+                yield a, b
+
+    def neighbors(self, kind, node_id, target_kind=None):
+        """{(kind, id)} adjacent to (kind, node_id), optionally of one kind only."""
+        result = set()
+        with self._lock:
+            for edge_type, (kind_a, kind_b) in EDGE_KINDS.items():
+                if kind_a == kind and target_kind in (None, kind_b):
+                    result.update((kind_b, b) for b in self._neighbor_ids(edge_type, False, node_id))
+                if kind_b == kind and target_kind in (None, kind_a):
+                    result.update((kind_a, a) for a in self._neighbor_ids(edge_type, True, node_id))
+        return result
+
+    def pivot(self, start_kind, start_ids, path):
+        """Follow `path` (a list of kinds) from `start_ids`; returns the final id set.
+
+        pivot('apt', [12], ['malware', 'ioc']) gives every IOC linked to any
+        malware used by APT 12.
+        """
+        current_kind, current = start_kind, set(start_ids)
+        with self._lock:
+            for next_kind in path:
+                step = set()
+                for edge_type, (kind_a, kind_b) in EDGE_KINDS.items():
+                    if kind_a == current_kind and kind_b == next_kind:
+                        for node in current:
+                            step.update(self._neighbor_ids(edge_type, False, node))
+                    if kind_b == current_kind and kind_a == next_kind:
+                        for node in current:
+                            step.update(self._neighbor_ids(edge_type, True, node))
+                current_kind, current = next_kind, step
+        return current
+
+    def stats(self):
+        with self._lock:
+            edges = {
+                edge_type: len(self._csr[(edge_type, False)].indices) if (edge_type, False) in self._csr else 0
+                for edge_type in EDGE_KINDS
+            }
+            return {
+                'ready': self.ready,
+                'built_at': self.built_at,
+                'edges': edges,
+                'overlay_events': self._overlay_size,
+                'memory_bytes': sum(c.nbytes for c in self._csr.values()),
+            }
+
+
+index = AdjacencyIndex()
+
+
+def encode_events(events):
+    return ';'.join(f'{op},{edge_type},{a},{b}' for op, edge_type, a, b in events)
+
+
+def decode_events(payload):
+    events = []
+    for item in payload.split(';'):
+        if not item:
+            continue
+        op, edge_type, a, b = item.split(',')
+        events.append((op, edge_type, int(a), int(b)))
+    return events
+
+
+def publish_events(session, events):
+    """Send edge events to other processes; delivered when `session` commits.
+
+    NOTIFY payloads are limited to 8000 bytes, so events go out in batches.
+    """
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) >= 200:
+            pubsub.notify(session, GRAPH_CHANNEL, encode_events(batch))
+            batch = []
+    if batch:
+        pubsub.notify(session, GRAPH_CHANNEL, encode_events(batch))
+
+
+def _on_notify(payload):
+    index.apply_events(decode_events(payload))
+
+
+def start(app):
+    """Load the snapshot, then rebuild from the database, in a background thread; follow writes."""
+    path = app.config['GRAPH_SNAPSHOT_PATH']
+    max_age = app.config['GRAPH_SNAPSHOT_MAX_AGE']
+    index.snapshot_path = path
+
+    def _load():
+        with app.app_context():
+            try:
+                pubsub.listener.subscribe(GRAPH_CHANNEL, _on_notify)
+                pubsub.listener.ensure_started(db.engine)
+                # serve from the snapshot while the database is read; it may miss recent edges
+                try:
+                    index.load_snapshot(path, max_age)
+                except OSError as e:
+                    print(f"Error reading graph index snapshot: {e}")
+                index.build_from_db()
+                index._save_quietly()
+            except Exception as e:
+                print(f"Error loading graph index: {e}")
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=_load, name='graph-index-loader', daemon=True).start()
@@ -0,0 +1,66 @@
+"""Batch lookup of file hashes against malware.hashes and hash IOCs.
+
+Both sides are answered with one query each, the hash list bound as a
+single array parameter: `malware.hashes && :hashes` uses the GIN index
+ix_malware_hashes, and `coalesce(iocs.normalized_value, iocs.value) =
+ANY(:hashes)` the index ix_iocs_lookup_value. Stored values are matched in
+lower and upper case, since array and b-tree lookups are case-sensitive and
+IOCs not normalized yet keep their original spelling.
+"""
+import re
+
+from sqlalchemy import any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from .models import db, Malware, IOC
+from .normalize import LOOKUP_VALUE
+
+_HASH = re.compile(r'^(?:[0-9a-f]{32}|[0-9a-f]{40}|[0-9a-f]{64}|[0-9a-f]{128})$')
+HASH_TYPES = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+
+def normalize_hashes(values):
+    """(unique lower-case hashes in input order, rejected inputs)."""
+    valid, invalid = {}, []
+    for value in values:
+        h = value.strip().lower() if isinstance(value, str) else ''
+        if _HASH.match(h):
+            valid.setdefault(h, None)
+        else:
+            invalid.append(value)
+    return list(valid), invalid
+
+
+def lookup_hashes(hashes):
+    """{hash: {'type', 'malware': [...], 'iocs': [...]}} for hashes with at least one match."""
+    wanted = set(hashes)
+    variants = hashes + [h.upper() for h in hashes]
+    param = bindparam('hashes', variants, type_=ARRAY(db.Text))
+    matches = {}
+
+    def entry(h):
+        return matches.setdefault(h, {'type': HASH_TYPES[len(h)], 'malware': [], 'iocs': []})
+
+    malware_rows = db.session.execute(
+        select(Malware.id, Malware.name, Malware.family, Malware.type, Malware.hashes)
+        .where(Malware.hashes.overlap(param))
+    ).all()
+    for row in malware_rows:
+        item = {'id': row.id, 'name': row.name, 'family': row.family, 'type': row.type}
+        for h in {x.lower() for x in row.hashes or () if x}:
+            if h in wanted:
+                entry(h)['malware'].append(item)
+
+    ioc_rows = db.session.execute(
+        select(IOC.id, IOC.type, LOOKUP_VALUE.label('value'), IOC.confidence, IOC.source, IOC.last_seen)
+        .where(LOOKUP_VALUE == any_(param))
+    ).all()
+    for row in ioc_rows:
+        entry(row.value.lower())['iocs'].append({
+            'id': row.id,
+            'type': row.type,
+            'confidence': row.confidence,
+            'source': row.source,
+            'last_seen': row.last_seen,
+        })
+    return matches
@@ -0,0 +1,211 @@
+"""Process-resident IOC matchers, loaded at startup and kept in step with writes.
+
+Each engine registered with `index.register` sees every IOC through
+add(ioc_id, type, value) / remove(ioc_id, type, value) and ignores the
+values it does not handle. `value` is the canonical spelling,
+coalesce(normalized_value, value), so defanged or mixed-case IOCs match;
+events must carry the same (see `index_value`). `start` builds all engines from `iocs` in a
+background thread. Writers then call `publish_events` before commit and
+`index.apply_events` after it; other processes receive the same events
+over pubsub. A batch larger than RELOAD_THRESHOLD is announced as a single
+"reload" instead, which makes every process rebuild from the table.
+
+Events applied while a rebuild is reading the table are replayed onto the
+new engines before they are swapped in, so no write is lost.
+
+apply_events only updates the engines' tables and marks them dirty; a
+background thread calls finish() (e.g. recompiling the text scanner's
+delta automaton) once writes have been quiet for FINISH_DELAY seconds, so
+a write request never pays for it. Engines may see finish() run alongside
+add/remove and lock themselves where that matters. Payloads carry the
+publishing process's ORIGIN, and a process ignores its own, since it has
+applied those events already.
+"""
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from sqlalchemy import func, select
+
+from . import pubsub
+from .domaintrie import DomainMatcher
+from .iptrie import CIDRMatcher
+from .textscan import TextScanner
+from .jsonprovider import dumps, loads
+from .models import db, IOC
+
+IOC_CHANNEL = 'klev_iocs'
+RELOAD_THRESHOLD = 2000
+NOTIFY_BYTES = 7000
+FETCH_SIZE = 20000
+FINISH_DELAY = 0.2
+ORIGIN = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+class IOCIndex:
+    def __init__(self):
+        self._factories = {}
+        self._engines = {}
+        self._lock = threading.RLock()
+        self._building = threading.Lock()
+        self._pending = None
+        self._dirty = threading.Event()
+        self._finisher = None
+        self.ready = False
+        self.built_at = None
+        self.size = 0
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    @contextmanager
+    def engines(self):
+        """Engines by name, with writers held off while the caller queries them."""
+        with self._lock:
+            yield self._engines
+
+    def build_from_db(self):
+        with self._building:
+            with self._lock:
+                self._pending = []
+            engines = {name: factory() for name, factory in self._factories.items()}
+            count = 0
+            result = db.session.execute(
+                select(IOC.id, IOC.type, func.coalesce(IOC.normalized_value, IOC.value))
+                .execution_options(yield_per=FETCH_SIZE)
+            )
+            for ioc_id, ioc_type, value in result:
+                for engine in engines.values():
+                    engine.add(ioc_id, ioc_type, value)
+                count += 1
+            db.session.close()
+            # the heavy part of finish() (e.g. compiling an automaton) runs
+            # before writers are held off; the replay below only adds a delta
+            for engine in engines.values():
+                engine.finish()
+            with self._lock:
+                self._apply(engines, self._pending)
+                self._pending = None
+                for engine in engines.values():
+                    engine.finish()
+                self._engines = engines
+                self.size = count
+                self.built_at = time.time()
+                self.ready = True
+
+    def _apply(self, engines, events):
+        for op, ioc_id, ioc_type, value in events:
+            for engine in engines.values():
+                if op == 'add':
+                    engine.add(ioc_id, ioc_type, value)
+                elif op == 'remove':
+                    engine.remove(ioc_id, ioc_type, value)
+
+    def apply_events(self, events):
+        """Apply ('add' | 'remove', ioc_id, type, value) events; idempotent."""
+        if not events:
+            return
+        with self._lock:
+            self._apply(self._engines, events)
+            if self._pending is not None:
+                self._pending.extend(events)
+            if self._engines:
+                if self._finisher is None:
+                    self._finisher = threading.Thread(target=self._finish_loop, name='ioc-index-finish', daemon=True)
+                    self._finisher.start()
+                self._dirty.set()
+
+    def _finish_loop(self):
+        while True:
+            self._dirty.wait()
+            # let a burst of writes land first, then finish once for all of them
+            while True:
+                self._dirty.clear()
+                time.sleep(FINISH_DELAY)
+                if not self._dirty.is_set():
+                    break
+            with self._lock:
+                engines = list(self._engines.values())
+            for engine in engines:
+                try:
+                    engine.finish()
+                except Exception as e:
+                    print(f"Error finishing IOC index engine: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'built_at': self.built_at,
+                'iocs': self.size,
+                'engines': {name: engine.stats() for name, engine in self._engines.items()},
+            }
+
+
+index = IOCIndex()
+index.register('cidr', CIDRMatcher)
+index.register('domain', DomainMatcher)
+index.register('text', TextScanner)
+
+
+def index_value(ioc):
+    """The value the engines know `ioc` by."""
+    return ioc.normalized_value or ioc.value
+
+
+def publish_reload(session):
+    """Make every process rebuild from the table; delivered when `session` commits."""
+    pubsub.notify(session, IOC_CHANNEL, f'{ORIGIN} reload')
+
+
+def publish_events(session, events):
+    """Send IOC events to other processes; delivered when `session` commits."""
+    if not events:
+        return
+    if len(events) > RELOAD_THRESHOLD:
+        pubsub.notify(session, IOC_CHANNEL, f'{ORIGIN} reload')
+        return
+    batch, size = [], 0
+    for event in events:
+        encoded = dumps(list(event))
+        if len(encoded) > NOTIFY_BYTES:
+            pubsub.notify(session, IOC_CHANNEL, f'{ORIGIN} reload')
+            return
+        if size + len(encoded) > NOTIFY_BYTES:
+            pubsub.notify(session, IOC_CHANNEL, f'{ORIGIN} [' + ','.join(batch) + ']')
+            batch, size = [], 0
+        batch.append(encoded)
+        size += len(encoded) + 1
+    pubsub.notify(session, IOC_CHANNEL, f'{ORIGIN} [' + ','.join(batch) + ']')
+
+
+def _rebuild(app):
+    with app.app_context():
+        try:
+            index.build_from_db()
+        except Exception as e:
+            print(f"Error loading IOC index: {e}")
+        finally:
+            db.session.remove()
+
+
+def start(app):
+    """Build the IOC index in a background thread and follow writes."""
+    def on_notify(payload):
+        origin, _, payload = payload.partition(' ')
+        if origin == ORIGIN:
+            return  # applied locally by the writer already
+        if payload == 'reload':
+            threading.Thread(target=_rebuild, args=(app,), name='ioc-index-reload', daemon=True).start()
+        else:
+            index.apply_events([tuple(event) for event in loads(payload)])
+
+    def _load():
+        with app.app_context():
+            pubsub.listener.subscribe(IOC_CHANNEL, on_notify)
+            pubsub.listener.ensure_started(db.engine)
+        _rebuild(app)
+
+    threading.Thread(target=_load, name='ioc-index-loader', daemon=True).start()
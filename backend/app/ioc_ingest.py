@@ -0,0 +1,163 @@
+"""Bulk IOC ingestion: validation and set-based upsert into `iocs`."""
+import json
+from datetime import date, datetime
+
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, IOC
+from .normalize import normalize_value
+
+
+class IOCValidationError(ValueError):
+    pass
+
+
+def _coerce_date(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.fromisoformat(str(value)).date()
+    except ValueError:
+        raise IOCValidationError(f'invalid date: {value!r}')
+
+
+def validate_ioc(raw):
+    """Check one incoming IOC dict and return a row ready for insert."""
+    if not isinstance(raw, dict):
+        raise IOCValidationError('item must be an object')
+    ioc_type = raw.get('type')
+    value = raw.get('value')
+    ioc_type = ioc_type.strip() if isinstance(ioc_type, str) else ''
+    value = value.strip() if isinstance(value, str) else ''
+    if not ioc_type or not value:
+        raise IOCValidationError('type and value are required')
+
+    confidence = raw.get('confidence')
+    if confidence not in (None, ''):
+        try:
+            confidence = int(confidence)
+        except (TypeError, ValueError):
+            raise IOCValidationError(f'invalid confidence: {confidence!r}')
+        if not 0 <= confidence <= 100:
+            raise IOCValidationError('confidence must be between 0 and 100')
+    else:
+        confidence = None
+
+    first_seen = _coerce_date(raw.get('first_seen'))
+    last_seen = _coerce_date(raw.get('last_seen'))
+    if first_seen and last_seen and first_seen > last_seen:
+        first_seen, last_seen = last_seen, first_seen
+
+    return {
+        'type': ioc_type,
+        'value': value,
+        'first_seen': first_seen,
+        'last_seen': last_seen,
+        'confidence': confidence,
+        'source': raw.get('source'),
+    }
+
+
+def _merge_rows(existing, row):
+    """Fold a duplicate of the same value the way ON CONFLICT does."""
+    for key, pick in (('first_seen', min), ('last_seen', max), ('confidence', max)):
+        candidates = [v for v in (existing[key], row[key]) if v is not None]
+        existing[key] = pick(candidates) if candidates else None
+    existing['source'] = row['source'] or existing['source']
+    return existing
+
+
+def _upsert(rows, target):
+    table = IOC.__table__
+    stmt = pg_insert(table).values(rows)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[target],
+        index_where=table.c.normalized_value.is_not(None) if target is table.c.normalized_value else None,
+        set_={
+            # LEAST/GREATEST skip NULLs, so a missing date never wipes a known one
+            'first_seen': func.least(table.c.first_seen, excluded.first_seen),
+            'last_seen': func.greatest(table.c.last_seen, excluded.last_seen),
+            'confidence': func.greatest(table.c.confidence, excluded.confidence),
+            'source': func.coalesce(excluded.source, table.c.source),
+        },
+    ).returning(
+        table.c.id, table.c.type, func.coalesce(table.c.normalized_value, table.c.value),
+        literal_column('(xmax = 0)').label('inserted'),
+    )
+
+
+def upsert_iocs(rows, created=None):
+    """Upsert a batch of validated rows in one statement.
+
+    Rows are deduplicated on their normalized value: rows sharing one are
+    merged first, since PostgreSQL refuses to touch the same row twice within
+    a single INSERT ... ON CONFLICT, and the upsert conflicts on the unique
+    normalized_value, so a value stored under another spelling (even by a
+    concurrent writer) is merged into that row. Rows whose raw value is
+    stored on a row normalize_iocs.py has not normalized yet conflict on
+    `value` instead.
+    Returns (inserted, updated); (id, type, coalesce(normalized_value, value)) of each
+    inserted row, as the IOC index knows it, is appended to `created` when given.
+    """
+    merged = {}
+    for row in rows:
+        normalized = row.get('normalized_value') or normalize_value(row['value'], row['type'])
+        if normalized in merged:
+            _merge_rows(merged[normalized], row)
+        else:
+            merged[normalized] = dict(row, normalized_value=normalized)
+    if not merged:
+        return 0, 0
+
+    unnormalized = set(db.session.execute(
+        select(IOC.value).where(
+            IOC.value.in_([row['value'] for row in merged.values()]),
+            IOC.normalized_value.is_(None),
+        )
+    ).scalars())
+    by_value = [row for row in merged.values() if row['value'] in unnormalized]
+    by_normalized = [row for row in merged.values() if row['value'] not in unnormalized]
+
+    result = []
+    if by_normalized:
+        result += db.session.execute(_upsert(by_normalized, IOC.__table__.c.normalized_value)).all()
+    if by_value:
+        result += db.session.execute(_upsert(by_value, IOC.__table__.c.value)).all()
+    inserted = 0
+    for ioc_id, ioc_type, value, is_new in result:
+        if is_new:
+            inserted += 1
+            if created is not None:
+                created.append((ioc_id, ioc_type, value))
+    return inserted, len(result) - inserted
+
+
+def iter_json_items(payload):
+    """(index, item) pairs from a parsed JSON body.
+
+    Not a generator, so a body of the wrong shape raises IOCValidationError
+    here, at the call, rather than on the first iteration.
+    """
+    if isinstance(payload, dict):
+        payload = payload.get('iocs')
+    if not isinstance(payload, list):
+        raise IOCValidationError('expected a JSON array of IOCs')
+    return enumerate(payload)
+
+
+def iter_ndjson_items(stream):
+    """Yield (index, item) pairs from an NDJSON byte stream, line by line."""
+    index = 0
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield index, json.loads(line)
+        except ValueError as e:
+            yield index, IOCValidationError(f'invalid JSON: {e}')
+        index += 1
@@ -0,0 +1,377 @@
+"""Compact binary IOC snapshot for sensors that mmap it and binary-search it.
+
+Layout (little-endian unless noted, every section 8-byte aligned):
+
+    header    8s magic b'KLEVIOC1' | u32 format | u32 sections | u64 version | u64 created (unix)
+    section   8s name | u32 record size | u32 reserved | u64 offset | u64 records   (x sections)
+
+Sections, all sorted so a lookup is one binary search:
+
+    md5 sha1 sha256 sha512   raw digest | u32 ioc id
+    ipv4                     u32 first | u32 last | u32 ioc id | u8 prefixlen | 3 pad
+    ipv6                     16s first | 16s last (big-endian) | u32 ioc id | u8 prefixlen | 3 pad
+    domain url               u32 offset | u32 length | u32 ioc id, ordered by the bytes they point to
+    strings                  UTF-8 blob the domain/url records point into (record size 1)
+
+IP intervals do not overlap: nested networks are flattened so each address
+range maps to its most specific IOC. Values come from
+iocs.normalized_value, so sensors compare against canonical spellings
+(lowercase hashes and hosts, compressed IPv6). A host matches a domain IOC
+if it, or one of its parent domains, is in `domain`.
+
+`build_snapshot` writes iocs-<version>.snap plus a .json sidecar holding
+the sha256 (the HTTP ETag) and counts; `start_build` runs it in a
+background thread, one build at a time per process. `IOCSnapshot` is a
+reference reader.
+"""
+import hashlib
+import ipaddress
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from .domaintrie import DOMAIN_TYPES, split_domain
+from .iptrie import parse_network
+from .jsonprovider import dumps_bytes, loads
+from .models import db, IOC
+
+MAGIC = b'KLEVIOC1'
+FORMAT = 1
+HEADER = struct.Struct('<8sIIQQ')
+SECTION = struct.Struct('<8sIIQQ')
+IPV4_RECORD = struct.Struct('<IIIB3x')
+IPV6_RECORD = struct.Struct('<16s16sIB3x')
+STRING_RECORD = struct.Struct('<III')
+ID = struct.Struct('<I')
+
+HASH_SECTIONS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+STRING_SECTIONS = ('domain', 'url')
+FETCH_SIZE = 20000
+
+_HEX = re.compile(r'^[0-9a-f]+$')
+
+_build_lock = threading.Lock()
+_building = None
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+# ---- building -----------------------------------------------------------------------------
+def _flatten(networks):
+    """Disjoint (first, last, ioc_id, prefixlen) ranges; the most specific network wins.
+
+    `networks` holds (first, last, prefixlen, ioc_id). CIDR blocks either nest
+    or are disjoint, so a stack of the enclosing blocks is enough.
+    """
+    best = {}
+    for first, last, prefixlen, ioc_id in networks:
+        key = (first, last)
+        if key not in best or ioc_id < best[key][1]:
+            best[key] = (prefixlen, ioc_id)
+    ordered = sorted((first, -last, prefixlen, ioc_id) for (first, last), (prefixlen, ioc_id) in best.items())
+
+    out = []
+
+    def emit(first, last, ioc_id, prefixlen):
+        if first > last:
+            return
+        if out and out[-1][2] == ioc_id and out[-1][1] + 1 == first:
+            out[-1] = (out[-1][0], last, ioc_id, prefixlen)
+        else:
+            out.append((first, last, ioc_id, prefixlen))
+
+    stack = []
+    cursor = 0
+    for first, neg_last, prefixlen, ioc_id in ordered:
+        last = -neg_last
+        while stack and stack[-1][0] < first:
+            end, top_id, top_len = stack.pop()
+            emit(cursor, end, top_id, top_len)
+            cursor = end + 1
+        if stack:
+            emit(cursor, first - 1, stack[-1][1], stack[-1][2])
+        cursor = first
+        stack.append((last, ioc_id, prefixlen))
+    while stack:
+        end, top_id, top_len = stack.pop()
+        emit(cursor, end, top_id, top_len)
+        cursor = end + 1
+    return out
+
+
+def _collect():
+    hashes = {name: {} for name in HASH_SECTIONS.values()}
+    networks = {4: [], 6: []}
+    strings = {name: {} for name in STRING_SECTIONS}
+    result = db.session.execute(
+        select(IOC.id, IOC.type, func.coalesce(IOC.normalized_value, IOC.value))
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+    for ioc_id, ioc_type, value in result:
+        if not value:
+            continue
+        if len(value) in HASH_SECTIONS and _HEX.match(value):
+            section, key = hashes[HASH_SECTIONS[len(value)]], bytes.fromhex(value)
+        elif '://' in value:
+            section, key = strings['url'], value
+        elif (net := parse_network(value)) is not None:
+            networks[net.version].append(
+                (int(net.network_address), int(net.broadcast_address), net.prefixlen, ioc_id)
+            )
+            continue
+        elif (ioc_type or '').lower() in DOMAIN_TYPES and (labels := split_domain(value)) is not None:
+            section, key = strings['domain'], '.'.join(reversed(labels))
+        else:
+            continue
+        section[key] = min(ioc_id, section.get(key, ioc_id))
+    return hashes, networks, strings
+
+
+def _sections(hashes, networks, strings):
+    """[(name, record size, records, payload bytes)] in file order."""
+    sections = []
+    for name in HASH_SECTIONS.values():
+        items = sorted(hashes[name].items())
+        size = len(items[0][0]) + ID.size if items else 0
+        sections.append((name, size, len(items), b''.join(d + ID.pack(i) for d, i in items)))
+
+    v4 = _flatten(networks[4])
+    sections.append(('ipv4', IPV4_RECORD.size, len(v4),
+                     b''.join(IPV4_RECORD.pack(a, b, i, p) for a, b, i, p in v4)))
+    v6 = _flatten(networks[6])
+    sections.append(('ipv6', IPV6_RECORD.size, len(v6),
+                     b''.join(IPV6_RECORD.pack(a.to_bytes(16, 'big'), b.to_bytes(16, 'big'), i, p)
+                              for a, b, i, p in v6)))
+
+    blob = bytearray()
+    for name in STRING_SECTIONS:
+        items = sorted((value.encode('utf-8'), ioc_id) for value, ioc_id in strings[name].items())
+        records = bytearray()
+        for encoded, ioc_id in items:
+            records += STRING_RECORD.pack(len(blob), len(encoded), ioc_id)
+            blob += encoded
+        sections.append((name, STRING_RECORD.size, len(items), bytes(records)))
+    sections.append(('strings', 1, len(blob), bytes(blob)))
+    return sections
+
+
+def _versions(directory):
+    found = []
+    for name in os.listdir(directory) if os.path.isdir(directory) else ():
+        if name.startswith('iocs-') and name.endswith('.snap'):
+            try:
+                found.append(int(name[5:-5]))
+            except ValueError:
+                pass
+    return sorted(found)
+
+
+def write_snapshot(path, sections, version):
+    """Write `sections` (see _sections) to `path` atomically; returns size, sha256 and counts."""
+    created = int(time.time())
+    table_end = HEADER.size + SECTION.size * len(sections)
+    offset = (table_end + 7) & ~7
+    entries, layout = [], []
+    for name, size, count, payload in sections:
+        entries.append(SECTION.pack(name.encode('ascii'), size, 0, offset, count))
+        layout.append((offset, payload))
+        offset = (offset + len(payload) + 7) & ~7
+
+    tmp = path + '.tmp'
+    digest = hashlib.sha256()
+    with open(tmp, 'wb') as f:
+        def write(data):
+            f.write(data)
+            digest.update(data)
+
+        write(HEADER.pack(MAGIC, FORMAT, len(sections), version, created) + b''.join(entries))
+        for section_offset, payload in layout:
+            write(b'\0' * (section_offset - f.tell()))
+            write(payload)
+        write(b'\0' * (offset - f.tell()))
+    os.replace(tmp, path)
+    return {
+        'version': version,
+        'format': FORMAT,
+        'created': created,
+        'bytes': offset,
+        'sha256': digest.hexdigest(),
+        'records': {name: count for name, _, count, _ in sections if name != 'strings'},
+    }
+
+
+def snapshot_path(directory, version):
+    return os.path.join(directory, f'iocs-{version}.snap')
+
+
+def next_version(directory):
+    existing = _versions(directory)
+    return max(int(time.time()), existing[-1] + 1 if existing else 0)
+
+
+def build_snapshot(directory, keep=5, version=None):
+    """Write a new snapshot of all IOCs into `directory`; returns its metadata."""
+    started = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    sections = _sections(*_collect())
+    db.session.close()
+
+    existing = _versions(directory)
+    if version is None:
+        version = next_version(directory)
+    path = snapshot_path(directory, version)
+    meta = write_snapshot(path, sections, version)
+    meta['build_seconds'] = round(time.perf_counter() - started, 2)
+    with open(path[:-5] + '.json', 'wb') as f:
+        f.write(dumps_bytes(meta))
+
+    for old in existing[:max(len(existing) + 1 - keep, 0)]:
+        for suffix in ('.snap', '.json'):
+            try:
+                os.remove(snapshot_path(directory, old)[:-5] + suffix)
+            except FileNotFoundError:
+                pass
+    return meta
+
+
+def start_build(app):
+    """Build a snapshot in a background thread of this process; returns (version, started).
+
+    While a build is running, its version is returned with started=False
+    instead of starting another one.
+    """
+    global _building
+    directory = app.config['IOC_SNAPSHOT_DIR']
+    with _build_lock:
+        if _building is not None:
+            return _building, False
+        _building = version = next_version(directory)
+
+    def _run():
+        global _building
+        with app.app_context():
+            try:
+                build_snapshot(directory, keep=app.config['IOC_SNAPSHOT_KEEP'], version=version)
+            except Exception as e:
+                print(f"Error building IOC snapshot: {e}")
+            finally:
+                db.session.remove()
+                with _build_lock:
+                    _building = None
+
+    threading.Thread(target=_run, name=f'ioc-snapshot-{version}', daemon=True).start()
+    return version, True
+
+
+def snapshot_meta(directory, version='latest'):
+    """Metadata of snapshot `version` ('latest' or an int), or None if there is none."""
+    if version == 'latest':
+        versions = _versions(directory)
+        if not versions:
+            return None
+        version = versions[-1]
+    try:
+        with open(snapshot_path(directory, version)[:-5] + '.json', 'rb') as f:
+            return loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+# ---- reading ------------------------------------------------------------------------------
+class IOCSnapshot:
+    """mmap-backed reader; every lookup is a binary search over one section."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, count, self.version, self.created = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise SnapshotError('not an IOC snapshot of a supported format')
+        self.sections = {}
+        for i in range(count):
+            name, size, _, offset, records = SECTION.unpack_from(self.buf, HEADER.size + i * SECTION.size)
+            self.sections[name.rstrip(b'\0').decode('ascii')] = (offset, size, records)
+
+    def close(self):
+        self.buf.close()
+
+    def _search(self, section, key_of, key):
+        """Index of the last record whose key is <= `key`, or -1."""
+        offset, size, records = self.sections[section]
+        lo, hi = 0, records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key_of(offset + mid * size) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def lookup_hash(self, value):
+        """IOC id for a hex digest, or None."""
+        name = HASH_SECTIONS.get(len(value))
+        if name is None or name not in self.sections:
+            return None
+        digest = bytes.fromhex(value)
+        offset, size, _ = self.sections[name]
+        width = size - ID.size
+        buf = self.buf
+        i = self._search(name, lambda at: buf[at:at + width], digest)
+        if i >= 0 and buf[offset + i * size:offset + i * size + width] == digest:
+            return ID.unpack_from(buf, offset + i * size + width)[0]
+        return None
+
+    def lookup_ip(self, address):
+        """(ioc id, prefixlen) of the most specific network holding `address`, or None."""
+        addr = ipaddress.ip_address(address)
+        buf = self.buf
+        if addr.version == 4:
+            name, record, key = 'ipv4', IPV4_RECORD, int(addr)
+            key_of = lambda at: ID.unpack_from(buf, at)[0]  # noqa: E731
+        else:
+            name, record, key = 'ipv6', IPV6_RECORD, addr.packed
+            key_of = lambda at: buf[at:at + 16]  # noqa: E731
+        i = self._search(name, key_of, key)
+        if i < 0:
+            return None
+        offset, size, _ = self.sections[name]
+        first, last, ioc_id, prefixlen = record.unpack_from(buf, offset + i * size)
+        return (ioc_id, prefixlen) if key <= last else None
+
+    def _lookup_string(self, name, value):
+        encoded = value.encode('utf-8')
+        blob = self.sections['strings'][0]
+        buf = self.buf
+
+        def key_of(at):
+            start, length, _ = STRING_RECORD.unpack_from(buf, at)
+            return buf[blob + start:blob + start + length]
+
+        i = self._search(name, key_of, encoded)
+        offset, size, _ = self.sections[name]
+        if i >= 0 and key_of(offset + i * size) == encoded:
+            return STRING_RECORD.unpack_from(buf, offset + i * size)[2]
+        return None
+
+    def lookup_url(self, url):
+        return self._lookup_string('url', url)
+
+    def match_domain(self, hostname):
+        """IOC ids of `hostname` and each listed parent domain, most specific first."""
+        labels = split_domain(hostname)
+        if labels is None:
+            return []
+        found = []
+        for depth in range(len(labels), 0, -1):
+            ioc_id = self._lookup_string('domain', '.'.join(reversed(labels[:depth])))
+            if ioc_id is not None:
+                found.append(ioc_id)
+        return found
+
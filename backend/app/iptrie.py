@@ -0,0 +1,175 @@
+"""Longest-prefix matching of IP addresses against IP and CIDR IOCs.
+
+PatriciaTrie is a path-compressed binary trie over W-bit integers (32 for
+IPv4, 128 for IPv6). Every node stores its prefix and length, and there
+are nodes only where stored prefixes branch or end. A lookup therefore
+visits a handful of nodes, not one per bit. A plain address is stored as
+a /32 (or /128), so an exact IP IOC and a covering CIDR IOC live in the
+same trie and the deepest node on the path is the most specific match.
+
+CIDRMatcher is the IOC index engine around two tries; see ioc_index.
+"""
+import ipaddress
+import re
+import socket
+
+# cheap filter before ipaddress sees a value: digits, hex, dots, colons, /len
+_IP_LIKE = re.compile(r'^[0-9a-fA-F:.]+(?:/\d{1,3})?$')
+
+
+class _Node:
+    __slots__ = ('prefix', 'length', 'iocs', 'children')
+
+    def __init__(self, prefix, length, iocs=None):
+        self.prefix = prefix
+        self.length = length
+        self.iocs = iocs
+        self.children = [None, None]
+
+
+class PatriciaTrie:
+    def __init__(self, width):
+        self.width = width
+        self.root = _Node(0, 0)
+        self.prefixes = 0
+
+    def _mask(self, key, length):
+        shift = self.width - length
+        return (key >> shift) << shift if length else 0
+
+    def _bit(self, key, position):
+        return (key >> (self.width - 1 - position)) & 1
+
+    def insert(self, key, length, ioc_id, payload):
+        """Store `ioc_id` under prefix key/length; False if it was already there."""
+        width = self.width
+        key = self._mask(key, length)
+        node = self.root
+        while True:
+            if length == node.length:
+                if node.iocs is None:
+                    node.iocs = {}
+                    self.prefixes += 1
+                new = ioc_id not in node.iocs
+                node.iocs[ioc_id] = payload
+                return new
+            bit = self._bit(key, node.length)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(key, length, {ioc_id: payload})
+                self.prefixes += 1
+                return True
+            diff = key ^ child.prefix
+            common = min(length, child.length, width - diff.bit_length() if diff else width)
+            if common == child.length:
+                node = child
+                continue
+            # split the edge to `child` at the first differing bit; the new
+            # node is complete before it is linked in, so readers never see
+            # a half-built subtree
+            mid = _Node(self._mask(key, common), common)
+            mid.children[self._bit(child.prefix, common)] = child
+            if common == length:
+                mid.iocs = {ioc_id: payload}
+            else:
+                mid.children[self._bit(key, common)] = _Node(key, length, {ioc_id: payload})
+            self.prefixes += 1
+            node.children[bit] = mid
+            return True
+
+    def remove(self, key, length, ioc_id):
+        """Drop `ioc_id` from the prefix; emptied nodes stay as plain branch points.
+
+        Returns whether it was there.
+        """
+        key = self._mask(key, length)
+        node = self.root
+        while node is not None and node.length <= length:
+            if node.length == length:
+                if node.prefix == key and node.iocs and node.iocs.pop(ioc_id, None) is not None:
+                    if not node.iocs:
+                        node.iocs = None
+                        self.prefixes -= 1
+                    return True
+                return False
+            node = node.children[self._bit(key, node.length)]
+        return False
+
+    def longest_match(self, addr):
+        """Deepest node with IOCs whose prefix covers `addr`, or None."""
+        width = self.width
+        best = None
+        node = self.root
+        while node is not None:
+            length = node.length
+            if length and (addr ^ node.prefix) >> (width - length):
+                break
+            if node.iocs:
+                best = node
+            if length == width:
+                break
+            node = node.children[(addr >> (width - 1 - length)) & 1]
+        return best
+
+
+def parse_address(text):
+    """(4 | 6, int) for an IPv4/IPv6 address string, or None."""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, text), 'big')
+    except (OSError, TypeError):
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, text), 'big')
+    except (OSError, TypeError):
+        return None
+
+
+def parse_network(value):
+    """ip_network for an IP or CIDR IOC value, or None."""
+    value = value.strip() if isinstance(value, str) else ''
+    if not _IP_LIKE.match(value):
+        return None
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
+
+
+class CIDRMatcher:
+    def __init__(self):
+        self.tries = {4: PatriciaTrie(32), 6: PatriciaTrie(128)}
+        self.iocs = 0
+
+    def add(self, ioc_id, ioc_type, value):
+        net = parse_network(value)
+        if net is not None and self.tries[net.version].insert(
+            int(net.network_address), net.prefixlen, ioc_id, (ioc_type, value)
+        ):
+            self.iocs += 1
+
+    def remove(self, ioc_id, ioc_type, value):
+        net = parse_network(value)
+        if net is not None and self.tries[net.version].remove(int(net.network_address), net.prefixlen, ioc_id):
+            self.iocs -= 1
+
+    def finish(self):
+        pass
+
+    def match(self, address):
+        """Most specific IOC covering `address`: (ioc_id, type, value, prefixlen), None, or False if invalid."""
+        parsed = parse_address(address)
+        if parsed is None:
+            return False
+        node = self.tries[parsed[0]].longest_match(parsed[1])
+        if node is None:
+            return None
+        ioc_id = min(node.iocs)
+        ioc_type, value = node.iocs[ioc_id]
+        return ioc_id, ioc_type, value, node.length
+
+    def stats(self):
+        return {
+            'iocs': self.iocs,
+            'ipv4_prefixes': self.tries[4].prefixes,
+            'ipv6_prefixes': self.tries[6].prefixes,
+        }
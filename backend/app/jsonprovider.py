@@ -0,0 +1,73 @@
+"""JSON provider used by jsonify(): orjson when installed, stdlib otherwise.
+
+Both paths write dates and datetimes as ISO 8601 and Decimals as strings,
+so endpoints can hand over raw column values (see projection.row_to_dict)
+instead of formatting every field in Python first.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+def _default(o):
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return str(o)
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if isinstance(o, UUID):
+        return str(o)
+    if isinstance(o, bytes):
+        return o.decode('utf-8', 'replace')
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def dumps_bytes(obj):
+    """Compact UTF-8 JSON for `obj`."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps(obj):
+    return dumps_bytes(obj).decode('utf-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    backend = 'orjson' if orjson else 'json'
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # explicit options (indent, sort_keys, ...) only the stdlib understands
+            kwargs.setdefault('default', _default)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            # pretty-printed output for debugging goes through the stdlib
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
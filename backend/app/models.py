@@ -1,64 +1,91 @@
+from datetime import datetime, timezone
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR
 
 # Создаем экземпляр SQLAlchemy, который будет использоваться во всем приложении
 db = SQLAlchemy()
 
+# Поиск опирается на pg_trgm и на IMMUTABLE-обертку над array_to_string
+# (сама array_to_string только STABLE и не годится для generated-колонок).
+# Создаем их до таблиц, чтобы create_all работал на чистой базе.
+event.listen(db.metadata, 'before_create', DDL(
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+).execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_create', DDL(
+    "CREATE OR REPLACE FUNCTION klev_array_text(arr text[]) RETURNS text "
+    "LANGUAGE sql IMMUTABLE AS $$ SELECT coalesce(array_to_string(arr, ' '), '') $$"
+).execute_if(dialect='postgresql'))
+
 # =====================================
 # Промежуточные таблицы для связей "многие-ко-многим"
 # =====================================
 # Эти таблицы не являются классами, так как они не содержат собственных данных,
 # кроме внешних ключей. SQLAlchemy использует их для построения связей.
+# Первичный ключ покрывает поиск по первой колонке, отдельный индекс по второй
+# нужен для обхода связей в обратную сторону (граф связей, /api/graph).
 
 apt_malware = db.Table('apt_malware',
     db.Column('apt_id', db.Integer, db.ForeignKey('apt_groups.id'), primary_key=True),
-    db.Column('malware_id', db.Integer, db.ForeignKey('malware.id'), primary_key=True)
+    db.Column('malware_id', db.Integer, db.ForeignKey('malware.id'), primary_key=True),
+    db.Index('ix_apt_malware_malware_id', 'malware_id')
 )
 
 malware_ioc = db.Table('malware_ioc',
     db.Column('malware_id', db.Integer, db.ForeignKey('malware.id'), primary_key=True),
-    db.Column('ioc_id', db.Integer, db.ForeignKey('iocs.id'), primary_key=True)
+    db.Column('ioc_id', db.Integer, db.ForeignKey('iocs.id'), primary_key=True),
+    db.Index('ix_malware_ioc_ioc_id', 'ioc_id')
 )
 
 report_apt = db.Table('report_apt',
     db.Column('report_id', db.Integer, db.ForeignKey('reports.id'), primary_key=True),
-    db.Column('apt_id', db.Integer, db.ForeignKey('apt_groups.id'), primary_key=True)
+    db.Column('apt_id', db.Integer, db.ForeignKey('apt_groups.id'), primary_key=True),
+    db.Index('ix_report_apt_apt_id', 'apt_id')
 )
 
 report_malware = db.Table('report_malware',
     db.Column('report_id', db.Integer, db.ForeignKey('reports.id'), primary_key=True),
-    db.Column('malware_id', db.Integer, db.ForeignKey('malware.id'), primary_key=True)
+    db.Column('malware_id', db.Integer, db.ForeignKey('malware.id'), primary_key=True),
+    db.Index('ix_report_malware_malware_id', 'malware_id')
 )
 
 report_ioc = db.Table('report_ioc',
     db.Column('report_id', db.Integer, db.ForeignKey('reports.id'), primary_key=True),
-    db.Column('ioc_id', db.Integer, db.ForeignKey('iocs.id'), primary_key=True)
+    db.Column('ioc_id', db.Integer, db.ForeignKey('iocs.id'), primary_key=True),
+    db.Index('ix_report_ioc_ioc_id', 'ioc_id')
 )
 
 campaign_apt = db.Table('campaign_apt',
     db.Column('campaign_id', db.Integer, db.ForeignKey('campaigns.id'), primary_key=True),
-    db.Column('apt_id', db.Integer, db.ForeignKey('apt_groups.id'), primary_key=True)
+    db.Column('apt_id', db.Integer, db.ForeignKey('apt_groups.id'), primary_key=True),
+    db.Index('ix_campaign_apt_apt_id', 'apt_id')
 )
 
 campaign_malware = db.Table('campaign_malware',
     db.Column('campaign_id', db.Integer, db.ForeignKey('campaigns.id'), primary_key=True),
-    db.Column('malware_id', db.Integer, db.ForeignKey('malware.id'), primary_key=True)
+    db.Column('malware_id', db.Integer, db.ForeignKey('malware.id'), primary_key=True),
+    db.Index('ix_campaign_malware_malware_id', 'malware_id')
 )
 
 campaign_reports = db.Table('campaign_reports',
     db.Column('campaign_id', db.Integer, db.ForeignKey('campaigns.id'), primary_key=True),
-    db.Column('report_id', db.Integer, db.ForeignKey('reports.id'), primary_key=True)
+    db.Column('report_id', db.Integer, db.ForeignKey('reports.id'), primary_key=True),
+    db.Index('ix_campaign_reports_report_id', 'report_id')
 )
 
 malware_vuln = db.Table('malware_vuln',
     db.Column('malware_id', db.Integer, db.ForeignKey('malware.id'), primary_key=True),
-    db.Column('vuln_id', db.Integer, db.ForeignKey('vulnerabilities.id'), primary_key=True)
+    db.Column('vuln_id', db.Integer, db.ForeignKey('vulnerabilities.id'), primary_key=True),
+    db.Index('ix_malware_vuln_vuln_id', 'vuln_id')
 )
 
 apt_vuln = db.Table('apt_vuln',
     db.Column('apt_id', db.Integer, db.ForeignKey('apt_groups.id'), primary_key=True),
-    db.Column('vuln_id', db.Integer, db.ForeignKey('vulnerabilities.id'), primary_key=True)
+    db.Column('vuln_id', db.Integer, db.ForeignKey('vulnerabilities.id'), primary_key=True),
+    db.Index('ix_apt_vuln_vuln_id', 'vuln_id')
 )
 
 # =====================================
@@ -67,6 +94,9 @@ apt_vuln = db.Table('apt_vuln',
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), unique=True, nullable=False)
     email = db.Column(db.String(150), unique=True, nullable=False)
@@ -94,6 +124,12 @@ class User(db.Model):
 
 class APTGroup(db.Model):
     __tablename__ = 'apt_groups'
+    __table_args__ = (
+        db.Index('ix_apt_groups_created_at_id', 'created_at', 'id'),
+        db.Index('ix_apt_groups_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_apt_groups_search_vector', 'search_vector', postgresql_using='gin'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), unique=True, nullable=False)
     aliases = db.Column(ARRAY(db.Text))
@@ -104,6 +140,15 @@ class APTGroup(db.Model):
     mitre_attack_id = db.Column(db.String(50))
     sources = db.Column(ARRAY(db.Text))
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    search_vector = deferred(db.Column(TSVECTOR, db.Computed(
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', klev_array_text(aliases)), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'C')",
+        persisted=True,
+    )))
+
+    API_FIELDS = ('id', 'name', 'aliases', 'country', 'description', 'first_seen', 'last_seen',
+                  'mitre_attack_id', 'sources')
 
     def to_dict(self):
         return {
@@ -120,6 +165,13 @@ class APTGroup(db.Model):
 
 class Malware(db.Model):
     __tablename__ = 'malware'
+    __table_args__ = (
+        db.Index('ix_malware_created_at_id', 'created_at', 'id'),
+        db.Index('ix_malware_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_malware_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_malware_hashes', 'hashes', postgresql_using='gin'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), unique=True, nullable=False)
     type = db.Column(db.String(100))
@@ -131,6 +183,15 @@ class Malware(db.Model):
     capabilities = db.Column(ARRAY(db.Text))
     sources = db.Column(ARRAY(db.Text))
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    search_vector = deferred(db.Column(TSVECTOR, db.Computed(
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(family, '') || ' ' || coalesce(type, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'C')",
+        persisted=True,
+    )))
+
+    API_FIELDS = ('id', 'name', 'type', 'family', 'description', 'first_seen', 'last_seen',
+                  'hashes', 'capabilities', 'sources')
 
     def to_dict(self):
         return {
@@ -148,16 +209,31 @@ class Malware(db.Model):
 
 class Report(db.Model):
     __tablename__ = 'reports'
+    __table_args__ = (
+        db.Index('ix_reports_created_at_id', 'created_at', 'id'),
+        db.Index('ix_reports_title_trgm', 'title', postgresql_using='gin',
+                 postgresql_ops={'title': 'gin_trgm_ops'}),
+        db.Index('ix_reports_search_vector', 'search_vector', postgresql_using='gin'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.Text, nullable=False)
     author = db.Column(db.String(150))
     source_url = db.Column(db.Text)
     publication_date = db.Column(db.Date)
     summary = db.Column(db.Text)
-    full_text = db.Column(db.Text)
+    full_text = deferred(db.Column(db.Text))  # loaded only when accessed
     status = db.Column(db.String(50), default='In Process')
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    search_vector = deferred(db.Column(TSVECTOR, db.Computed(
+        "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(summary, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(full_text, '')), 'C')",
+        persisted=True,
+    )))
+
+    API_FIELDS = ('id', 'title', 'author', 'source_url', 'publication_date', 'summary', 'status', 'user_id')
+    API_OPTIONAL_FIELDS = ('full_text', 'created_at')
 
     def to_dict(self):
         return {
@@ -173,20 +249,34 @@ class Report(db.Model):
 
 class IOC(db.Model):
     __tablename__ = 'iocs'
+    __table_args__ = (
+        db.Index('ix_iocs_created_at_id', 'created_at', 'id'),
+        db.Index('ix_iocs_value_trgm', 'value', postgresql_using='gin',
+                 postgresql_ops={'value': 'gin_trgm_ops'}),
+        db.Index('iocs_normalized_value_key', 'normalized_value', unique=True,
+                 postgresql_where=db.text('normalized_value IS NOT NULL')),
+        db.Index('ix_iocs_lookup_value', db.text('coalesce(normalized_value, value)')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(50))
     value = db.Column(db.Text, unique=True, nullable=False)
+    # canonical spelling (app.normalize); upserts conflict on it, lookups compare
+    # coalesce(normalized_value, value) until normalize_iocs.py has filled every row
+    normalized_value = db.Column(db.Text)
     first_seen = db.Column(db.Date)
     last_seen = db.Column(db.Date)
     confidence = db.Column(db.Integer)
     source = db.Column(db.Text)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
+    API_FIELDS = ('id', 'type', 'value', 'normalized_value', 'first_seen', 'last_seen', 'confidence', 'source')
+
     def to_dict(self):
         return {
             'id': self.id,
             'type': self.type,
             'value': self.value,
+            'normalized_value': self.normalized_value,
             'first_seen': self.first_seen.isoformat() if self.first_seen else None,
             'last_seen': self.last_seen.isoformat() if self.last_seen else None,
             'confidence': self.confidence,
@@ -240,14 +330,22 @@ class SigmaRule(db.Model):
     """Simple storage for Sigma rules (YAML content)."""
 
     __tablename__ = 'sigma_rules'
+    __table_args__ = (
+        db.Index('ix_sigma_rules_created_at_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     filename = db.Column(db.String(255))
     content = db.Column(db.Text, nullable=False)
+    content_hash = db.Column(db.String(64), unique=True)  # sha256 of content, used to dedupe
+    parsed = deferred(db.Column(JSONB))  # validated rule as JSON, see sigma.parse_rule
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
+    API_FIELDS = ('id', 'name', 'description', 'filename', 'created_at')
+    API_OPTIONAL_FIELDS = ('content',)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -264,7 +362,8 @@ class UserProfile(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), unique=True, nullable=False)
     job_title = db.Column(db.String(120), default='Analyst')
     plan = db.Column(db.String(20), default='free')  # free / pro
-    avatar = db.Column(db.Text)  # Base64 encoded image
+    avatar = deferred(db.Column(db.Text))  # legacy base64 image, superseded by avatar_hash
+    avatar_hash = db.Column(db.String(64))  # key into avatar_blobs
 
     user = db.relationship('User', back_populates='profile')
 
@@ -272,13 +371,16 @@ class UserProfile(db.Model):
         return {
             'job_title': self.job_title,
             'plan': self.plan,
-            'avatar': self.avatar,
+            'avatar': f'/api/avatars/{self.avatar_hash}' if self.avatar_hash else None,
         }
 
 
 class Alert(db.Model):
     """Model for storing system alerts/notifications"""
     __tablename__ = 'alerts'
+    __table_args__ = (
+        db.Index('ix_alerts_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(50), nullable=False)  # 'report', 'sigma', 'threat'
@@ -286,6 +388,9 @@ class Alert(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     username = db.Column(db.String(100))
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+    API_FIELDS = ('id', 'type', 'message', 'user_id', 'username', 'created_at')
+    API_OPTIONAL_FIELDS = ()
     
     def to_dict(self):
         return {
@@ -297,3 +402,107 @@ class Alert(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+
+
+class MonthlyStat(db.Model):
+    """Per-entity row counts by month, kept in step with inserts/deletes"""
+    __tablename__ = 'monthly_stats'
+
+    entity = db.Column(db.String(50), primary_key=True)  # 'malware', 'iocs', 'reports'
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class EntityCounter(db.Model):
+    """Running row count per entity for /api/stats/metrics"""
+    __tablename__ = 'entity_counters'
+
+    entity = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime(timezone=True))
+
+
+class VTCacheEntry(db.Model):
+    """Processed VirusTotal lookup results keyed by normalized indicator"""
+    __tablename__ = 'vt_cache'
+
+    indicator = db.Column(db.Text, primary_key=True)
+    status = db.Column(db.SmallInteger, nullable=False)  # 200 found / 404 not found
+    payload = db.Column(JSONB, nullable=False)
+    fetched_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+
+class AvatarBlob(db.Model):
+    """Avatar thumbnails, content-addressed by SHA-256 of the uploaded image"""
+    __tablename__ = 'avatar_blobs'
+
+    hash = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.SmallInteger, primary_key=True)  # edge length in px
+    content_type = db.Column(db.String(50), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+
+class RetroHunt(db.Model):
+    """Sigma retro-hunt over local JSONL log files"""
+    __tablename__ = 'retro_hunts'
+    __table_args__ = (
+        db.Index('ix_retro_hunts_created_at_id', 'created_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.Text, nullable=False)
+    logsource = db.Column(JSONB)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued/running/done/failed/cancelled
+    rules = db.Column(db.Integer)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    processed_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    events = db.Column(db.BigInteger, nullable=False, default=0)
+    hits = db.Column(db.BigInteger, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    started_at = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
+
+    def to_dict(self):
+        elapsed = None
+        if self.started_at:
+            end = self.finished_at or datetime.now(timezone.utc)
+            elapsed = max((end - self.started_at).total_seconds(), 0.0)
+        return {
+            'id': self.id,
+            'path': self.path,
+            'logsource': self.logsource,
+            'status': self.status,
+            'rules': self.rules,
+            'total_bytes': self.total_bytes,
+            'processed_bytes': self.processed_bytes,
+            'progress': round(self.processed_bytes / self.total_bytes, 4) if self.total_bytes else None,
+            'events': self.events,
+            'hits': self.hits,
+            'elapsed_seconds': round(elapsed, 1) if elapsed is not None else None,
+            'events_per_second': round(self.events / elapsed) if elapsed else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class RetroHuntHit(db.Model):
+    """One rule match found by a retro-hunt"""
+    __tablename__ = 'retro_hunt_hits'
+    __table_args__ = (
+        db.Index('ix_retro_hunt_hits_hunt_id_created_at_id', 'hunt_id', 'created_at', 'id'),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    hunt_id = db.Column(db.Integer, db.ForeignKey('retro_hunts.id', ondelete='CASCADE'), nullable=False)
+    rule_id = db.Column(db.Integer, nullable=False)
+    file = db.Column(db.Text, nullable=False)
+    line_offset = db.Column(db.BigInteger, nullable=False)  # byte offset of the line (uncompressed)
+    event = db.Column(JSONB)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+    API_FIELDS = ('id', 'hunt_id', 'rule_id', 'file', 'line_offset', 'event')
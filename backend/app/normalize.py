@@ -0,0 +1,256 @@
+"""Canonical form of IOC values, stored in `iocs.normalized_value`.
+
+`normalize_value` refangs the value (hxxp://, evil[.]com), then puts it in
+one canonical spelling by shape, whatever the IOC type says:
+IP addresses and networks via ipaddress (compressed IPv6, host networks as
+plain addresses), hashes and domains lowercased without a trailing dot,
+URLs with lowercased scheme and host, no default port, "/" for an empty
+path and no fragment. Anything else, and values of types that are not
+network indicators (file names, mutexes, registry keys...), is only stripped.
+
+The column is unique (iocs_normalized_value_key), and upserts conflict on
+it. Lookups and search compare LOOKUP_VALUE, i.e. coalesce(normalized_value,
+value), so rows written before the column existed keep matching by their
+raw value until `backfill` has normalized them. Rows whose normalized value
+another row already holds stay NULL; `merge_duplicates` folds them into
+that row.
+"""
+import ipaddress
+import re
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+from sqlalchemy import delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .graph_index import index as graph_index, publish_events as publish_graph_events
+from .ioc_index import index as ioc_index, index_value, publish_events as publish_ioc_events, publish_reload
+from .models import db, IOC, malware_ioc, report_ioc
+from .rollups import track_delete
+
+_REFANG = (
+    (re.compile(r'\bhxxp', re.IGNORECASE), 'http'),
+    (re.compile(r'\[:\]//|\[://\]'), '://'),
+    (re.compile(r'\[\.\]|\(\.\)|\{\.\}|\[dot\]', re.IGNORECASE), '.'),
+)
+
+_HASH = re.compile(r'^(?:[0-9a-fA-F]{32}|[0-9a-fA-F]{40}|[0-9a-fA-F]{64}|[0-9a-fA-F]{128})$')
+_IP_LIKE = re.compile(r'^[0-9a-fA-F:.]+(?:/\d{1,3})?$')
+_DOMAIN = re.compile(r'^\*?\.?(?:[\w-]+\.)+[\w-]+\.?$')
+_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+$')
+_DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+# case and dots are meaningful (or at least not ours to fold) in these
+VERBATIM_TYPES = frozenset((
+    'filename', 'file', 'filepath', 'path', 'mutex', 'registry', 'regkey',
+    'user-agent', 'useragent', 'yara', 'text',
+))
+
+BATCH_SIZE = 5000
+
+
+def refang(text):
+    for pattern, replacement in _REFANG:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _normalize_host(host):
+    host = host.lower().rstrip('.')
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        return host
+
+
+def _normalize_url(value):
+    try:
+        parts = urlsplit(value)
+        port = parts.port
+    except ValueError:
+        return value
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if host:
+        try:
+            host = ipaddress.ip_address(host).compressed
+            if ':' in host:
+                host = f'[{host}]'
+        except ValueError:
+            host = _normalize_host(host)
+    netloc = host
+    if port is not None and port != _DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    if parts.username is not None:
+        userinfo = parts.username + (f':{parts.password}' if parts.password is not None else '')
+        netloc = f'{userinfo}@{netloc}'
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def normalize_value(value, ioc_type=None):
+    """Canonical spelling of an IOC value (see the module docstring)."""
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if not value or (ioc_type or '').strip().lower() in VERBATIM_TYPES:
+        return value
+    value = refang(value)
+
+    if _IP_LIKE.match(value):
+        try:
+            net = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            pass
+        else:
+            if net.prefixlen == net.max_prefixlen:
+                return net.network_address.compressed
+            return net.compressed
+    if _HASH.match(value):
+        return value.lower()
+    if '://' in value:
+        return _normalize_url(value)
+    if _EMAIL.match(value):
+        local, _, domain = value.rpartition('@')
+        return f'{local.lower()}@{_normalize_host(domain)}'
+    if _DOMAIN.match(value):
+        return _normalize_host(value)
+    return value
+
+
+# ---- existing rows ------------------------------------------------------------------------
+# what lookups compare: rows normalize_iocs.py has not reached yet still match by their raw value
+LOOKUP_VALUE = func.coalesce(IOC.normalized_value, IOC.value)
+
+
+def _holders(values):
+    """{normalized value: id of the row holding it} for `values`."""
+    return dict(db.session.execute(
+        select(IOC.normalized_value, IOC.id).where(IOC.normalized_value.in_(values))
+    ).all())
+
+
+def backfill(only_missing=True, batch_size=BATCH_SIZE, on_batch=None):
+    """Compute normalized_value for existing rows, in keyset batches of `batch_size` ids.
+
+    A row whose normalized value is already held by another row is left
+    (or set back to) NULL and counted as a duplicate for merge_duplicates.
+    """
+    started = time.perf_counter()
+    stats = {'scanned': 0, 'updated': 0, 'duplicates': 0}
+    last_id = 0
+    while True:
+        query = select(IOC.id, IOC.type, IOC.value, IOC.normalized_value).where(IOC.id > last_id)
+        if only_missing:
+            query = query.where(IOC.normalized_value.is_(None))
+        rows = db.session.execute(query.order_by(IOC.id).limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        computed = {
+            row.id: (normalized, row.normalized_value)
+            for row in rows
+            if (normalized := normalize_value(row.value, row.type)) and normalized != row.normalized_value
+        }
+        holders = _holders({normalized for normalized, _ in computed.values()}) if computed else {}
+        changes = []
+        for ioc_id, (normalized, current) in computed.items():
+            holder = holders.setdefault(normalized, ioc_id)
+            if holder == ioc_id:
+                changes.append({'id': ioc_id, 'normalized_value': normalized})
+                continue
+            stats['duplicates'] += 1
+            if current is not None:
+                changes.append({'id': ioc_id, 'normalized_value': None})
+        if changes:
+            db.session.execute(update(IOC), changes)
+        db.session.commit()
+        stats['scanned'] += len(rows)
+        stats['updated'] += len(changes)
+        stats['elapsed_seconds'] = time.perf_counter() - started
+        if on_batch:
+            on_batch(stats)
+    if stats['updated']:
+        # the IOC index knows rows by their normalized value, which just changed
+        publish_reload(db.session)
+        db.session.commit()
+    stats['elapsed_seconds'] = time.perf_counter() - started
+    return stats
+
+
+def duplicate_groups(batch_size=BATCH_SIZE):
+    """[(normalized value, id of the row holding it, [ids of rows that normalize to it too])].
+
+    The duplicates are the rows backfill had to leave NULL because the
+    unique index already gives their normalized value to another row.
+    """
+    pending = {}
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(IOC.id, IOC.type, IOC.value)
+            .where(IOC.normalized_value.is_(None), IOC.id > last_id)
+            .order_by(IOC.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        for row in rows:
+            normalized = normalize_value(row.value, row.type)
+            if normalized:
+                pending.setdefault(normalized, []).append(row.id)
+
+    groups = []
+    values = list(pending)
+    for i in range(0, len(values), batch_size):
+        for normalized, holder in _holders(values[i:i + batch_size]).items():
+            groups.append((normalized, holder, pending[normalized]))
+    return groups
+
+
+def merge_duplicates(on_group=None):
+    """Fold every duplicate group into the row holding its value; returns (groups merged, rows deleted).
+
+    Links from reports and malware move to the kept row, and dates and
+    confidence are merged the way the bulk upsert merges them. The graph and
+    IOC indexes are told about the moved links and the deleted rows.
+    """
+    groups = deleted = 0
+    for _, keep, drop in duplicate_groups():
+        ids = [keep, *drop]
+        rows = db.session.execute(select(IOC).where(IOC.id.in_(ids)).with_for_update()).scalars().all()
+        kept = next(ioc for ioc in rows if ioc.id == keep)
+        removed = [ioc for ioc in rows if ioc.id != keep]
+        for ioc in removed:
+            for attr, pick in (('first_seen', min), ('last_seen', max), ('confidence', max)):
+                candidates = [v for v in (getattr(kept, attr), getattr(ioc, attr)) if v is not None]
+                setattr(kept, attr, pick(candidates) if candidates else None)
+            kept.source = kept.source or ioc.source
+
+        edge_events = []
+        for ioc_id in drop:
+            edge_events += graph_index.node_removal_events('ioc', ioc_id)
+        for edge_type, table, owner in (('report_ioc', report_ioc, 'report_id'),
+                                         ('malware_ioc', malware_ioc, 'malware_id')):
+            moved = db.session.execute(
+                pg_insert(table).from_select(
+                    [owner, 'ioc_id'],
+                    select(table.c[owner], literal(keep)).where(table.c.ioc_id.in_(drop)).distinct(),
+                ).on_conflict_do_nothing().returning(table.c[owner])
+            ).scalars().all()
+            edge_events += [('add', edge_type, owner_id, keep) for owner_id in moved]
+            db.session.execute(delete(table).where(table.c.ioc_id.in_(drop)))
+
+        ioc_events = [('remove', ioc.id, ioc.type, index_value(ioc)) for ioc in removed]
+        for ioc in removed:
+            track_delete('iocs', ioc.created_at)
+        db.session.execute(delete(IOC).where(IOC.id.in_(drop)))
+        publish_graph_events(db.session, edge_events)
+        publish_ioc_events(db.session, ioc_events)
+        db.session.commit()
+        graph_index.apply_events(edge_events)
+        ioc_index.apply_events(ioc_events)
+
+        groups += 1
+        deleted += len(drop)
+        if on_group:
+            on_group(groups, deleted)
+    return groups, deleted
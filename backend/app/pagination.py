@@ -0,0 +1,66 @@
+"""Keyset (cursor) pagination on (created_at, id) for collection endpoints."""
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app, jsonify, request
+from sqlalchemy import tuple_
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at, row_id):
+    payload = json.dumps([created_at.isoformat() if created_at else None, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise CursorError('invalid cursor')
+
+
+def page_size(default):
+    limit = request.args.get('limit', type=int) or default
+    return max(1, min(limit, current_app.config['PAGE_SIZE_MAX']))
+
+
+def paginate(query, model, default_size):
+    """Return one page of `query` newest-first and the cursor for the next one.
+
+    The WHERE (created_at, id) < cursor predicate walks the composite
+    (created_at, id) index, so deep pages cost the same as the first.
+    """
+    size = page_size(default_size)
+    cursor = request.args.get('cursor')
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(size + 1).all()
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+def page_response(items, next_cursor):
+    """Wrap a page for the client.
+
+    Callers that page explicitly (?cursor= or ?limit=) get
+    {"items": [...], "next_cursor": ...}; older clients keep receiving a bare
+    list. The cursor is always available in the X-Next-Cursor header.
+    """
+    if 'cursor' in request.args or 'limit' in request.args:
+        resp = jsonify({'items': items, 'next_cursor': next_cursor})
+    else:
+        resp = jsonify(items)
+    if next_cursor:
+        resp.headers['X-Next-Cursor'] = next_cursor
+    return resp
@@ -0,0 +1,38 @@
+"""Sparse fieldsets (?fields=a,b,c) rendered straight from column tuples.
+
+Collection endpoints SELECT only the requested columns (plus the id and
+created_at the cursor needs) and serialize the rows without building ORM
+instances. Without ?fields= the model's API_FIELDS are used, which match
+the keys of its to_dict(). Values go to jsonify() as they come out of the
+driver; app.jsonprovider formats dates and Decimals.
+"""
+from flask import request
+
+from .models import db
+
+
+class FieldsError(ValueError):
+    pass
+
+
+def requested_fields(model):
+    allowed = model.API_FIELDS + getattr(model, 'API_OPTIONAL_FIELDS', ('created_at',))
+    raw = request.args.get('fields')
+    if not raw:
+        return list(model.API_FIELDS)
+    fields = list(dict.fromkeys(f.strip() for f in raw.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in allowed]
+    if unknown or not fields:
+        raise FieldsError(f"unknown fields: {', '.join(unknown)}; allowed: {', '.join(allowed)}")
+    return fields
+
+
+def projected_query(model, fields):
+    columns = list(dict.fromkeys(fields + ['id', 'created_at']))
+    return db.session.query(*[getattr(model, c) for c in columns])
+
+
+def row_to_dict(row, fields):
+    # projected_query puts the requested fields first, in order; dates and
+    # Decimals are left as they are for the JSON provider to write out
+    return dict(zip(fields, row))
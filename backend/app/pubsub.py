@@ -0,0 +1,87 @@
+"""Cross-process change notifications over PostgreSQL LISTEN/NOTIFY.
+
+Writers queue a NOTIFY inside their transaction with `notify`; it is
+delivered to every worker process when the transaction commits. Each
+process runs a single listener thread that dispatches payloads to the
+callbacks registered with `listener.subscribe`. On other databases
+`notify` is a no-op and only in-process updates apply.
+"""
+import select
+import threading
+from collections import defaultdict
+
+from sqlalchemy import text
+
+
+def notify(session, channel, payload):
+    """Queue NOTIFY `channel` with `payload`; delivered when `session` commits."""
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                        {'channel': channel, 'payload': payload})
+
+
+class Listener:
+    def __init__(self):
+        self._callbacks = defaultdict(list)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._listening = set()
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            if callback not in self._callbacks[channel]:
+                self._callbacks[channel].append(callback)
+
+    def ensure_started(self, engine):
+        """Start the LISTEN thread once per process (PostgreSQL only)."""
+        if engine.dialect.name != 'postgresql':
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(engine,), name='pg-listener', daemon=True
+            )
+            self._thread.start()
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"Error handling {channel} notification: {e}")
+
+    def _run(self, engine):
+        while True:
+            raw = engine.raw_connection()
+            try:
+                conn = raw.driver_connection
+                conn.autocommit = True
+                self._listening = set()
+                while True:
+                    with self._lock:
+                        channels = set(self._callbacks) - self._listening
+                    if channels:
+                        with conn.cursor() as cur:
+                            for channel in channels:
+                                cur.execute(f'LISTEN "{channel}"')
+                        self._listening |= channels
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        self._dispatch(note.channel, note.payload)
+            except Exception as e:
+                print(f"Notification listener reconnecting: {e}")
+            finally:
+                try:
+                    raw.invalidate()
+                except Exception:
+                    pass
+            threading.Event().wait(5)
+
+
+listener = Listener()
@@ -0,0 +1,45 @@
+"""Per-request SQL statement counting, used to hold endpoints to a query budget.
+
+Every statement executed on the engine while an app context is active
+increments `g.query_count`. With QUERY_COUNT_HEADER enabled the total is
+returned in the X-Query-Count response header, so a test can assert, for
+example, that /api/admin/users stays at one query per page whatever the
+number of users.
+
+`enforce_budget` holds an endpoint to its budget: over it, the request
+fails when the app is testing (or QUERY_BUDGET_STRICT is set), so an N+1
+regression breaks the test suite, and is logged otherwise.
+"""
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+
+
+def query_count():
+    return g.get('query_count', 0) if has_app_context() else 0
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def enforce_budget(name, started, budget):
+    """Check the statements run since `started` (a query_count()) against `budget`."""
+    spent = query_count() - started
+    if spent <= budget:
+        return
+    if current_app.testing or current_app.config.get('QUERY_BUDGET_STRICT'):
+        raise QueryBudgetExceeded(f'{name} ran {spent} queries (budget {budget})')
+    current_app.logger.warning('%s ran %d queries (budget %d)', name, spent, budget)
+
+
+def init_query_counter(app, engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _count_statement(conn, cursor, statement, parameters, context, executemany):
+        if has_app_context():
+            g.query_count = g.get('query_count', 0) + 1
+
+    if app.config.get('QUERY_COUNT_HEADER'):
+        @app.after_request
+        def _query_count_header(response):
+            response.headers['X-Query-Count'] = str(query_count())
+            return response
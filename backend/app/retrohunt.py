@@ -0,0 +1,230 @@
+"""Sigma retro-hunt over local JSONL log files.
+
+The input (one file or a directory tree) is cut into byte ranges of
+RETRO_HUNT_CHUNK_MB. A line belongs to the range its first byte falls in:
+a worker seeks to the range start, skips the partial line in front of it,
+and reads whole lines until it passes the range end. Gzip files cannot be
+split like that and are scanned as one range each.
+
+Ranges run in a process pool whose workers compile the stored Sigma rules
+once at start-up. Only a couple of ranges per worker are in flight, so
+memory stays flat however large the input is. As each range completes,
+the parent writes its hits to `retro_hunt_hits`, adds the byte/event/hit
+counts to the `retro_hunts` row and commits, which is what the progress
+endpoint reads.
+"""
+import gzip
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+
+from .jsonprovider import loads
+from .models import db, RetroHunt, RetroHuntHit, SigmaRule
+from .sigma import CompiledRule, SigmaEngine, SigmaError, parse_rule
+
+LOG_SUFFIXES = ('.jsonl', '.ndjson', '.json', '.log')
+MAX_HITS_PER_RANGE = 10000
+
+
+class RetroHuntError(ValueError):
+    pass
+
+
+def resolve_path(root, path):
+    """`path` inside `root`, or RetroHuntError."""
+    root = os.path.realpath(root)
+    full = os.path.realpath(os.path.join(root, path))
+    if full != root and not full.startswith(root + os.sep):
+        raise RetroHuntError('path must be inside the retro-hunt log directory')
+    if not os.path.exists(full):
+        raise RetroHuntError(f'{path} does not exist')
+    return full
+
+
+def list_files(path):
+    if os.path.isfile(path):
+        return [path]
+    found = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for name in sorted(filenames):
+            base = name[:-3] if name.endswith('.gz') else name
+            if base.endswith(LOG_SUFFIXES):
+                found.append(os.path.join(dirpath, name))
+    return found
+
+
+def plan_ranges(files, chunk_bytes):
+    """(path, start, end, gzipped) tasks covering every file."""
+    for path in files:
+        size = os.path.getsize(path)
+        if path.endswith('.gz'):
+            yield path, 0, size, True
+            continue
+        for start in range(0, size, chunk_bytes):
+            yield path, start, min(start + chunk_bytes, size), False
+
+
+# ---- worker processes ---------------------------------------------------------------------
+_engine = None
+_logsource = None
+
+
+def _init_worker(rules, logsource):
+    global _engine, _logsource
+    compiled = []
+    for rule_id, name, doc in rules:
+        try:
+            compiled.append(CompiledRule(rule_id, name, doc))
+        except SigmaError:
+            pass
+    _engine = SigmaEngine(compiled)
+    _logsource = logsource
+
+
+def _iter_lines(path, start, end, gzipped):
+    """(offset, line) pairs of the lines starting inside [start, end)."""
+    if gzipped:
+        offset = 0
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                yield offset, line
+                offset += len(line)
+        return
+    with open(path, 'rb', buffering=1 << 20) as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()
+        offset = f.tell()
+        while offset < end:
+            line = f.readline()
+            if not line:
+                break
+            yield offset, line
+            offset += len(line)
+
+
+def _scan_range(task):
+    path, start, end, gzipped = task
+    events = bad = hit_count = 0
+    hits = []
+    for offset, line in _iter_lines(path, start, end, gzipped):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            event = loads(line)
+        except ValueError:
+            bad += 1
+            continue
+        if not isinstance(event, dict):
+            bad += 1
+            continue
+        events += 1
+        matched, _ = _engine.match_event(event, _logsource)
+        for rule_id in matched:
+            hit_count += 1
+            if len(hits) < MAX_HITS_PER_RANGE:
+                hits.append((rule_id, offset, event))
+    return {'path': path, 'bytes': end - start, 'events': events, 'bad_lines': bad,
+            'hit_count': hit_count, 'hits': hits}
+
+
+# ---- coordinator ---------------------------------------------------------------------------
+def run_hunt(hunt_id, workers=None, chunk_bytes=64 << 20, max_hits=100000, on_progress=None):
+    """Run retro-hunt `hunt_id` to completion in the calling thread."""
+    hunt = db.session.get(RetroHunt, hunt_id)
+    try:
+        rules = []
+        for rule_id, name, parsed, content in db.session.execute(
+            db.select(SigmaRule.id, SigmaRule.name, SigmaRule.parsed, SigmaRule.content)
+        ):
+            try:
+                rules.append((rule_id, name, parsed if parsed is not None else parse_rule(content)))
+            except SigmaError:
+                pass
+        files = list_files(hunt.path)
+        tasks = iter(plan_ranges(files, chunk_bytes))
+        workers = workers or os.cpu_count() or 1
+
+        hunt.status = 'running'
+        hunt.rules = len(rules)
+        hunt.total_bytes = sum(os.path.getsize(f) for f in files)
+        hunt.started_at = datetime.now(timezone.utc)
+        db.session.commit()
+
+        stored = 0
+        # spawn, not fork: the parent holds pooled DB connections and listener threads
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(rules, hunt.logsource),
+        ) as pool:
+            pending = set()
+
+            def fill():
+                while len(pending) < workers * 2:
+                    task = next(tasks, None)
+                    if task is None:
+                        return
+                    pending.add(pool.submit(_scan_range, task))
+
+            fill()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    rows = [
+                        {'hunt_id': hunt_id, 'rule_id': rule_id, 'file': result['path'],
+                         'line_offset': offset, 'event': event}
+                        for rule_id, offset, event in result['hits'][:max(max_hits - stored, 0)]
+                    ]
+                    if rows:
+                        db.session.execute(db.insert(RetroHuntHit), rows)
+                        stored += len(rows)
+                    hunt.processed_bytes += result['bytes']
+                    hunt.events += result['events']
+                    hunt.hits += result['hit_count']
+                db.session.commit()
+                if on_progress:
+                    on_progress(hunt.to_dict())
+
+                db.session.refresh(hunt, ['status'])
+                if hunt.status == 'cancelled':
+                    for future in pending:
+                        future.cancel()
+                    break
+                fill()
+
+        if hunt.status != 'cancelled':
+            hunt.status = 'done'
+        hunt.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        hunt = db.session.get(RetroHunt, hunt_id)
+        hunt.status = 'failed'
+        hunt.error = str(e)
+        hunt.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+    return hunt.to_dict()
+
+
+def start_hunt(app, hunt_id):
+    """Run `hunt_id` in a background thread of this process."""
+    def _run():
+        with app.app_context():
+            try:
+                run_hunt(
+                    hunt_id,
+                    workers=app.config['RETRO_HUNT_WORKERS'] or None,
+                    chunk_bytes=app.config['RETRO_HUNT_CHUNK_MB'] << 20,
+                    max_hits=app.config['RETRO_HUNT_MAX_HITS'],
+                )
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=_run, name=f'retro-hunt-{hunt_id}', daemon=True).start()
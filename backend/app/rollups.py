@@ -0,0 +1,177 @@
+"""Incrementally maintained stats: monthly rollup and total counters.
+
+Write paths call `track_insert` / `track_delete` inside their own
+transaction, so `monthly_stats` and `entity_counters` commit or roll back
+together with the rows they count. The dashboard then reads a handful of
+primary-key rows instead of scanning the base tables.
+
+Counters are recounted (`reconcile_counters`) by rebuild_stats.py and by
+the `start_reconciler` timer, never by a read request.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, MonthlyStat, EntityCounter, Malware, IOC, Report, SigmaRule
+
+ROLLUP_MODELS = {
+    'malware': Malware,
+    'iocs': IOC,
+    'reports': Report,
+}
+
+COUNTED_MODELS = {
+    'reports': Report,
+    'malware': Malware,
+    'iocs': IOC,
+    'sigma_rules': SigmaRule,
+}
+
+
+def _month_of(value):
+    return func.date_trunc('month', value).cast(db.Date)
+
+
+def bump_month(entity, delta=1, at=None):
+    """Add `delta` to the bucket of `at` (the transaction's now() by default)."""
+    if not delta:
+        return
+    table = MonthlyStat.__table__
+    stmt = pg_insert(table).values(
+        entity=entity,
+        month=_month_of(at if at is not None else func.now()),
+        count=delta,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.entity, table.c.month],
+        set_={'count': table.c.count + stmt.excluded.count},
+    )
+    db.session.execute(stmt)
+
+
+def exact_monthly_counts(model, since):
+    """One date_trunc GROUP BY over rows created on or after `since`."""
+    month = _month_of(model.created_at)
+    rows = (
+        db.session.query(month, func.count(model.id))
+        .filter(model.created_at >= since)
+        .group_by(month)
+        .all()
+    )
+    return {m: c for m, c in rows}
+
+
+def rollup_monthly_counts(entity, since):
+    rows = (
+        db.session.query(MonthlyStat.month, MonthlyStat.count)
+        .filter(MonthlyStat.entity == entity, MonthlyStat.month >= since)
+        .all()
+    )
+    return {m: c for m, c in rows}
+
+
+def rebuild_rollup():
+    """Recompute `monthly_stats` from the base tables (backfill / repair)."""
+    db.session.query(MonthlyStat).delete()
+    for entity, model in ROLLUP_MODELS.items():
+        month = _month_of(model.created_at)
+        rows = (
+            db.session.query(month, func.count(model.id))
+            .filter(model.created_at.isnot(None))
+            .group_by(month)
+            .all()
+        )
+        db.session.add_all(MonthlyStat(entity=entity, month=m, count=c) for m, c in rows)
+    db.session.commit()
+
+
+def bump_counter(entity, delta=1):
+    if not delta:
+        return
+    table = EntityCounter.__table__
+    stmt = pg_insert(table).values(entity=entity, count=delta)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.entity],
+        set_={'count': table.c.count + stmt.excluded.count},
+    )
+    db.session.execute(stmt)
+
+
+def track_insert(entity, n=1):
+    """Account for `n` new rows of `entity` in the current transaction."""
+    if entity in ROLLUP_MODELS:
+        bump_month(entity, n)
+    bump_counter(entity, n)
+
+
+def track_delete(entity, created_at):
+    """Account for one deleted row of `entity` in the current transaction."""
+    if entity in ROLLUP_MODELS and created_at is not None:
+        bump_month(entity, -1, at=created_at)
+    bump_counter(entity, -1)
+
+
+def exact_counts():
+    return {
+        entity: db.session.query(func.count(model.id)).scalar() or 0
+        for entity, model in COUNTED_MODELS.items()
+    }
+
+
+def reconcile_counters():
+    """Overwrite each counter with the real COUNT(*).
+
+    The counter row is locked before counting, so writers that commit
+    meanwhile queue behind the lock and add their delta afterwards
+    instead of being lost.
+    """
+    table = EntityCounter.__table__
+    counts = {}
+    for entity, model in COUNTED_MODELS.items():
+        db.session.execute(pg_insert(table).values(entity=entity, count=0).on_conflict_do_nothing())
+        db.session.query(EntityCounter).filter_by(entity=entity).with_for_update().one()
+        counts[entity] = db.session.query(func.count(model.id)).scalar() or 0
+        db.session.query(EntityCounter).filter_by(entity=entity).update(
+            {'count': counts[entity], 'reconciled_at': func.now()},
+            synchronize_session=False,
+        )
+        db.session.commit()
+    return counts
+
+
+def cached_counts():
+    """(counts, reconciled_at) as stored in `entity_counters`.
+
+    `reconciled_at` is the oldest recount of the counters, or None if one
+    has never been recounted.
+    """
+    rows = db.session.query(EntityCounter).filter(EntityCounter.entity.in_(COUNTED_MODELS)).all()
+    stamps = [r.reconciled_at for r in rows]
+    reconciled_at = None if len(rows) < len(COUNTED_MODELS) or None in stamps else min(stamps)
+    return {r.entity: r.count for r in rows}, reconciled_at
+
+
+def start_reconciler(app):
+    """Recount the counters in a background thread whenever they are older than COUNTERS_RECONCILE_SECONDS."""
+    interval = app.config['COUNTERS_RECONCILE_SECONDS']
+    if interval <= 0:
+        return
+
+    def _run():
+        while True:
+            with app.app_context():
+                try:
+                    _, reconciled_at = cached_counts()
+                    due = datetime.now(timezone.utc) - timedelta(seconds=interval)
+                    if reconciled_at is None or reconciled_at < due:
+                        reconcile_counters()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error reconciling entity counters: {e}")
+                finally:
+                    db.session.remove()
+            threading.Event().wait(min(interval, 300))
+
+    threading.Thread(target=_run, name='counters-reconciler', daemon=True).start()
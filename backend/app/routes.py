@@ -1,11 +1,16 @@
 # app/routes.py
+import math
 import os
+import time
 import bcrypt
-import requests
-from datetime import datetime
-from flask import request, jsonify
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime
+from flask import Response, request, jsonify, send_file, stream_with_context
 from flask import current_app as app
-from sqlalchemy import extract, func
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from .models import (
     db,
     User,
@@ -16,10 +21,61 @@ from .models import (
     SigmaRule,
     UserProfile,
     Alert,
+    RetroHunt,
+    RetroHuntHit,
     report_malware,
 )
+from .ioc_ingest import (
+    IOCValidationError,
+    iter_json_items,
+    iter_ndjson_items,
+    upsert_iocs,
+    validate_ioc,
+)
+from .pagination import CursorError, paginate, page_response, page_size
+from .jsonprovider import dumps as json_dumps
+from .projection import FieldsError, projected_query, requested_fields, row_to_dict
+from .querycount import enforce_budget, query_count
+from .search import search_entities
+from .sigma import SigmaError, rule_cache as sigma_rule_cache, send_rules_notify
+from .sigma import content_hash as sigma_content_hash, parse_rule as parse_sigma_rule
+from .sigma_import import SigmaImportError, import_archive as import_sigma_archive, spool_upload
+from .retrohunt import RetroHuntError, resolve_path, start_hunt
+from .avatars import AvatarError, decode_avatar, get_thumbnail, store_avatar
+from .export import EXPORT_FORMATS, EXPORT_MODELS, iter_export
+from .extract import extract_indicators, link_report
+from .normalize import LOOKUP_VALUE as IOC_LOOKUP_VALUE, normalize_value as normalize_ioc_value
+from .hashlookup import lookup_hashes, normalize_hashes
+from .graph import ENTITY_ALIASES as GRAPH_ENTITY_ALIASES, neighborhood, sql_pivot
+from . import graph_index
+from .graph_index import publish_events as publish_graph_events
+from .ioc_index import index as ioc_index, index_value as index_ioc_value, publish_events as publish_ioc_events
+from .textscan import CHUNK_BYTES as TEXT_SCAN_CHUNK
+from .ioc_snapshot import start_build as start_ioc_snapshot_build
+from .ioc_snapshot import snapshot_meta as ioc_snapshot_meta, snapshot_path as ioc_snapshot_path
+from .rollups import (
+    ROLLUP_MODELS,
+    cached_counts,
+    exact_counts,
+    exact_monthly_counts,
+    rollup_monthly_counts,
+    track_delete,
+    track_insert,
+)
+from .alert_stream import broker as alert_broker, format_sse, send_alert_notify
+
+from .virustotal import RateLimited, VTCache, VTClient, normalize_indicator
+
+SSE_HEARTBEAT_SECONDS = 15
+ADMIN_USERS_QUERY_BUDGET = 1
 
 VIRUSTOTAL_API_KEY = os.environ.get('VIRUSTOTAL_API_KEY') or os.environ.get('VT_API_KEY')
+vt_cache = VTCache(app.config['VT_CACHE_MEMORY_ENTRIES'])
+vt_client = VTClient(
+    app.config['VT_BASE_URL'],
+    rate_per_minute=app.config['VT_RATE_PER_MINUTE'],
+    pool_size=app.config['VT_BATCH_CONCURRENCY'],
+)
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -100,6 +156,7 @@ def malware_collection():
                 sources=data.get('sources'),
             )
             db.session.add(m)
+            track_insert('malware')
             db.session.commit()
             
             # Create alert notification
@@ -116,12 +173,44 @@ def malware_collection():
 
     # GET
     q = request.args.get('q', type=str)
-    query = Malware.query
-    if q:
-        ilike = f"%{q}%"
-        query = query.filter(Malware.name.ilike(ilike))
-    items = [m.to_dict() for m in query.order_by(Malware.created_at.desc()).limit(200)]
-    return jsonify(items)
+    try:
+        fields = requested_fields(Malware)
+        query = projected_query(Malware, fields)
+        if q:
+            ilike = f"%{q}%"
+            query = query.filter(Malware.name.ilike(ilike))
+        rows, next_cursor = paginate(query, Malware, 200)
+    except (CursorError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    return page_response([row_to_dict(row, fields) for row in rows], next_cursor)
+
+@app.route('/api/malware/lookup-hashes', methods=['POST'])
+def malware_lookup_hashes():
+    """Which malware / IOCs carry these file hashes?
+
+    Body: {"hashes": ["<md5|sha1|sha256|sha512>", ...]} (or a bare array),
+    up to MALWARE_HASH_LOOKUP_MAX. Only hashes with a match appear in
+    "matches"; malformed inputs are listed under "invalid".
+    """
+    data = request.get_json(silent=True)
+    values = data.get('hashes') if isinstance(data, dict) else data
+    if not isinstance(values, list):
+        return jsonify({'message': 'hashes must be a JSON array'}), 400
+    limit = app.config['MALWARE_HASH_LOOKUP_MAX']
+    if len(values) > limit:
+        return jsonify({'message': f'at most {limit} hashes per request'}), 413
+
+    started = time.perf_counter()
+    hashes, invalid = normalize_hashes(values)
+    matches = lookup_hashes(hashes) if hashes else {}
+    return jsonify({
+        'checked': len(hashes),
+        'matched': len(matches),
+        'matches': matches,
+        'invalid': invalid[:100],
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
 
 @app.route('/api/malware/<int:malware_id>', methods=['GET'])
 def malware_detail(malware_id: int):
@@ -157,10 +246,22 @@ def reports_collection():
             if malware_names:
                 found = Malware.query.filter(Malware.name.in_(malware_names)).all()
                 malware_ids.extend([x.id for x in found])
+            graph_events = [('add', 'report_malware', r.id, mid) for mid in set(malware_ids)]
             for mid in set(malware_ids):
                 db.session.execute(report_malware.insert().values(report_id=r.id, malware_id=mid))
 
+            # IOC/CVE из полного текста
+            ioc_events = []
+            if r.full_text:
+                _, extracted_events, ioc_events = link_report(r.id, extract_indicators(r.full_text))
+                graph_events += extracted_events
+
+            track_insert('reports')
+            publish_graph_events(db.session, graph_events)
+            publish_ioc_events(db.session, ioc_events)
             db.session.commit()
+            graph_index.index.apply_events(graph_events)
+            ioc_index.apply_events(ioc_events)
             
             # Create alert notification
             _create_alert(
@@ -176,12 +277,16 @@ def reports_collection():
             return jsonify({'message': 'failed to create report', 'error': str(e)}), 400
 
     q = request.args.get('q', type=str)
-    query = Report.query
-    if q:
-        ilike = f"%{q}%"
-        query = query.filter(Report.title.ilike(ilike))
-    items = [r.to_dict() for r in query.order_by(Report.created_at.desc()).limit(200)]
-    return jsonify(items)
+    try:
+        fields = requested_fields(Report)
+        query = projected_query(Report, fields)
+        if q:
+            ilike = f"%{q}%"
+            query = query.filter(Report.title.ilike(ilike))
+        rows, next_cursor = paginate(query, Report, 200)
+    except (CursorError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    return page_response([row_to_dict(row, fields) for row in rows], next_cursor)
 
 @app.route('/api/reports/<int:report_id>', methods=['GET', 'PATCH', 'DELETE'])
 def report_detail(report_id: int):
@@ -189,8 +294,12 @@ def report_detail(report_id: int):
     
     if request.method == 'DELETE':
         try:
+            graph_events = graph_index.index.node_removal_events('report', r.id)
+            track_delete('reports', r.created_at)
+            publish_graph_events(db.session, graph_events)
             db.session.delete(r)
             db.session.commit()
+            graph_index.index.apply_events(graph_events)
             return jsonify({'message': 'Report deleted successfully'}), 200
         except Exception as e:
             db.session.rollback()
@@ -207,10 +316,17 @@ def report_detail(report_id: int):
                 r.author = data['author']
             if 'summary' in data:
                 r.summary = data['summary']
+            graph_events, ioc_events = [], []
             if 'full_text' in data:
                 r.full_text = data['full_text']
+                if r.full_text:
+                    _, graph_events, ioc_events = link_report(r.id, extract_indicators(r.full_text))
+                    publish_graph_events(db.session, graph_events)
+                    publish_ioc_events(db.session, ioc_events)
                 
             db.session.commit()
+            graph_index.index.apply_events(graph_events)
+            ioc_index.apply_events(ioc_events)
             return jsonify(r.to_dict()), 200
         except Exception as e:
             db.session.rollback()
@@ -235,29 +351,359 @@ def iocs_collection():
         data = request.get_json() or {}
         if not data.get('type') or not data.get('value'):
             return jsonify({'message': 'type and value are required'}), 400
+        normalized = normalize_ioc_value(data['value'], data['type'])
         try:
-            ioc = IOC(
-                type=data['type'],
-                value=data['value'],
-                first_seen=_parse_date(data.get('first_seen')),
-                last_seen=_parse_date(data.get('last_seen')),
-                confidence=data.get('confidence'),
-                source=data.get('source'),
-            )
-            db.session.add(ioc)
+            # the unique index decides, so two spellings posted at once cannot both land
+            ioc_id = db.session.execute(
+                pg_insert(IOC.__table__).values(
+                    type=data['type'],
+                    value=data['value'],
+                    normalized_value=normalized,
+                    first_seen=_parse_date(data.get('first_seen')),
+                    last_seen=_parse_date(data.get('last_seen')),
+                    confidence=data.get('confidence'),
+                    source=data.get('source'),
+                ).on_conflict_do_nothing(
+                    index_elements=[IOC.__table__.c.normalized_value],
+                    index_where=IOC.__table__.c.normalized_value.is_not(None),
+                ).returning(IOC.__table__.c.id)
+            ).scalar()
+            if ioc_id is None:
+                db.session.rollback()
+                existing = db.session.execute(
+                    db.select(IOC.id).where(IOC.normalized_value == normalized)
+                ).scalar()
+                return jsonify({'message': 'IOC already exists', 'id': existing}), 409
+            ioc = db.session.get(IOC, ioc_id)
+            ioc_events = [('add', ioc.id, ioc.type, index_ioc_value(ioc))]
+            track_insert('iocs')
+            publish_ioc_events(db.session, ioc_events)
             db.session.commit()
+            ioc_index.apply_events(ioc_events)
             return jsonify(ioc.to_dict()), 201
+        except IntegrityError:
+            # same raw value on a row normalize_iocs.py has not normalized yet
+            db.session.rollback()
+            existing = db.session.execute(db.select(IOC.id).where(IOC.value == data['value'])).scalar()
+            return jsonify({'message': 'IOC already exists', 'id': existing}), 409
         except Exception as e:
             db.session.rollback()
             return jsonify({'message': 'failed to create ioc', 'error': str(e)}), 400
 
     q = request.args.get('q', type=str)
-    query = IOC.query
-    if q:
-        ilike = f"%{q}%"
-        query = query.filter(IOC.value.ilike(ilike))
-    items = [i.to_dict() for i in query.order_by(IOC.created_at.desc()).limit(200)]
-    return jsonify(items)
+    value = request.args.get('value', type=str)
+    try:
+        fields = requested_fields(IOC)
+        query = projected_query(IOC, fields)
+        if value:
+            # exact lookup in any spelling: evil[.]com, EVIL.COM. and evil.com are one value
+            query = query.filter(IOC_LOOKUP_VALUE == normalize_ioc_value(value))
+        if q:
+            ilike = f"%{q}%"
+            query = query.filter(or_(
+                IOC_LOOKUP_VALUE == normalize_ioc_value(q),
+                IOC.value.ilike(ilike),
+            ))
+        rows, next_cursor = paginate(query, IOC, 200)
+    except (CursorError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    return page_response([row_to_dict(row, fields) for row in rows], next_cursor)
+
+
+def _ioc_index_unavailable():
+    resp = jsonify({'message': 'IOC index is still loading, retry shortly'})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = '5'
+    return resp
+
+
+def _match_batch(key):
+    """The list under `key` (or a bare JSON array) of a match request, or an error response."""
+    data = request.get_json(silent=True)
+    values = data.get(key) if isinstance(data, dict) else data
+    if not isinstance(values, list):
+        return None, (jsonify({'message': f'{key} must be a JSON array'}), 400)
+    limit = app.config['IOC_MATCH_MAX']
+    if len(values) > limit:
+        return None, (jsonify({'message': f'at most {limit} {key} per request'}), 413)
+    return values, None
+
+
+@app.route('/api/iocs/match-ips', methods=['POST'])
+def iocs_match_ips():
+    """Match IPv4/IPv6 addresses against IP and CIDR IOCs (longest prefix wins).
+
+    Body: {"addresses": ["10.1.2.3", "2001:db8::1", ...]} or a bare array.
+    Only addresses with a match are listed, with their index in the input.
+    """
+    addresses, error = _match_batch('addresses')
+    if error:
+        return error
+    if not ioc_index.ready:
+        return _ioc_index_unavailable()
+
+    started = time.perf_counter()
+    matches, invalid = [], []
+    with ioc_index.engines() as engines:
+        match = engines['cidr'].match
+        for i, address in enumerate(addresses):
+            found = match(address) if isinstance(address, str) else False
+            if found is False:
+                invalid.append(i)
+            elif found is not None:
+                ioc_id, ioc_type, value, prefixlen = found
+                matches.append({
+                    'index': i,
+                    'address': address,
+                    'ioc': {'id': ioc_id, 'type': ioc_type, 'value': value, 'prefixlen': prefixlen},
+                })
+    return jsonify({
+        'checked': len(addresses),
+        'matched': len(matches),
+        'matches': matches,
+        'invalid': invalid[:100],
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+@app.route('/api/iocs/match-domains', methods=['POST'])
+def iocs_match_domains():
+    """Match hostnames against domain IOCs, including their subdomains.
+
+    Body: {"hostnames": ["cdn.a.evil.example", ...]} or a bare array.
+    Each matched hostname lists every covering domain IOC, most specific first.
+    """
+    hostnames, error = _match_batch('hostnames')
+    if error:
+        return error
+    if not ioc_index.ready:
+        return _ioc_index_unavailable()
+
+    started = time.perf_counter()
+    found, invalid = [], []
+    with ioc_index.engines() as engines:
+        match = engines['domain'].match
+        for i, hostname in enumerate(hostnames):
+            iocs = match(hostname)
+            if iocs is None:
+                invalid.append(i)
+            elif iocs:
+                found.append((i, hostname, iocs))
+
+    ioc_ids = {ioc[0] for _, _, iocs in found for ioc in iocs}
+    confidence = dict(db.session.execute(
+        db.select(IOC.id, IOC.confidence).where(IOC.id.in_(ioc_ids))
+    ).all()) if ioc_ids else {}
+    matches = [
+        {
+            'index': i,
+            'hostname': hostname,
+            'iocs': [
+                {'id': ioc_id, 'type': ioc_type, 'value': value, 'confidence': confidence.get(ioc_id)}
+                for ioc_id, ioc_type, value in iocs
+            ],
+        }
+        for i, hostname, iocs in found
+    ]
+    return jsonify({
+        'checked': len(hostnames),
+        'matched': len(matches),
+        'matches': matches,
+        'invalid': invalid[:100],
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+@app.route('/api/iocs/scan-text', methods=['POST'])
+def iocs_scan_text():
+    """Find every known IOC value in raw text (logs, mail bodies, sandbox output).
+
+    The body is the text itself, or a multipart upload in "file". It is read
+    and scanned in chunks, and results stream back as NDJSON: one line per
+    IOC at its first occurrence, then a summary line with "done": true.
+    ?malware=1 also reports hash-shaped tokens that belong to malware samples.
+    """
+    if not ioc_index.ready:
+        return _ioc_index_unavailable()
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    max_bytes = app.config['IOC_SCAN_MAX_MB'] << 20
+    with_malware = request.args.get('malware', '').lower() in ('1', 'true')
+    with ioc_index.engines() as engines:
+        scanner = engines['text']
+
+    def results():
+        started = time.perf_counter()
+        read = {'bytes': 0, 'truncated': False}
+
+        def chunks():
+            while True:
+                chunk = stream.read(min(TEXT_SCAN_CHUNK, max_bytes - read['bytes']))
+                if not chunk:
+                    read['truncated'] = read['bytes'] >= max_bytes and bool(stream.read(1))
+                    return
+                read['bytes'] += len(chunk)
+                yield chunk
+
+        hash_tokens = set() if with_malware else None
+        first = {}
+        occurrences = 0
+        for offset, ioc_id, ioc_type, value in scanner.scan(chunks(), hash_tokens):
+            occurrences += 1
+            if ioc_id in first:
+                continue
+            first[ioc_id] = offset
+            yield json_dumps({'offset': offset, 'ioc': {'id': ioc_id, 'type': ioc_type, 'value': value}}) + '\n'
+
+        malware = 0
+        if hash_tokens:
+            for h, match in lookup_hashes(sorted(hash_tokens)).items():
+                if match['malware']:
+                    malware += 1
+                    yield json_dumps({'hash': h, 'type': match['type'], 'malware': match['malware']}) + '\n'
+
+        elapsed = time.perf_counter() - started
+        yield json_dumps({
+            'done': True,
+            'bytes': read['bytes'],
+            'truncated': read['truncated'],
+            'iocs': len(first),
+            'occurrences': occurrences,
+            'malware_hashes': malware,
+            'elapsed_ms': round(elapsed * 1000, 2),
+            'mb_per_second': round(read['bytes'] / 1e6 / elapsed, 2) if elapsed else None,
+        }) + '\n'
+
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/iocs/snapshot', methods=['GET', 'POST'])
+def iocs_snapshot_latest():
+    """Metadata of the newest binary IOC snapshot.
+
+    POST starts a build in the background and answers 202 with the version
+    it will have (build_ioc_snapshot.py builds one from cron instead). Only
+    one build runs at a time, and none starts within
+    IOC_SNAPSHOT_MIN_INTERVAL seconds of the newest snapshot.
+    """
+    directory = app.config['IOC_SNAPSHOT_DIR']
+    if request.method == 'POST':
+        latest = ioc_snapshot_meta(directory)
+        wait = latest['created'] + app.config['IOC_SNAPSHOT_MIN_INTERVAL'] - time.time() if latest else 0
+        if wait > 0:
+            resp = jsonify({'message': 'a snapshot was built recently', 'version': latest['version']})
+            resp.headers['Retry-After'] = str(math.ceil(wait))
+            return resp, 429
+        version, started = start_ioc_snapshot_build(app._get_current_object())
+        return jsonify({'version': version, 'started': started}), 202
+    meta = ioc_snapshot_meta(directory)
+    if meta is None:
+        return jsonify({'message': 'no snapshot has been built yet'}), 404
+    return jsonify(meta)
+
+
+@app.route('/api/iocs/snapshot/<version>', methods=['GET'])
+def iocs_snapshot_file(version):
+    """The snapshot file itself (format: app/ioc_snapshot.py); `version` may be "latest".
+
+    The ETag is the file's sha256, so sensors poll with If-None-Match and
+    only download when the set has changed.
+    """
+    directory = app.config['IOC_SNAPSHOT_DIR']
+    if version != 'latest' and not version.isdigit():
+        return jsonify({'message': 'version must be a number or "latest"'}), 400
+    meta = ioc_snapshot_meta(directory, version if version == 'latest' else int(version))
+    if meta is None:
+        return jsonify({'message': f'snapshot {version} not found'}), 404
+    path = os.path.abspath(ioc_snapshot_path(directory, meta['version']))
+    resp = send_file(
+        path,
+        mimetype='application/octet-stream',
+        download_name=os.path.basename(path),
+        etag=meta['sha256'],
+        conditional=True,
+        max_age=0 if version == 'latest' else 86400,
+    )
+    resp.headers['X-Snapshot-Version'] = str(meta['version'])
+    return resp
+
+
+@app.route('/api/iocs/index', methods=['GET'])
+def iocs_index_stats():
+    """State of this process' in-memory IOC matchers."""
+    return jsonify(ioc_index.stats())
+
+
+@app.route('/api/iocs/bulk', methods=['POST'])
+def iocs_bulk():
+    """Upsert many IOCs at once.
+
+    Accepts a JSON array (or {"iocs": [...]}) or an NDJSON stream with
+    Content-Type application/x-ndjson. Existing values are merged:
+    first_seen keeps the earliest date, last_seen and confidence the highest.
+    """
+    started = time.perf_counter()
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = iter_ndjson_items(request.stream)
+    else:
+        try:
+            items = iter_json_items(request.get_json(silent=True))
+        except IOCValidationError as e:
+            return jsonify({'message': str(e)}), 400
+
+    chunk_size = app.config['IOC_BULK_CHUNK_SIZE']
+    inserted = updated = rejected = 0
+    errors = []
+    chunk = []
+
+    def flush():
+        nonlocal inserted, updated
+        created = []
+        ins, upd = upsert_iocs(chunk, created)
+        track_insert('iocs', ins)
+        ioc_events = [('add', *row) for row in created]
+        publish_ioc_events(db.session, ioc_events)
+        db.session.commit()
+        ioc_index.apply_events(ioc_events)
+        inserted += ins
+        updated += upd
+        chunk.clear()
+
+    try:
+        for index, raw in items:
+            try:
+                if isinstance(raw, Exception):
+                    raise raw
+                chunk.append(validate_ioc(raw))
+            except IOCValidationError as e:
+                rejected += 1
+                if len(errors) < 100:
+                    errors.append({'index': index, 'error': str(e)})
+                continue
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'message': 'bulk ingest failed',
+            'error': str(e),
+            'inserted': inserted,
+            'updated': updated,
+            'rejected': rejected,
+        }), 400
+
+    elapsed = time.perf_counter() - started
+    processed = inserted + updated + rejected
+    return jsonify({
+        'inserted': inserted,
+        'updated': updated,
+        'rejected': rejected,
+        'errors': errors,
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'rows_per_sec': round(processed / elapsed, 1) if elapsed > 0 else None,
+    }), 200
 
 
 # ===============================
@@ -266,12 +712,108 @@ def iocs_collection():
 @app.route('/api/apt-groups', methods=['GET'])
 def apt_groups_collection():
     q = request.args.get('q', type=str)
-    query = APTGroup.query
-    if q:
-        ilike = f"%{q}%"
-        query = query.filter(APTGroup.name.ilike(ilike))
-    items = [a.to_dict() for a in query.order_by(APTGroup.created_at.desc()).limit(200)]
-    return jsonify(items)
+    try:
+        fields = requested_fields(APTGroup)
+        query = projected_query(APTGroup, fields)
+        if q:
+            ilike = f"%{q}%"
+            query = query.filter(APTGroup.name.ilike(ilike))
+        rows, next_cursor = paginate(query, APTGroup, 200)
+    except (CursorError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    return page_response([row_to_dict(row, fields) for row in rows], next_cursor)
+
+
+# ===============================
+# API: Relationship graph
+# ===============================
+@app.route('/api/graph/pivot', methods=['GET'])
+def graph_pivot():
+    """Multi-hop pivot, e.g. ?from=apt:12&path=malware,ioc -> IOCs of malware used by APT 12.
+
+    Answered from the in-memory adjacency index (?engine=memory, the default,
+    falling back to SQL until the index has loaded) or from SQL (?engine=sql).
+    """
+    start = request.args.get('from', '')
+    kind, _, raw_ids = start.partition(':')
+    kind = GRAPH_ENTITY_ALIASES.get(kind)
+    try:
+        start_ids = [int(x) for x in raw_ids.split(',') if x]
+    except ValueError:
+        start_ids = []
+    path = [GRAPH_ENTITY_ALIASES.get(p) for p in request.args.get('path', '').split(',') if p]
+    if kind is None or not start_ids or not path or None in path:
+        return jsonify({'message': 'expected ?from=<kind>:<id>[,<id>...]&path=<kind>[,<kind>...]'}), 400
+
+    engine = request.args.get('engine', 'memory')
+    limit = max(1, min(request.args.get('limit', 1000, type=int), 100000))
+    started = time.perf_counter()
+    if engine == 'memory' and graph_index.index.ready:
+        ids = graph_index.index.pivot(kind, start_ids, path)
+    else:
+        engine = 'sql'
+        ids = sql_pivot(kind, start_ids, path)
+    elapsed_us = (time.perf_counter() - started) * 1e6
+
+    return jsonify({
+        'kind': path[-1],
+        'count': len(ids),
+        'ids': sorted(ids)[:limit],
+        'engine': engine,
+        'elapsed_us': round(elapsed_us, 1),
+    })
+
+
+@app.route('/api/graph/index', methods=['GET'])
+def graph_index_stats():
+    """State of this process' in-memory adjacency index."""
+    return jsonify(graph_index.index.stats())
+
+
+@app.route('/api/graph/<entity>/<int:entity_id>', methods=['GET'])
+def entity_graph(entity, entity_id: int):
+    """Neighbourhood of an entity across APT/malware/IOC/report/campaign/CVE links.
+
+    ?depth= (1..GRAPH_MAX_DEPTH, default 2), ?max_nodes= and ?max_edges= are
+    capped by GRAPH_MAX_NODES / GRAPH_MAX_EDGES.
+    """
+    kind = GRAPH_ENTITY_ALIASES.get(entity)
+    if kind is None:
+        return jsonify({'message': f'unknown entity, expected one of: {", ".join(GRAPH_ENTITY_ALIASES)}'}), 404
+    depth = max(1, min(request.args.get('depth', 2, type=int), app.config['GRAPH_MAX_DEPTH']))
+    max_nodes = max(1, min(request.args.get('max_nodes', app.config['GRAPH_MAX_NODES'], type=int),
+                           app.config['GRAPH_MAX_NODES']))
+    max_edges = max(1, min(request.args.get('max_edges', app.config['GRAPH_MAX_EDGES'], type=int),
+                           app.config['GRAPH_MAX_EDGES']))
+
+    graph = neighborhood(kind, entity_id, depth, max_nodes, max_edges)
+    if graph is None:
+        return jsonify({'message': f'{entity} {entity_id} not found'}), 404
+    return jsonify(graph)
+
+
+# ===============================
+# API: Export
+# ===============================
+@app.route('/api/export/<entity>', methods=['GET'])
+def export_entity(entity):
+    """Stream a whole table as NDJSON (default) or CSV."""
+    model = EXPORT_MODELS.get(entity)
+    if model is None:
+        return jsonify({'message': f'unknown entity, expected one of: {", ".join(EXPORT_MODELS)}'}), 404
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'message': 'format must be ndjson or csv'}), 400
+
+    filename = f"{entity}-{datetime.utcnow():%Y%m%d}.{fmt}"
+    return Response(
+        stream_with_context(iter_export(model, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no',
+        },
+    )
 
 
 # ===============================
@@ -279,16 +821,12 @@ def apt_groups_collection():
 # ===============================
 @app.route('/api/search', methods=['GET'])
 def search_all():
-    q = request.args.get('q', '')
+    """Ranked search; each item carries a `score` (trigram similarity or ts_rank)."""
+    q = request.args.get('q', '').strip()
     if not q:
         return jsonify({'malware': [], 'apt_groups': [], 'iocs': [], 'reports': []})
-    ilike = f"%{q}%"
-    return jsonify({
-        'malware': [m.to_dict() for m in Malware.query.filter(Malware.name.ilike(ilike)).limit(50)],
-        'apt_groups': [a.to_dict() for a in APTGroup.query.filter(APTGroup.name.ilike(ilike)).limit(50)],
-        'iocs': [i.to_dict() for i in IOC.query.filter(IOC.value.ilike(ilike)).limit(50)],
-        'reports': [r.to_dict() for r in Report.query.filter(Report.title.ilike(ilike)).limit(50)],
-    })
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    return jsonify(search_entities(q, limit))
 
 
 # ===============================
@@ -296,37 +834,46 @@ def search_all():
 # ===============================
 @app.route('/api/stats/overview', methods=['GET'])
 def stats_overview():
+    """Monthly counts from the `monthly_stats` rollup; ?exact=1 recounts the base tables."""
     now = datetime.utcnow()
-    labels = []
-    malware_counts = []
-    ioc_counts = []
-    report_counts = []
-
+    months = []
     for i in range(11, -1, -1):
-        year = (now.year if now.month - i > 0 else now.year - 1) if (now.month - i) <= 0 else now.year
-        month = ((now.month - i - 1) % 12) + 1
-        labels.append(datetime(year, month, 1).strftime('%b %Y'))
-        malware_counts.append(_count_by_month(Malware, year, month))
-        ioc_counts.append(_count_by_month(IOC, year, month))
-        report_counts.append(_count_by_month(Report, year, month))
+        year, month = divmod(now.year * 12 + now.month - 1 - i, 12)
+        months.append(date(year, month + 1, 1))
+
+    exact = request.args.get('exact') in ('1', 'true')
+    datasets = {}
+    for entity, model in ROLLUP_MODELS.items():
+        if exact:
+            counts = exact_monthly_counts(model, months[0])
+        else:
+            counts = rollup_monthly_counts(entity, months[0])
+        datasets[entity] = [counts.get(m, 0) for m in months]
 
     return jsonify({
-        'labels': labels,
-        'datasets': {
-            'malware': malware_counts,
-            'iocs': ioc_counts,
-            'reports': report_counts,
-        }
+        'labels': [m.strftime('%b %Y') for m in months],
+        'datasets': datasets,
     })
 
 
 @app.route('/api/stats/metrics', methods=['GET'])
 def stats_metrics():
+    """Entity totals as stored in `entity_counters`, with the time of their last recount.
+
+    ?exact=1 counts the base tables with COUNT(*) instead (reconciledAt is
+    then null), read-only: the stored counters are only recounted by the
+    background reconciler and rebuild_stats.py, so a GET never locks them.
+    """
+    if request.args.get('exact') in ('1', 'true'):
+        counts, reconciled_at = exact_counts(), None
+    else:
+        counts, reconciled_at = cached_counts()
     return jsonify({
-        'reports': db.session.query(func.count(Report.id)).scalar() or 0,
-        'malware': db.session.query(func.count(Malware.id)).scalar() or 0,
-        'iocs': db.session.query(func.count(IOC.id)).scalar() or 0,
-        'sigmaRules': db.session.query(func.count(SigmaRule.id)).scalar() or 0,
+        'reports': counts.get('reports', 0),
+        'malware': counts.get('malware', 0),
+        'iocs': counts.get('iocs', 0),
+        'sigmaRules': counts.get('sigma_rules', 0),
+        'reconciledAt': reconciled_at.isoformat() if reconciled_at else None,
     })
 
 
@@ -350,6 +897,16 @@ def sigma_rules_collection():
         content = (data.get('content') or '').strip()
         if not name or not content:
             return jsonify({'message': 'name and content are required'}), 400
+        try:
+            parsed = parse_sigma_rule(content)
+        except SigmaError as e:
+            return jsonify({'message': f'invalid sigma rule: {e}'}), 400
+        digest = sigma_content_hash(content)
+        duplicate = db.session.execute(
+            db.select(SigmaRule.id).where(SigmaRule.content_hash == digest)
+        ).scalar()
+        if duplicate is not None:
+            return jsonify({'message': 'an identical sigma rule already exists', 'id': duplicate}), 409
 
         try:
             rule = SigmaRule(
@@ -357,9 +914,14 @@ def sigma_rules_collection():
                 description=data.get('description'),
                 filename=data.get('filename'),
                 content=content,
+                content_hash=digest,
+                parsed=parsed,
             )
             db.session.add(rule)
+            track_insert('sigma_rules')
+            send_rules_notify(db.session)
             db.session.commit()
+            sigma_rule_cache.invalidate()
             
             # Create alert notification
             _create_alert(
@@ -375,12 +937,57 @@ def sigma_rules_collection():
 
     # GET
     q = request.args.get('q', type=str)
-    query = SigmaRule.query.order_by(SigmaRule.created_at.desc())
-    if q:
-        ilike = f"%{q}%"
-        query = query.filter(SigmaRule.name.ilike(ilike))
-    items = [r.to_dict() for r in query.limit(200)]
-    return jsonify(items)
+    try:
+        fields = requested_fields(SigmaRule)
+        query = projected_query(SigmaRule, fields)
+        if q:
+            ilike = f"%{q}%"
+            query = query.filter(SigmaRule.name.ilike(ilike))
+        rows, next_cursor = paginate(query, SigmaRule, 200)
+    except (CursorError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    return page_response([row_to_dict(row, fields) for row in rows], next_cursor)
+
+
+@app.route('/api/sigma-rules/bulk', methods=['POST'])
+def sigma_rules_bulk():
+    """Import every *.yml/*.yaml rule from a ZIP or tar(.gz) archive.
+
+    Send the archive as multipart field "file" or as the raw request body.
+    Uploads over SIGMA_IMPORT_UPLOAD_MAX_MB are refused with 413; a raw body
+    is spooled to a temporary file rather than held in memory.
+    Rules are validated; invalid ones are reported, duplicates (same
+    content) skipped.
+    """
+    upload_max = app.config['SIGMA_IMPORT_UPLOAD_MAX_MB'] << 20
+    if request.content_length is not None and request.content_length > upload_max:
+        return jsonify({'message': f'archive is larger than {upload_max >> 20} MB'}), 413
+    try:
+        upload = request.files.get('file')
+        fileobj = upload.stream if upload else spool_upload(request.stream, upload_max)
+    except SigmaImportError as e:
+        return jsonify({'message': str(e)}), 413
+    try:
+        stats = import_sigma_archive(
+            fileobj,
+            max_bytes=app.config['SIGMA_IMPORT_MAX_MB'] << 20,
+            workers=app.config['SIGMA_IMPORT_WORKERS'] or None,
+        )
+    except SigmaImportError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'failed to import sigma rules', 'error': str(e)}), 400
+    finally:
+        fileobj.close()
+
+    if stats['imported']:
+        _create_alert(
+            alert_type='sigma',
+            message=f'Импортировано Sigma-правил: {stats["imported"]}',
+            username='System'
+        )
+    return jsonify(stats), 201 if stats['imported'] else 200
 
 
 @app.route('/api/sigma-rules/<int:rule_id>', methods=['GET', 'DELETE'])
@@ -388,8 +995,11 @@ def sigma_rule_detail(rule_id: int):
     rule = SigmaRule.query.get_or_404(rule_id)
     if request.method == 'DELETE':
         try:
+            track_delete('sigma_rules', rule.created_at)
             db.session.delete(rule)
+            send_rules_notify(db.session)
             db.session.commit()
+            sigma_rule_cache.invalidate()
             return jsonify({'message': 'deleted'}), 200
         except Exception as e:
             db.session.rollback()
@@ -401,121 +1011,217 @@ def sigma_rule_detail(rule_id: int):
     return jsonify(data)
 
 
+@app.route('/api/sigma/match', methods=['POST'])
+def sigma_match():
+    """Run a batch of JSON events through the compiled Sigma rules.
+
+    Body: {"events": [{...}, ...], "logsource": {"product": "windows", ...}}.
+    The logsource applies to every event unless an event carries its own
+    "logsource" object. Returns one hit per (event index, rule id).
+    """
+    data = request.get_json(silent=True) or {}
+    events = data.get('events')
+    if not isinstance(events, list):
+        return jsonify({'message': 'events must be a JSON array'}), 400
+    max_events = app.config['SIGMA_MATCH_MAX_EVENTS']
+    if len(events) > max_events:
+        return jsonify({'message': f'at most {max_events} events per request'}), 413
+    logsource = data.get('logsource') if isinstance(data.get('logsource'), dict) else None
+
+    started = time.perf_counter()
+    engine = sigma_rule_cache.engine()
+    hits = []
+    evaluated = 0
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            continue
+        matched, n = engine.match_event(event, logsource)
+        evaluated += n
+        hits.extend({'event': index, 'rule_id': rid} for rid in matched)
+
+    hit_rules = {hit['rule_id'] for hit in hits}
+    return jsonify({
+        'hits': hits,
+        'rules': {rid: engine.rules[rid].info() for rid in hit_rules},
+        'events': len(events),
+        'rules_loaded': len(engine.rules),
+        'rules_failed': engine.errors,
+        'evaluations': evaluated,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+@app.route('/api/sigma/retro-hunts', methods=['GET', 'POST'])
+def retro_hunts_collection():
+    """Start a retro-hunt of all stored Sigma rules over local JSONL logs, or list hunts.
+
+    POST {"path": "2024/09", "logsource": {...}} - path is a file or directory
+    under RETRO_HUNT_ROOT; *.jsonl/*.ndjson/*.json/*.log, optionally .gz.
+    """
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        try:
+            path = resolve_path(app.config['RETRO_HUNT_ROOT'], str(data.get('path') or ''))
+        except RetroHuntError as e:
+            return jsonify({'message': str(e)}), 400
+        logsource = data.get('logsource') if isinstance(data.get('logsource'), dict) else None
+        try:
+            hunt = RetroHunt(path=path, logsource=logsource, status='queued')
+            db.session.add(hunt)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'message': 'failed to create retro-hunt', 'error': str(e)}), 400
+        start_hunt(app._get_current_object(), hunt.id)
+        return jsonify(hunt.to_dict()), 202
+
+    try:
+        hunts, next_cursor = paginate(RetroHunt.query, RetroHunt, 50)
+    except CursorError as e:
+        return jsonify({'message': str(e)}), 400
+    return page_response([h.to_dict() for h in hunts], next_cursor)
+
+
+@app.route('/api/sigma/retro-hunts/<int:hunt_id>', methods=['GET'])
+def retro_hunt_detail(hunt_id: int):
+    """Progress of a retro-hunt: bytes done, events, hits, events per second."""
+    return jsonify(RetroHunt.query.get_or_404(hunt_id).to_dict())
+
+
+@app.route('/api/sigma/retro-hunts/<int:hunt_id>/cancel', methods=['POST'])
+def retro_hunt_cancel(hunt_id: int):
+    hunt = RetroHunt.query.get_or_404(hunt_id)
+    if hunt.status in ('queued', 'running'):
+        hunt.status = 'cancelled'
+        db.session.commit()
+    return jsonify(hunt.to_dict())
+
+
+@app.route('/api/sigma/retro-hunts/<int:hunt_id>/hits', methods=['GET'])
+def retro_hunt_hits(hunt_id: int):
+    RetroHunt.query.get_or_404(hunt_id)
+    try:
+        fields = requested_fields(RetroHuntHit)
+        query = projected_query(RetroHuntHit, fields).filter(RetroHuntHit.hunt_id == hunt_id)
+        rule_id = request.args.get('rule_id', type=int)
+        if rule_id is not None:
+            query = query.filter(RetroHuntHit.rule_id == rule_id)
+        rows, next_cursor = paginate(query, RetroHuntHit, 200)
+    except (CursorError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    return page_response([row_to_dict(row, fields) for row in rows], next_cursor)
+
+
 @app.route('/api/virustotal/scan', methods=['POST'])
 def virustotal_scan():
-    """Proxy VirusTotal lookups to keep API key on the server."""
+    """Proxy VirusTotal lookups to keep API key on the server.
+
+    Results are served from the VirusTotal cache when fresh; pass
+    {"refresh": true} to force a new upstream lookup. The X-Cache response
+    header tells where the answer came from (memory, db or miss). When the
+    quota has no token within VT_SCAN_WAIT seconds the answer is 429 with
+    Retry-After instead of holding the request.
+    """
     payload = request.get_json() or {}
     indicator = (payload.get('indicator') or '').strip()
     if not indicator:
         return jsonify({'message': 'Indicator is required'}), 400
 
+    key = normalize_indicator(indicator)
+    if not payload.get('refresh'):
+        cached = vt_cache.get(key)
+        if cached is not None:
+            body, status, source = cached
+            resp = jsonify(body)
+            resp.headers['X-Cache'] = f'HIT-{source.upper()}'
+            return resp, status
+
     api_key = VIRUSTOTAL_API_KEY
     if not api_key:
         return jsonify({'message': 'VirusTotal API key is not configured on the server'}), 500
 
-    headers = {'x-apikey': api_key}
-    
     try:
-        # First, try to get file report by hash
-        if len(indicator) in [32, 40, 64]:  # MD5, SHA-1, or SHA-256
-            try:
-                resp = requests.get(
-                    f'https://www.virustotal.com/api/v3/files/{indicator}',
-                    headers=headers,
-                    timeout=15,
-                )
-                if resp.status_code == 200:
-                    data = resp.json()
-                    return process_vt_response(data, indicator)
-            except requests.RequestException:
-                pass  # Fall through to search if direct lookup fails
-        
-        # If not a hash or hash lookup failed, try search
-        params = {'query': indicator}
-        resp = requests.get(
-            'https://www.virustotal.com/api/v3/search',
-            headers=headers,
-            params=params,
-            timeout=15,
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        
-        hits = data.get('data', [])
-        if not hits:
-            return jsonify({
-                'message': 'No results found in VirusTotal',
-                'indicator': indicator,
-                'found': False
-            }), 404
-            
-        # Get the most relevant result
-        result = hits[0].get('attributes', {})
-        return process_vt_response({'data': {'attributes': result}}, indicator)
-        
-    except requests.RequestException as exc:
-        return jsonify({
-            'message': 'Failed to get response from VirusTotal',
-            'error': str(exc)
-        }), 502
-    except (ValueError, KeyError) as e:
-        return jsonify({
-            'message': 'Invalid response from VirusTotal',
-            'error': str(e)
-        }), 502
-
-def process_vt_response(vt_data, indicator):
-    """Process VirusTotal API response into a standardized format."""
-    try:
-        # Handle direct file report response
-        if 'data' in vt_data and 'attributes' in vt_data['data']:
-            attrs = vt_data['data']['attributes']
-            last_analysis_stats = attrs.get('last_analysis_stats', {})
-            malicious = last_analysis_stats.get('malicious', 0)
-            suspicious = last_analysis_stats.get('suspicious', 0)
-            total = sum(last_analysis_stats.values())
-            detection_ratio = f"{malicious + suspicious}/{total}" if total > 0 else "0/0"
-            
-            # Get top 5 detection engines that marked it as malicious or suspicious
-            engines = []
-            if 'last_analysis_results' in attrs:
-                engines = [
-                    {'engine': k, 'result': v.get('result', 'unknown')}
-                    for k, v in attrs['last_analysis_results'].items()
-                    if v.get('category') in ['malicious', 'suspicious'] or v.get('result') in ['malicious', 'suspicious']
-                ][:5]  # Limit to top 5
-            
-            # Format analysis date if available
-            last_analysis_date = None
-            if 'last_analysis_date' in attrs:
-                try:
-                    last_analysis_date = datetime.utcfromtimestamp(attrs['last_analysis_date']).isoformat() + 'Z'
-                except (TypeError, ValueError):
-                    pass
-            
-            return jsonify({
-                'data': {
-                    'indicator': indicator,
-                    'type': 'file',
-                    'detection_ratio': detection_ratio,
-                    'reputation': attrs.get('reputation', 0),
-                    'last_analysis_date': last_analysis_date,
-                    'engines': engines,
-                    'permalink': f"https://www.virustotal.com/gui/file/{indicator}/detection"
-                }
-            })
-        
-        # Handle search response (shouldn't normally reach here with the current implementation)
-        return jsonify({
-            'message': 'Unexpected response format from VirusTotal',
-            'data': None
-        }), 500
-        
-    except Exception as e:
-        return jsonify({
-            'message': 'Error processing VirusTotal response',
-            'error': str(e)
-        }), 500
+        body, status = vt_client.lookup(key, api_key, wait=app.config['VT_SCAN_WAIT'])
+    except RateLimited as e:
+        resp = jsonify({'message': 'VirusTotal quota exhausted, try again later'})
+        resp.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+        return resp, 429
+    vt_cache.put(key, body, status, app.config['VT_CACHE_TTL'], app.config['VT_CACHE_NEGATIVE_TTL'])
+    resp = jsonify(body)
+    resp.headers['X-Cache'] = 'MISS'
+    return resp, status
+
+
+@app.route('/api/virustotal/scan-batch', methods=['POST'])
+def virustotal_scan_batch():
+    """Look up many indicators, streaming one NDJSON line per indicator.
+
+    Cached answers are emitted first; the rest are fetched concurrently over
+    the pooled client (VT_BATCH_CONCURRENCY workers, paced by the
+    VT_RATE_PER_MINUTE token bucket) and emitted as each one completes.
+    Each line is {"indicator", "status", "cache", "result"}.
+    """
+    payload = request.get_json() or {}
+    raw = payload.get('indicators')
+    if isinstance(raw, str):
+        raw = raw.split()
+    if not isinstance(raw, list):
+        return jsonify({'message': 'indicators must be a list'}), 400
+    keys = list(dict.fromkeys(
+        normalize_indicator(x) for x in raw if isinstance(x, str) and x.strip()
+    ))
+    if not keys:
+        return jsonify({'message': 'indicators are required'}), 400
+    if len(keys) > app.config['VT_BATCH_MAX']:
+        return jsonify({'message': f"at most {app.config['VT_BATCH_MAX']} indicators per batch"}), 400
+
+    refresh = bool(payload.get('refresh'))
+    api_key = VIRUSTOTAL_API_KEY
+    ttl_found = app.config['VT_CACHE_TTL']
+    ttl_not_found = app.config['VT_CACHE_NEGATIVE_TTL']
+    concurrency = max(1, app.config['VT_BATCH_CONCURRENCY'])
+
+    def line(key, body, status, cache):
+        return json_dumps({'indicator': key, 'status': status, 'cache': cache, 'result': body}) + '\n'
+
+    def results():
+        misses = []
+        for key in keys:
+            cached = None if refresh else vt_cache.get(key)
+            if cached is None:
+                misses.append(key)
+            else:
+                body, status, source = cached
+                yield line(key, body, status, source)
+        if not misses:
+            return
+        if not api_key:
+            body = {'message': 'VirusTotal API key is not configured on the server'}
+            for key in misses:
+                yield line(key, body, 500, 'miss')
+            return
+
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='vt-batch')
+        try:
+            futures = {pool.submit(vt_client.lookup, key, api_key): key for key in misses}
+            for future in as_completed(futures):
+                key = futures[future]
+                body, status = future.result()
+                vt_cache.put(key, body, status, ttl_found, ttl_not_found)
+                yield line(key, body, status, 'miss')
+        finally:
+            # client went away: drop the lookups that have not started yet
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/virustotal/cache', methods=['GET', 'DELETE'])
+def virustotal_cache():
+    """Hit/miss statistics of this process' VirusTotal cache; DELETE purges expired rows."""
+    if request.method == 'DELETE':
+        return jsonify({'removed': vt_cache.purge_expired()})
+    return jsonify(vt_cache.stats())
 
 
 @app.route('/api/users/<int:user_id>', methods=['GET'])
@@ -548,7 +1254,11 @@ def update_password(user_id: int):
 
 @app.route('/api/users/<int:user_id>/avatar', methods=['POST'])
 def update_avatar(user_id: int):
-    """Update user avatar (base64 encoded image)"""
+    """Update user avatar (base64 encoded image).
+
+    The image is stored once as thumbnails in `avatar_blobs`; the response
+    and user payloads only carry its /api/avatars/<hash> URL.
+    """
     user = User.query.get_or_404(user_id)
     data = request.get_json() or {}
     avatar = data.get('avatar')
@@ -557,15 +1267,38 @@ def update_avatar(user_id: int):
         return jsonify({'message': 'avatar is required'}), 400
     
     try:
+        raw = decode_avatar(avatar, app.config['AVATAR_MAX_BYTES'])
         profile = _ensure_profile(user)
-        profile.avatar = avatar
+        profile.avatar_hash = store_avatar(raw, app.config['AVATAR_SIZES'])
+        profile.avatar = None
         db.session.commit()
-        return jsonify({'message': 'Avatar updated', 'avatar': avatar}), 200
+        return jsonify({'message': 'Avatar updated', 'avatar': profile.to_dict()['avatar']}), 200
+    except AvatarError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Failed to update avatar: {str(e)}'}), 400
 
 
+@app.route('/api/avatars/<avatar_hash>', methods=['GET'])
+def get_avatar(avatar_hash: str):
+    """Serve an avatar thumbnail; ?size= picks one of AVATAR_SIZES (largest by default)."""
+    sizes = app.config['AVATAR_SIZES']
+    size = request.args.get('size', max(sizes), type=int)
+    if size not in sizes:
+        return jsonify({'message': f"size must be one of {', '.join(map(str, sizes))}"}), 400
+    blob = get_thumbnail(avatar_hash.lower(), size)
+    if blob is None:
+        return jsonify({'message': 'avatar not found'}), 404
+
+    resp = Response(blob.data, mimetype=blob.content_type)
+    # (hash, size) always maps to the same bytes
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    resp.set_etag(f'{blob.hash}-{size}')
+    return resp.make_conditional(request)
+
+
 # ===============================
 # Helpers
 # ===============================
@@ -577,13 +1310,6 @@ def _parse_date(value):
     except Exception:
         return None
 
-def _count_by_month(model, year, month):
-    return db.session.query(model).filter(
-        extract('year', model.created_at) == year,
-        extract('month', model.created_at) == month
-    ).count()
-
-
 def _ensure_profile(user: User, auto_commit=True):
     if user.profile:
         return user.profile
@@ -604,7 +1330,10 @@ def _create_alert(alert_type, message, user_id=None, username=None):
             username=username
         )
         db.session.add(alert)
+        db.session.flush()
+        send_alert_notify(db.session, alert.id)
         db.session.commit()
+        alert_broker.publish(alert.id)
         return alert
     except Exception as e:
         print(f"Error creating alert: {e}")
@@ -617,14 +1346,76 @@ def _create_alert(alert_type, message, user_id=None, username=None):
 # ===============================
 @app.route('/api/alerts', methods=['GET'])
 def get_alerts():
-    """Get all alerts, sorted by newest first"""
+    """Get alerts, newest first, one page at a time.
+
+    With ?since_id=N only alerts with id > N are returned, oldest first, so a
+    client can keep passing the last id it has seen.
+    """
     try:
-        alerts = Alert.query.order_by(Alert.created_at.desc()).limit(100).all()
-        return jsonify([alert.to_dict() for alert in alerts])
+        fields = requested_fields(Alert)
+        query = projected_query(Alert, fields)
+        since_id = request.args.get('since_id', type=int)
+        if since_id is not None:
+            rows = (
+                query.filter(Alert.id > since_id)
+                .order_by(Alert.id.asc())
+                .limit(page_size(100))
+                .all()
+            )
+            return jsonify([row_to_dict(row, fields) for row in rows])
+        rows, next_cursor = paginate(query, Alert, 100)
+        return page_response([row_to_dict(row, fields) for row in rows], next_cursor)
+    except (CursorError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'message': f'Error fetching alerts: {str(e)}'}), 500
 
 
+@app.route('/api/alerts/stream', methods=['GET'])
+def stream_alerts():
+    """Server-Sent Events feed of new alerts.
+
+    Resumes after the Last-Event-ID header (sent by EventSource on reconnect)
+    or ?since_id=N; otherwise starts from the newest existing alert. The
+    backlog after a resume id is read from the database right away, page by
+    page, before the stream starts waiting on the broker, which only knows
+    about alerts announced since this process started.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('since_id', type=int)
+    if last_id is None:
+        last_id = db.session.query(func.max(Alert.id)).scalar() or 0
+    db.session.close()
+    alert_broker.ensure_listener(db.engine)
+
+    def events():
+        nonlocal last_id
+        yield 'retry: 5000\n\n'
+        backlog = True  # read once on connect: a resuming client may be behind
+        while True:
+            if not backlog and not alert_broker.wait(last_id, timeout=SSE_HEARTBEAT_SECONDS):
+                yield ': keepalive\n\n'
+                continue
+            try:
+                rows = Alert.query.filter(Alert.id > last_id).order_by(Alert.id.asc()).limit(100).all()
+                payloads = [(a.id, a.to_dict()) for a in rows]
+            finally:
+                # hand the connection back to the pool between wake-ups
+                db.session.close()
+            # a full page means more may be waiting
+            backlog = len(payloads) == 100
+            for alert_id, payload in payloads:
+                last_id = max(last_id, alert_id)
+                yield format_sse(json_dumps(payload), event_id=alert_id, event='alert')
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 @app.route('/api/alerts/<int:alert_id>', methods=['DELETE'])
 def delete_alert(alert_id):
     """Delete a specific alert"""
@@ -643,9 +1434,32 @@ def delete_alert(alert_id):
 # ===============================
 @app.route('/api/admin/users', methods=['GET'])
 def admin_get_users():
-    """Get all users (admin only)"""
-    users = User.query.order_by(User.created_at.desc()).all()
-    return jsonify([u.to_dict(include_profile=True) for u in users])
+    """List users with profiles (admin only).
+
+    Profiles are joined-eager-loaded, so a page costs one query
+    (ADMIN_USERS_QUERY_BUDGET) regardless of user count. Supports cursor
+    paging (?cursor=, ?limit=) and filtering by ?role= and ?blocked=true|false.
+    """
+    started = query_count()
+    query = User.query.options(joinedload(User.profile))
+    role = request.args.get('role')
+    if role:
+        query = query.filter(func.lower(User.role) == role.lower())
+    blocked = request.args.get('blocked')
+    if blocked is not None:
+        if blocked.lower() not in ('true', 'false', '1', '0'):
+            return jsonify({'message': 'blocked must be true or false'}), 400
+        is_blocked = blocked.lower() in ('true', '1')
+        # NULL is_blocked (rows created before the column existed) counts as not blocked
+        query = query.filter(User.is_blocked.is_(True) if is_blocked else User.is_blocked.isnot(True))
+    try:
+        users, next_cursor = paginate(query, User, 100)
+    except CursorError as e:
+        return jsonify({'message': str(e)}), 400
+
+    items = [u.to_dict(include_profile=True) for u in users]
+    enforce_budget('admin_get_users', started, ADMIN_USERS_QUERY_BUDGET)
+    return page_response(items, next_cursor)
 
 
 @app.route('/api/admin/users', methods=['POST'])
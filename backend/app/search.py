@@ -0,0 +1,52 @@
+"""Ranked search over malware, APT groups, IOCs and reports.
+
+Every predicate here is served by an index: substring matches by the
+pg_trgm GIN indexes on the name-like columns, word matches by the GIN
+indexes on the generated `search_vector` columns, and IOC values in any
+spelling by the index on `coalesce(normalized_value, value)`.
+"""
+from sqlalchemy import case, func, or_
+
+from .models import db, Malware, APTGroup, IOC, Report
+from .normalize import LOOKUP_VALUE, normalize_value
+
+TS_CONFIG = 'simple'
+
+
+def like_pattern(q):
+    """Build a %q% pattern with LIKE wildcards in q escaped."""
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _ranked(model, column, q, limit, with_vector=True, exact=None):
+    pattern = like_pattern(q)
+    score = func.similarity(column, q)
+    predicate = column.ilike(pattern, escape='\\')
+    if exact is not None:
+        # an exact hit ranks first whatever its trigram similarity
+        score = case((exact, 1.0), else_=score)
+        predicate = or_(predicate, exact)
+    if with_vector:
+        tsquery = func.websearch_to_tsquery(TS_CONFIG, q)
+        score = func.greatest(score, func.ts_rank_cd(model.search_vector, tsquery))
+        predicate = or_(predicate, model.search_vector.op('@@')(tsquery))
+    score = score.label('score')
+    rows = db.session.query(model, score).filter(predicate).order_by(score.desc(), model.id.desc()).limit(limit)
+    results = []
+    for obj, value in rows:
+        item = obj.to_dict()
+        item['score'] = round(float(value or 0), 4)
+        results.append(item)
+    return results
+
+
+def search_entities(q, limit=50):
+    """Return {entity: [item + score, ...]} ordered by descending score."""
+    return {
+        'malware': _ranked(Malware, Malware.name, q, limit),
+        'apt_groups': _ranked(APTGroup, APTGroup.name, q, limit),
+        'iocs': _ranked(IOC, IOC.value, q, limit, with_vector=False,
+                        exact=LOOKUP_VALUE == normalize_value(q)),
+        'reports': _ranked(Report, Report.title, q, limit),
+    }
@@ -0,0 +1,509 @@
+"""Sigma rules compiled into Python matchers.
+
+A rule's `detection` block is parsed once: every search identifier
+becomes a predicate over a flattened event ({'a.b': value}), and the
+condition becomes a tree of and/or/not over those predicates. Supported
+field modifiers are listed in MODIFIERS. Aggregations (`| count() ...`)
+are not supported.
+
+SigmaEngine avoids evaluating every rule against every event:
+
+* rules are grouped by logsource, so an event tagged
+  {'product': 'windows'} never reaches linux rules;
+* most rules can only match when some field equals one of a few literal
+  values (EventID: 4688, Image: 'C:\\x.exe', ...). Those "anchors" are
+  taken from the condition tree and put into a field -> value -> rules
+  index, so only rules whose anchor appears in the event are evaluated.
+  Rules without an anchor are evaluated for every event of their
+  logsource.
+
+`parse_rule` validates a rule and returns the JSON form stored in
+sigma_rules.parsed; that is what gets compiled later, so YAML is only
+parsed when a rule is written. `rule_cache` keeps compiled rules by id
+and content hash and builds the engine lazily. The sigma write routes
+invalidate it after commit and, via `send_rules_notify`, in other
+processes too.
+"""
+import fnmatch
+import hashlib
+import ipaddress
+import re
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+
+import yaml
+from sqlalchemy import func, select
+
+from . import pubsub
+from .models import db, SigmaRule
+
+SIGMA_CHANNEL = 'klev_sigma'
+LOGSOURCE_KEYS = ('category', 'product', 'service')
+MODIFIERS = frozenset((
+    'contains', 'startswith', 'endswith', 'all', 'cased',
+    're', 'i', 'm', 's', 'cidr', 'exists', 'lt', 'lte', 'gt', 'gte',
+))
+
+
+class SigmaError(ValueError):
+    pass
+
+
+# ---- values -------------------------------------------------------------------------
+def _norm(value):
+    return str(value).lower()
+
+
+def _has_wildcard(text):
+    return re.search(r'(?<!\\)[*?]', text) is not None
+
+
+def _unescape(text):
+    """`text` with Sigma escapes (\\*, \\?, \\\\) resolved to the literal characters."""
+    return re.sub(r'\\([*?\\])', r'\1', text)
+
+
+def _glob_to_regex(text):
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '\\' and i + 1 < len(text) and text[i + 1] in '*?\\':
+            out.append(re.escape(text[i + 1]))
+            i += 2
+            continue
+        out.append('.*' if c == '*' else '.' if c == '?' else re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _value_predicate(value, mods):
+    """Predicate for one scalar of the event against one Sigma value."""
+    if value is None:
+        return lambda x: x is None
+
+    if 're' in mods:
+        flags = (re.IGNORECASE if 'i' in mods else 0) | (re.MULTILINE if 'm' in mods else 0) \
+            | (re.DOTALL if 's' in mods else 0)
+        try:
+            rx = re.compile(str(value), flags)
+        except re.error as e:
+            raise SigmaError(f'bad regex {value!r}: {e}')
+        return lambda x: x is not None and rx.search(str(x)) is not None
+
+    if 'cidr' in mods:
+        try:
+            net = ipaddress.ip_network(str(value), strict=False)
+        except ValueError:
+            raise SigmaError(f'bad cidr {value!r}')
+
+        def in_net(x):
+            try:
+                return ipaddress.ip_address(str(x)) in net
+            except ValueError:
+                return False
+        return in_net
+
+    for op, test in (('lt', float.__lt__), ('lte', float.__le__), ('gt', float.__gt__), ('gte', float.__ge__)):
+        if op in mods:
+            bound = _number(value)
+            if bound is None:
+                raise SigmaError(f'{op} needs a number, got {value!r}')
+            return lambda x, bound=bound, test=test: (_number(x) is not None and test(_number(x), bound))
+
+    cased = 'cased' in mods
+    text = str(value).lower() if isinstance(value, bool) else str(value)
+    prefix = 'contains' in mods or 'endswith' in mods
+    suffix = 'contains' in mods or 'startswith' in mods
+
+    if _has_wildcard(text):
+        pattern = ('.*' if prefix else '') + _glob_to_regex(text) + ('.*' if suffix else '')
+        rx = re.compile(pattern, re.DOTALL | (0 if cased else re.IGNORECASE))
+        return lambda x: x is not None and rx.fullmatch(str(x)) is not None
+
+    text = _unescape(text)
+    needle = text if cased else text.lower()
+    fold = str if cased else _norm
+    if prefix and suffix:
+        return lambda x: x is not None and needle in fold(x)
+    if suffix:
+        return lambda x: x is not None and fold(x).startswith(needle)
+    if prefix:
+        return lambda x: x is not None and fold(x).endswith(needle)
+    return lambda x: x is not None and fold(x) == needle
+
+
+# ---- search identifiers -------------------------------------------------------------------
+def _compile_field(key, values):
+    """(predicate, anchors) for one `field|mod|mod: value(s)` entry."""
+    field, *mods = str(key).split('|')
+    mods = {m.lower() for m in mods}
+    unknown = mods - MODIFIERS
+    if unknown:
+        raise SigmaError(f"unsupported modifier(s) {', '.join(sorted(unknown))} on {field}")
+    if not isinstance(values, list):
+        values = [values]
+
+    if 'exists' in mods:
+        want = bool(values[0]) if values else True
+        return (lambda flat: (flat.get(field) is not None) == want), None
+
+    preds = [_value_predicate(v, mods) for v in values]
+    combine = all if 'all' in mods else any
+
+    def match(flat):
+        actual = flat.get(field)
+        items = actual if isinstance(actual, list) else (actual,)
+        return combine(any(p(x) for x in items) for p in preds)
+
+    anchors = None
+    if not mods and values and all(
+        isinstance(v, (str, int, float, bool)) and not (isinstance(v, str) and _has_wildcard(v))
+        for v in values
+    ):
+        anchors = frozenset((field, _norm(_unescape(v) if isinstance(v, str) else v)) for v in values)
+    return match, anchors
+
+
+def _compile_map(mapping):
+    if not mapping:
+        raise SigmaError('empty selection')
+    compiled = [_compile_field(k, v) for k, v in mapping.items()]
+    preds = [p for p, _ in compiled]
+    anchored = [a for _, a in compiled if a]
+    return (lambda flat: all(p(flat) for p in preds)), (min(anchored, key=len) if anchored else None)
+
+
+def _iter_values(flat):
+    for value in flat.values():
+        if isinstance(value, list):
+            yield from value
+        else:
+            yield value
+
+
+def _compile_search(name, body):
+    if isinstance(body, dict):
+        return _compile_map(body)
+    if isinstance(body, list) and body and all(isinstance(x, dict) for x in body):
+        compiled = [_compile_map(x) for x in body]
+        preds = [p for p, _ in compiled]
+        anchors = [a for _, a in compiled]
+        union = None if any(a is None for a in anchors) else frozenset().union(*anchors)
+        return (lambda flat: any(p(flat) for p in preds)), union
+    if isinstance(body, (list, str, int)):
+        # keyword search: any value of the event contains any keyword
+        words = body if isinstance(body, list) else [body]
+        preds = [_value_predicate(w, {'contains'}) for w in words]
+        return (lambda flat: any(p(x) for x in _iter_values(flat) for p in preds)), None
+    raise SigmaError(f'cannot interpret search identifier {name!r}')
+
+
+# ---- condition ------------------------------------------------------------------------------
+_TOKEN = re.compile(r'\(|\)|[^\s()]+')
+
+
+def _parse_condition(text, names):
+    tokens = _TOKEN.findall(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos].lower() if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def targets(pattern):
+        if pattern.lower() == 'them':
+            found = [n for n in names if not n.startswith('_')]
+        else:
+            found = [n for n in names if fnmatch.fnmatchcase(n, pattern)]
+        if not found:
+            raise SigmaError(f'condition refers to unknown {pattern!r}')
+        return [('id', n) for n in found]
+
+    def primary():
+        tok = peek()
+        if tok is None:
+            raise SigmaError('unexpected end of condition')
+        if tok == '(':
+            take()
+            node = expr()
+            if peek() != ')':
+                raise SigmaError('unbalanced parentheses in condition')
+            take()
+            return node
+        if tok in ('1', 'any', 'all') and pos + 1 < len(tokens) and tokens[pos + 1].lower() == 'of':
+            take()
+            take()
+            if peek() is None:
+                raise SigmaError('"of" needs a target')
+            return ('and' if tok == 'all' else 'or', targets(take()))
+        if tok == '|':
+            raise SigmaError('aggregation conditions are not supported')
+        name = take()
+        if name not in names:
+            raise SigmaError(f'condition refers to unknown {name!r}')
+        return ('id', name)
+
+    def negation():
+        if peek() == 'not':
+            take()
+            return ('not', negation())
+        return primary()
+
+    def conjunction():
+        nodes = [negation()]
+        while peek() == 'and':
+            take()
+            nodes.append(negation())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def expr():
+        nodes = [conjunction()]
+        while peek() == 'or':
+            take()
+            nodes.append(conjunction())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    node = expr()
+    if pos != len(tokens):
+        raise SigmaError(f'unexpected {tokens[pos]!r} in condition')
+    return node
+
+
+def _compile_node(node, searches):
+    op = node[0]
+    if op == 'id':
+        return searches[node[1]][0]
+    if op == 'not':
+        inner = _compile_node(node[1], searches)
+        return lambda flat: not inner(flat)
+    preds = [_compile_node(child, searches) for child in node[1]]
+    if op == 'and':
+        return lambda flat: all(p(flat) for p in preds)
+    return lambda flat: any(p(flat) for p in preds)
+
+
+def _node_anchors(node, searches):
+    """Literal (field, value) pairs of which at least one must be present for a match."""
+    op = node[0]
+    if op == 'id':
+        return searches[node[1]][1]
+    if op == 'not':
+        return None
+    children = [_node_anchors(child, searches) for child in node[1]]
+    if op == 'and':
+        known = [a for a in children if a is not None]
+        return min(known, key=len) if known else None
+    if any(a is None for a in children):
+        return None
+    return frozenset().union(*children)
+
+
+# ---- rules -------------------------------------------------------------------------------------
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _plain(value):
+    """YAML scalars JSONB cannot hold (dates) as strings."""
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def parse_rule(content):
+    """Parse and validate one rule; returns the JSON-safe document stored in `parsed`."""
+    try:
+        doc = yaml.load(content, Loader=_YAML_LOADER)
+    except yaml.YAMLError as e:
+        raise SigmaError(f'invalid YAML: {e}')
+    if not isinstance(doc, dict):
+        raise SigmaError('rule is not a YAML mapping')
+    doc = _plain(doc)
+    CompiledRule(None, None, doc)
+    return doc
+
+
+class CompiledRule:
+    __slots__ = ('id', 'name', 'title', 'level', 'logsource', 'match', 'anchors')
+
+    def __init__(self, rule_id, name, doc):
+        if not isinstance(doc, dict) or not isinstance(doc.get('detection'), dict):
+            raise SigmaError('rule has no detection block')
+
+        detection = dict(doc['detection'])
+        condition = detection.pop('condition', None)
+        if not condition:
+            raise SigmaError('detection has no condition')
+        searches = {name_: _compile_search(name_, body) for name_, body in detection.items()}
+        conditions = condition if isinstance(condition, list) else [condition]
+        tree = [_parse_condition(str(c), list(searches)) for c in conditions]
+        tree = tree[0] if len(tree) == 1 else ('or', tree)
+
+        logsource = doc.get('logsource') or {}
+        self.id = rule_id
+        self.name = name
+        self.title = doc.get('title') or name
+        self.level = doc.get('level')
+        self.logsource = tuple(
+            _norm(logsource[k]) if logsource.get(k) is not None else None for k in LOGSOURCE_KEYS
+        )
+        self.match = _compile_node(tree, searches)
+        self.anchors = _node_anchors(tree, searches)
+
+    def info(self):
+        return {'id': self.id, 'name': self.name, 'title': self.title, 'level': self.level}
+
+
+def flatten_event(event, prefix='', out=None):
+    out = {} if out is None else out
+    for key, value in event.items():
+        if isinstance(value, dict):
+            flatten_event(value, f'{prefix}{key}.', out)
+        else:
+            out[f'{prefix}{key}'] = value
+    return out
+
+
+def event_logsource(event, default=None):
+    source = event.get('logsource') if isinstance(event.get('logsource'), dict) else default or {}
+    return tuple(_norm(source[k]) if source.get(k) is not None else None for k in LOGSOURCE_KEYS)
+
+
+class SigmaEngine:
+    def __init__(self, rules, errors=None):
+        self.rules = {r.id: r for r in rules}
+        self.errors = errors or {}
+        self._unanchored = [r.id for r in rules if r.anchors is None]
+        self._index = defaultdict(lambda: defaultdict(list))
+        for r in rules:
+            for field, value in r.anchors or ():
+                self._index[field][value].append(r.id)
+        self._index = {field: dict(values) for field, values in self._index.items()}
+        self._allowed = {}
+
+    def _allowed_for(self, source):
+        """(unanchored rule ids, set of all rule ids) applicable to an event logsource."""
+        allowed = self._allowed.get(source)
+        if allowed is None:
+            ids = {
+                r.id for r in self.rules.values()
+                if all(want is None or have is None or want == have for want, have in zip(r.logsource, source))
+            }
+            allowed = ([rid for rid in self._unanchored if rid in ids], ids)
+            self._allowed[source] = allowed
+        return allowed
+
+    def candidates(self, flat, source):
+        unanchored, allowed = self._allowed_for(source)
+        found = set()
+        index = self._index
+        for field, value in flat.items():
+            values = index.get(field)
+            if values is None:
+                continue
+            for item in (value if isinstance(value, list) else (value,)):
+                found.update(values.get(_norm(item), ()))
+        return unanchored + [rid for rid in found if rid in allowed]
+
+    def match_event(self, event, default_logsource=None):
+        """(ids of matching rules, number of rules evaluated) for one event."""
+        flat = flatten_event(event)
+        hits = []
+        candidates = self.candidates(flat, event_logsource(event, default_logsource))
+        for rid in candidates:
+            if self.rules[rid].match(flat):
+                hits.append(rid)
+        return hits, len(candidates)
+
+    def stats(self):
+        return {
+            'rules': len(self.rules),
+            'anchored': len(self.rules) - len(self._unanchored),
+            'unanchored': len(self._unanchored),
+            'indexed_fields': len(self._index),
+            'errors': self.errors,
+        }
+
+
+class RuleCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # rule id -> (content_hash (sha256), or md5(content) for rows without one; CompiledRule or SigmaError)
+        self._compiled = {}
+        self._engine = None
+
+    def invalidate(self, _payload=None):
+        with self._lock:
+            self._engine = None
+
+    def ensure_listener(self, engine):
+        pubsub.listener.subscribe(SIGMA_CHANNEL, self.invalidate)
+        pubsub.listener.ensure_started(engine)
+
+    def engine(self):
+        """Current SigmaEngine; only rules whose content changed are recompiled."""
+        with self._lock:
+            if self._engine is not None:
+                return self._engine
+            digest = func.coalesce(SigmaRule.content_hash, func.md5(SigmaRule.content))
+            current = db.session.execute(select(SigmaRule.id, SigmaRule.name, digest)).all()
+            stale = [rid for rid, _, h in current if self._compiled.get(rid, (None,))[0] != h]
+            docs = {
+                rid: (parsed, content) for rid, parsed, content in db.session.execute(
+                    select(SigmaRule.id, SigmaRule.parsed, SigmaRule.content).where(SigmaRule.id.in_(stale))
+                )
+            } if stale else {}
+
+            compiled = {}
+            for rid, name, digest in current:
+                if rid in docs:
+                    parsed, content = docs[rid]
+                    try:
+                        doc = parsed if parsed is not None else parse_rule(content)
+                        compiled[rid] = (digest, CompiledRule(rid, name, doc))
+                    except SigmaError as e:
+                        compiled[rid] = (digest, e)
+                else:
+                    compiled[rid] = self._compiled[rid]
+            self._compiled = compiled
+
+            rules = [c for _, c in compiled.values() if isinstance(c, CompiledRule)]
+            errors = {rid: str(c) for rid, (_, c) in compiled.items() if isinstance(c, SigmaError)}
+            self._engine = SigmaEngine(rules, errors)
+            return self._engine
+
+
+rule_cache = RuleCache()
+
+
+def start(app):
+    """Drop the compiled rules whenever another process changes sigma_rules."""
+    with app.app_context():
+        rule_cache.ensure_listener(db.engine)
+
+
+def send_rules_notify(session):
+    """Queue a NOTIFY telling other processes to drop their compiled rules; sent on commit."""
+    pubsub.notify(session, SIGMA_CHANNEL, 'changed')
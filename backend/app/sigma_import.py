@@ -0,0 +1,189 @@
+"""Bulk import of Sigma rules from a ZIP or tar archive (e.g. a SigmaHQ checkout).
+
+Every *.yml / *.yaml member is read straight from the archive and hashed.
+Files whose content already exists, in the archive or in sigma_rules, are
+counted as duplicates and never parsed. The rest are parsed and validated
+with sigma.parse_rule, in a process pool once there are enough of them.
+Valid rules are inserted BATCH_SIZE per transaction with
+ON CONFLICT (content_hash) DO NOTHING, so concurrent imports cannot
+create duplicates either.
+"""
+import multiprocessing
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, SigmaRule
+from .rollups import track_insert
+from .sigma import SigmaError, content_hash, parse_rule, rule_cache, send_rules_notify
+
+RULE_SUFFIXES = ('.yml', '.yaml')
+MAX_RULE_BYTES = 1 << 20
+BATCH_SIZE = 500
+PARALLEL_MIN_RULES = 500
+MAX_ERRORS = 200
+SPOOL_BYTES = 8 << 20
+COPY_CHUNK = 1 << 20
+
+
+class SigmaImportError(ValueError):
+    pass
+
+
+def spool_upload(stream, max_bytes):
+    """Copy `stream` into a seekable temporary file, kept in memory up to SPOOL_BYTES.
+
+    Raises SigmaImportError once more than `max_bytes` have been read.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    total = 0
+    while True:
+        chunk = stream.read(COPY_CHUNK)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            spool.close()
+            raise SigmaImportError(f'archive is larger than {max_bytes >> 20} MB')
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def iter_archive(fileobj, max_bytes):
+    """(path, bytes or None) for every rule file in a ZIP or (compressed) tar stream.
+
+    None marks a member over MAX_RULE_BYTES. Stops with SigmaImportError once
+    more than `max_bytes` would be unpacked.
+    """
+    total = 0
+
+    def budget(size):
+        nonlocal total
+        total += size
+        if total > max_bytes:
+            raise SigmaImportError(f'archive unpacks to more than {max_bytes >> 20} MB')
+
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(RULE_SUFFIXES):
+                    continue
+                if info.file_size > MAX_RULE_BYTES:
+                    yield info.filename, None
+                    continue
+                budget(info.file_size)
+                yield info.filename, zf.read(info)
+        return
+
+    fileobj.seek(0)
+    try:
+        tf = tarfile.open(fileobj=fileobj, mode='r:*')
+    except tarfile.TarError:
+        raise SigmaImportError('expected a ZIP or tar archive')
+    with tf:
+        for member in tf:
+            if not member.isfile() or not member.name.lower().endswith(RULE_SUFFIXES):
+                continue
+            if member.size > MAX_RULE_BYTES:
+                yield member.name, None
+                continue
+            budget(member.size)
+            yield member.name, tf.extractfile(member).read()
+
+
+def _parse_job(text):
+    try:
+        return parse_rule(text), None
+    except SigmaError as e:
+        return None, str(e)
+
+
+def _row(path, text, digest, doc):
+    title = str(doc.get('title') or os.path.splitext(os.path.basename(path))[0])
+    description = doc.get('description')
+    return {
+        'name': title[:200],
+        'description': str(description) if description is not None else None,
+        'filename': path[-255:],
+        'content': text,
+        'content_hash': digest,
+        'parsed': doc,
+    }
+
+
+def import_archive(fileobj, max_bytes, workers=None):
+    started = time.perf_counter()
+    stats = {'files': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'errors': []}
+
+    def reject(path, error):
+        stats['invalid'] += 1
+        if len(stats['errors']) < MAX_ERRORS:
+            stats['errors'].append({'file': path, 'error': error})
+
+    unique = {}
+    for path, raw in iter_archive(fileobj, max_bytes):
+        stats['files'] += 1
+        if raw is None:
+            reject(path, 'file too large')
+            continue
+        try:
+            text = raw.decode('utf-8-sig').strip()
+        except UnicodeDecodeError:
+            reject(path, 'not UTF-8')
+            continue
+        if not text:
+            reject(path, 'empty file')
+            continue
+        digest = content_hash(text)
+        if digest in unique:
+            stats['duplicates'] += 1
+            continue
+        unique[digest] = (path, text)
+
+    digests = list(unique)
+    existing = set()
+    for i in range(0, len(digests), 1000):
+        existing.update(db.session.execute(
+            select(SigmaRule.content_hash).where(SigmaRule.content_hash.in_(digests[i:i + 1000]))
+        ).scalars())
+    todo = [(digest, path, text) for digest, (path, text) in unique.items() if digest not in existing]
+    stats['duplicates'] += len(unique) - len(todo)
+
+    texts = [text for _, _, text in todo]
+    workers = workers or os.cpu_count() or 1
+    if len(todo) >= PARALLEL_MIN_RULES and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            parsed = list(pool.map(_parse_job, texts, chunksize=max(1, len(texts) // (workers * 4))))
+    else:
+        parsed = [_parse_job(text) for text in texts]
+
+    rows = []
+    for (digest, path, text), (doc, error) in zip(todo, parsed):
+        if error:
+            reject(path, error)
+        else:
+            rows.append(_row(path, text, digest, doc))
+
+    for i in range(0, len(rows), BATCH_SIZE):
+        stmt = pg_insert(SigmaRule.__table__).values(rows[i:i + BATCH_SIZE]).on_conflict_do_nothing(
+            index_elements=[SigmaRule.__table__.c.content_hash]
+        ).returning(SigmaRule.__table__.c.id)
+        inserted = len(db.session.execute(stmt).all())
+        track_insert('sigma_rules', inserted)
+        send_rules_notify(db.session)
+        db.session.commit()
+        stats['imported'] += inserted
+        stats['duplicates'] += min(BATCH_SIZE, len(rows) - i) - inserted
+    if rows:
+        rule_cache.invalidate()
+
+    stats['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
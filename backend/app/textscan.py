@@ -0,0 +1,236 @@
+"""Aho-Corasick scanning of raw text for every indexed IOC value.
+
+All IOC values are compiled into one automaton, so a scan is a single pass
+over the input whatever the number of patterns. The C automaton from
+pyahocorasick is used when it is installed; _PyAutomaton is a slower
+stand-in with the same interface.
+
+Matching ignores ASCII case. A match is only reported when it is not glued
+to letters or digits: `1.2.3.4` is not found inside `11.2.3.45`.
+
+TextScanner is the IOC index engine (see ioc_index). It keeps a large
+`main` automaton and a small `delta` automaton for values added since
+`main` was built. finish() rebuilds only the delta. Once the delta or the
+number of removed values passes DELTA_MAX, `main` is rebuilt in a
+background thread and swapped in. Removed values can stay in the automata
+until then; matches are resolved through `patterns`, which never holds them.
+"""
+import codecs
+import re
+import threading
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+MIN_PATTERN = 4
+MAX_PATTERN = 2048
+DELTA_MAX = 20000
+CHUNK_BYTES = 1 << 20
+MAX_HASH_TOKENS = 10000
+
+_WORD = frozenset('abcdefghijklmnopqrstuvwxyz0123456789')
+_HASH_TOKEN = re.compile(r'(?<![0-9a-f])(?:[0-9a-f]{128}|[0-9a-f]{64}|[0-9a-f]{40}|[0-9a-f]{32})(?![0-9a-f])')
+
+
+def pattern_key(value):
+    """ASCII-lowercased, stripped `value`, or None if it is too short or too long to scan for."""
+    if not isinstance(value, str):
+        return None
+    key = value.strip().encode('utf-8', 'surrogatepass').lower().decode('utf-8', 'replace')
+    return key if MIN_PATTERN <= len(key) <= MAX_PATTERN else None
+
+
+class _PyAutomaton:
+    """Pure-Python subset of ahocorasick.Automaton: add_word, make_automaton, iter."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+
+    def add_word(self, key, value):
+        state = 0
+        for ch in key:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state = nxt
+        self.out[state] = (value,)
+
+    def make_automaton(self):
+        goto, fail, out = self.goto, self.fail, self.out
+        queue = list(goto[0].values())
+        for state in queue:
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+    def iter(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for value in out[state]:
+                yield i, value
+
+
+def build_automaton(keys):
+    """Automaton yielding (end index, key) for `keys`, or None when there are none."""
+    automaton = ahocorasick.Automaton() if ahocorasick is not None else _PyAutomaton()
+    empty = True
+    for key in keys:
+        automaton.add_word(key, key)
+        empty = False
+    if empty:
+        return None
+    automaton.make_automaton()
+    return automaton
+
+
+class TextScanner:
+    def __init__(self):
+        self.patterns = {}
+        self.main = None
+        self.main_keys = frozenset()
+        self.delta = None
+        self.delta_keys = set()
+        self.stale = 0
+        self.max_len = 0
+        self.builds = 0
+        self._dirty = False
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def add(self, ioc_id, ioc_type, value):
+        key = pattern_key(value)
+        if key is None:
+            return
+        with self._lock:
+            self.patterns.setdefault(key, {})[ioc_id] = (ioc_type, value)
+            if key not in self.main_keys and key not in self.delta_keys:
+                self.delta_keys.add(key)
+                self.max_len = max(self.max_len, len(key))
+                self._dirty = True
+
+    def remove(self, ioc_id, ioc_type, value):
+        key = pattern_key(value)
+        with self._lock:
+            entry = self.patterns.get(key)
+            if entry is None or entry.pop(ioc_id, None) is None or entry:
+                return
+            del self.patterns[key]
+            if key in self.delta_keys:
+                self.delta_keys.discard(key)
+                self._dirty = True
+            else:
+                self.stale += 1
+
+    def finish(self):
+        """Make the automata reflect add/remove calls so far (the delta at least)."""
+        with self._lock:
+            rebuild = None
+            if not self._rebuilding:
+                if self.main is None and self.patterns:
+                    rebuild = 'now'  # first build: there is nothing to serve from yet
+                elif len(self.delta_keys) + self.stale > DELTA_MAX:
+                    rebuild = 'background'
+            if rebuild:
+                self._rebuilding = True
+            if rebuild != 'now' and self._dirty:
+                self.delta = build_automaton(self.delta_keys)
+                self._dirty = False
+        if rebuild == 'now':
+            self._rebuild_main()
+        elif rebuild == 'background':
+            threading.Thread(target=self._rebuild_main, name='ioc-scan-rebuild', daemon=True).start()
+
+    def _rebuild_main(self):
+        with self._lock:
+            keys = list(self.patterns)
+        automaton = build_automaton(keys)
+        with self._lock:
+            self.main = automaton
+            self.main_keys = frozenset(keys)
+            self.delta_keys = {key for key in self.delta_keys if key not in self.main_keys and key in self.patterns}
+            self.delta = build_automaton(self.delta_keys)
+            self.stale = 0
+            self.max_len = max(map(len, self.patterns), default=0)
+            self.builds += 1
+            self._dirty = False
+            self._rebuilding = False
+
+    def _snapshot(self):
+        with self._lock:
+            return [a for a in (self.main, self.delta) if a is not None], self.max_len
+
+    def scan(self, chunks, hash_tokens=None):
+        """Yield (offset, ioc_id, type, value) for every IOC occurrence in a stream of byte chunks.
+
+        Offsets count characters of the decoded text. When `hash_tokens` is a
+        set, hash-shaped tokens of the input are collected into it as well.
+        """
+        automata, max_len = self._snapshot()
+        overlap = max(max_len, 128) + 1
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        patterns = self.patterns
+        carry = ''
+        base = 0
+        chunks = (chunk for chunk in chunks if chunk)
+        chunk = next(chunks, b'')
+        while True:
+            following = next(chunks, None) if chunk else None
+            final = following is None
+            buf = carry + decoder.decode(chunk.lower(), final)
+            seen = len(carry)
+            size = len(buf)
+            limit = size if final else size - 1
+
+            hits = []
+            for automaton in automata:
+                for end, key in automaton.iter(buf):
+                    if end < seen - 1 or end >= limit:
+                        continue
+                    start = end - len(key) + 1
+                    if key[0] in _WORD and start and buf[start - 1] in _WORD:
+                        continue
+                    if key[-1] in _WORD and end + 1 < size and buf[end + 1] in _WORD:
+                        continue
+                    hits.append((start, key))
+            hits.sort()
+            for start, key in hits:
+                for ioc_id, (ioc_type, value) in tuple((patterns.get(key) or {}).items()):
+                    yield base + start, ioc_id, ioc_type, value
+
+            if hash_tokens is not None and len(hash_tokens) < MAX_HASH_TOKENS:
+                for m in _HASH_TOKEN.finditer(buf, max(seen - 129, 0)):
+                    if seen <= m.end() and (final or m.end() < size):
+                        hash_tokens.add(m.group(0))
+
+            if final:
+                return
+            keep = min(overlap, size)
+            base += size - keep
+            carry = buf[size - keep:]
+            chunk = following
+
+    def stats(self):
+        return {
+            'patterns': len(self.patterns),
+            'main': len(self.main_keys),
+            'delta': len(self.delta_keys),
+            'stale': self.stale,
+            'builds': self.builds,
+            'engine': 'pyahocorasick' if ahocorasick is not None else 'python',
+        }
@@ -0,0 +1,319 @@
+"""VirusTotal v3 lookups with a two-level result cache.
+
+Processed lookup results (the output of `process_vt_response`, plus the
+"not found" answer) are kept in a process-local LRU in front of the
+`vt_cache` table. Found and not-found results have separate TTLs.
+Transport and upstream errors are never cached.
+
+Upstream calls go through `VTClient`, which keeps one pooled HTTP session
+per process and paces requests with a token bucket sized to the API
+key's per-minute quota. Interactive lookups wait a bounded time for a
+token and raise RateLimited past it; only the batch pool waits for as long
+as it takes.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from types import SimpleNamespace
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, VTCacheEntry
+
+VT_BASE_URL = 'https://www.virustotal.com/api/v3'
+HASH_RE = re.compile(r'^(?:[0-9a-fA-F]{32}|[0-9a-fA-F]{40}|[0-9a-fA-F]{64})$')
+
+
+def normalize_indicator(indicator):
+    """Cache key for an indicator: trimmed, hex hashes lower-cased."""
+    indicator = (indicator or '').strip()
+    if HASH_RE.match(indicator):
+        return indicator.lower()
+    return indicator
+
+
+def process_vt_response(vt_data, indicator):
+    """Process VirusTotal API response into a standardized format.
+
+    Returns a (payload, status) pair.
+    """
+    try:
+        # Handle direct file report response
+        if 'data' in vt_data and 'attributes' in vt_data['data']:
+            attrs = vt_data['data']['attributes']
+            last_analysis_stats = attrs.get('last_analysis_stats', {})
+            malicious = last_analysis_stats.get('malicious', 0)
+            suspicious = last_analysis_stats.get('suspicious', 0)
+            total = sum(last_analysis_stats.values())
+            detection_ratio = f"{malicious + suspicious}/{total}" if total > 0 else "0/0"
+
+            # Get top 5 detection engines that marked it as malicious or suspicious
+            engines = []
+            if 'last_analysis_results' in attrs:
+                engines = [
+                    {'engine': k, 'result': v.get('result', 'unknown')}
+                    for k, v in attrs['last_analysis_results'].items()
+                    if v.get('category') in ['malicious', 'suspicious'] or v.get('result') in ['malicious', 'suspicious']
+                ][:5]  # Limit to top 5
+
+            # Format analysis date if available
+            last_analysis_date = None
+            if 'last_analysis_date' in attrs:
+                try:
+                    last_analysis_date = datetime.utcfromtimestamp(attrs['last_analysis_date']).isoformat() + 'Z'
+                except (TypeError, ValueError):
+                    pass
+
+            return {
+                'data': {
+                    'indicator': indicator,
+                    'type': 'file',
+                    'detection_ratio': detection_ratio,
+                    'reputation': attrs.get('reputation', 0),
+                    'last_analysis_date': last_analysis_date,
+                    'engines': engines,
+                    'permalink': f"https://www.virustotal.com/gui/file/{indicator}/detection"
+                }
+            }, 200
+
+        # Handle search response (shouldn't normally reach here with the current implementation)
+        return {
+            'message': 'Unexpected response format from VirusTotal',
+            'data': None
+        }, 500
+
+    except Exception as e:
+        return {
+            'message': 'Error processing VirusTotal response',
+            'error': str(e)
+        }, 500
+
+
+def lookup(indicator, api_key, session=None, base_url=VT_BASE_URL):
+    """Query VirusTotal for one indicator and return (payload, status)."""
+    http = session or requests
+    headers = {'x-apikey': api_key}
+
+    try:
+        # First, try to get file report by hash
+        if len(indicator) in [32, 40, 64]:  # MD5, SHA-1, or SHA-256
+            try:
+                resp = http.get(f'{base_url}/files/{indicator}', headers=headers, timeout=15)
+                if resp.status_code == 200:
+                    return process_vt_response(resp.json(), indicator)
+            except requests.RequestException:
+                pass  # Fall through to search if direct lookup fails
+
+        # If not a hash or hash lookup failed, try search
+        resp = http.get(f'{base_url}/search', headers=headers, params={'query': indicator}, timeout=15)
+        resp.raise_for_status()
+        data = resp.json()
+
+        hits = data.get('data', [])
+        if not hits:
+            return {
+                'message': 'No results found in VirusTotal',
+                'indicator': indicator,
+                'found': False
+            }, 404
+
+        # Get the most relevant result
+        result = hits[0].get('attributes', {})
+        return process_vt_response({'data': {'attributes': result}}, indicator)
+
+    except requests.RequestException as exc:
+        return {
+            'message': 'Failed to get response from VirusTotal',
+            'error': str(exc)
+        }, 502
+    except (ValueError, KeyError) as e:
+        return {
+            'message': 'Invalid response from VirusTotal',
+            'error': str(e)
+        }, 502
+
+
+class RateLimited(Exception):
+    """No VirusTotal quota within the caller's wait; a token is due in `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'VirusTotal quota exhausted, retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate_per_minute` tokens, refilled continuously."""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, rate_per_minute)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting up to `timeout` seconds (None: indefinitely).
+
+        Returns False when no token came in time. A rate of 0 means unlimited.
+        """
+        if self.rate <= 0:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def delay(self):
+        """Seconds until the next token is due (0 if one is available now)."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.0)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (upstream said 429)."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class VTClient:
+    """Pooled, quota-aware HTTP client for the VirusTotal v3 API."""
+
+    MAX_429_RETRIES = 2
+
+    def __init__(self, base_url=VT_BASE_URL, rate_per_minute=4, pool_size=4):
+        self.base_url = base_url.rstrip('/')
+        self.limiter = TokenBucket(rate_per_minute)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, wait=None, **kwargs):
+        """GET `url` within the quota; raises RateLimited if no token comes within `wait` seconds."""
+        for attempt in range(self.MAX_429_RETRIES + 1):
+            if not self.limiter.acquire(timeout=wait):
+                raise RateLimited(self.limiter.delay())
+            resp = self.session.get(url, **kwargs)
+            if resp.status_code != 429 or attempt == self.MAX_429_RETRIES:
+                return resp
+            try:
+                retry_after = float(resp.headers.get('Retry-After', 60))
+            except ValueError:
+                retry_after = 60.0
+            self.limiter.pause(retry_after)
+        return resp
+
+    def lookup(self, indicator, api_key, wait=None):
+        """`lookup` over the pooled session; see `get` for `wait`."""
+        http = self if wait is None else SimpleNamespace(get=partial(self.get, wait=wait))
+        return lookup(indicator, api_key, session=http, base_url=self.base_url)
+
+
+class VTCache:
+    """LRU over the `vt_cache` table; only 200 and 404 results are stored."""
+
+    CACHEABLE = (200, 404)
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _remember(self, key, payload, status, expires_at):
+        with self._lock:
+            self._entries[key] = (payload, status, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Return (payload, status, source) or None; source is 'memory' or 'db'."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return entry[0], entry[1], 'memory'
+                del self._entries[key]
+
+        row = db.session.get(VTCacheEntry, key)
+        if row is not None and row.expires_at > now:
+            self._remember(key, row.payload, row.status, row.expires_at)
+            self._count('db_hits')
+            return row.payload, row.status, 'db'
+
+        self._count('misses')
+        return None
+
+    def put(self, key, payload, status, ttl_found, ttl_not_found):
+        if status not in self.CACHEABLE:
+            return
+        ttl = ttl_found if status == 200 else ttl_not_found
+        if ttl <= 0:
+            return
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        table = VTCacheEntry.__table__
+        stmt = pg_insert(table).values(indicator=key, status=status, payload=payload, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.indicator],
+            set_={
+                'status': stmt.excluded.status,
+                'payload': stmt.excluded.payload,
+                'fetched_at': func.now(),
+                'expires_at': stmt.excluded.expires_at,
+            },
+        )
+        try:
+            db.session.execute(stmt)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error storing VirusTotal cache entry: {e}")
+        self._remember(key, payload, status, expires_at)
+        self._count('stores')
+
+    def purge_expired(self):
+        """Drop expired rows from `vt_cache`; returns the number removed."""
+        removed = VTCacheEntry.query.filter(
+            VTCacheEntry.expires_at <= datetime.now(timezone.utc)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['memory_entries'] = len(self._entries)
+        lookups = data['memory_hits'] + data['db_hits'] + data['misses']
+        data['hit_ratio'] = round((data['memory_hits'] + data['db_hits']) / lookups, 4) if lookups else None
+        return data
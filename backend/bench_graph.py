@@ -0,0 +1,62 @@
+"""Compare pivot latency: in-memory adjacency index vs SQL joins.
+
+Usage: python bench_graph.py [pivots] [path]   e.g. python bench_graph.py 200 malware,ioc
+The start kind is apt; start ids are drawn from apt_malware.
+"""
+import sys
+import os
+import random
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import create_app
+from app.graph import sql_pivot
+from app.graph_index import AdjacencyIndex
+from app.models import db, apt_malware
+
+
+def _timed(fn, starts, path):
+    samples = []
+    for start in starts:
+        t0 = time.perf_counter()
+        fn('apt', [start], path)
+        samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95)]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    path = (sys.argv[2] if len(sys.argv) > 2 else 'malware,ioc').split(',')
+
+    app = create_app()
+    with app.app_context():
+        try:
+            index = AdjacencyIndex()
+            t0 = time.perf_counter()
+            index.build_from_db()
+            print(f"✓ index built in {time.perf_counter() - t0:.2f}s: {index.stats()}")
+
+            apt_ids = sorted({a for (a,) in db.session.execute(db.select(apt_malware.c.apt_id))})
+            if not apt_ids:
+                print("No apt_malware rows to pivot from")
+                return
+            starts = [random.choice(apt_ids) for _ in range(runs)]
+
+            for start in starts[:20]:
+                assert index.pivot('apt', [start], path) == sql_pivot('apt', [start], path)
+            print("✓ memory and SQL results agree")
+
+            mem = _timed(index.pivot, starts, path)
+            sql = _timed(sql_pivot, starts, path)
+            print(f"apt -> {' -> '.join(path)}, {runs} pivots")
+            print(f"  memory: p50 {mem[0]:10.1f} us   p95 {mem[1]:10.1f} us")
+            print(f"  sql:    p50 {sql[0]:10.1f} us   p95 {sql[1]:10.1f} us")
+        except Exception as e:
+            print(f"Error running benchmark: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    main()
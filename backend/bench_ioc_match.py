@@ -0,0 +1,55 @@
+"""Measure IP lookup throughput of the CIDR trie against the IOCs in the database.
+
+Usage: python bench_ioc_match.py [lookups]   e.g. python bench_ioc_match.py 500000
+Addresses are random IPv4, plus random addresses inside stored IP/CIDR IOCs
+so that part of the lookups hit.
+"""
+import sys
+import os
+import random
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import create_app
+from app.iptrie import CIDRMatcher, parse_network
+from app.models import db, IOC
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    app = create_app()
+    with app.app_context():
+        try:
+            matcher = CIDRMatcher()
+            networks = []
+            t0 = time.perf_counter()
+            for ioc_id, ioc_type, value in db.session.execute(db.select(IOC.id, IOC.type, IOC.value)):
+                matcher.add(ioc_id, ioc_type, value)
+                net = parse_network(value)
+                if net is not None:
+                    networks.append(net)
+            print(f"✓ trie built in {time.perf_counter() - t0:.2f}s: {matcher.stats()}")
+
+            addresses = []
+            for _ in range(runs):
+                if networks and random.random() < 0.3:
+                    net = random.choice(networks)
+                    addr = net.network_address + random.randrange(net.num_addresses)
+                    addresses.append(str(addr))
+                else:
+                    addresses.append('.'.join(str(random.randrange(256)) for _ in range(4)))
+
+            t0 = time.perf_counter()
+            hits = sum(1 for address in addresses if matcher.match(address))
+            elapsed = time.perf_counter() - t0
+            print(f"{runs} lookups, {hits} matched")
+            print(f"  {runs / elapsed:,.0f} lookups/s   {elapsed / runs * 1e6:.2f} us/lookup")
+        except Exception as e:
+            print(f"Error running benchmark: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Serialization time per 1k list rows: to_dict + stdlib jsonify vs row tuples + FastJSONProvider.
+
+Usage: python bench_json.py [rows] [repeats]
+No database needed: rows are synthetic IOCs shaped like the /api/iocs listing.
+"""
+import sys
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+sys.path.insert(0, os.path.dirname(__file__))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from app import jsonprovider
+from app.jsonprovider import FastJSONProvider
+from app.models import IOC
+from app.projection import row_to_dict
+
+
+def _rows(n, fields):
+    """Tuples of `fields` plus created_at, built by field name so they follow IOC.API_FIELDS."""
+    base = date(2024, 1, 1)
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    make = {
+        'id': lambda i: i,
+        'type': lambda i: 'domain',
+        'value': lambda i: f'host-{i}.example.net',
+        'normalized_value': lambda i: f'host-{i}.example.net',
+        'first_seen': lambda i: base + timedelta(days=i % 300),
+        'last_seen': lambda i: base + timedelta(days=i % 300 + 30),
+        'confidence': lambda i: i % 101,
+        'source': lambda i: 'feed',
+        'created_at': lambda i: created + timedelta(minutes=i),
+    }
+    return [tuple(make[f](i) for f in fields + ['created_at']) for i in range(n)]
+
+
+def _best(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    fields = list(IOC.API_FIELDS)
+    rows = _rows(n, fields)
+    models = [IOC(**dict(zip(fields + ['created_at'], row))) for row in rows]
+
+    app = Flask(__name__)
+    stdlib = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+
+    def before():
+        return stdlib.dumps([m.to_dict() for m in models])
+
+    def after():
+        return jsonprovider.dumps_bytes([row_to_dict(row, fields) for row in rows])
+
+    def after_stdlib():
+        orjson, jsonprovider.orjson = jsonprovider.orjson, None
+        try:
+            return jsonprovider.dumps_bytes([row_to_dict(row, fields) for row in rows])
+        finally:
+            jsonprovider.orjson = orjson
+
+    per_1k = 1000 / n * 1000
+    print(f"{n} rows, best of {repeats} (ms per 1k rows)")
+    print(f"  before  to_dict + stdlib jsonify:     {_best(before, repeats) * per_1k:8.2f}")
+    print(f"  after   tuples + {fast.backend:<6} provider:    {_best(after, repeats) * per_1k:8.2f}")
+    if jsonprovider.orjson is not None:
+        print(f"  after   tuples + stdlib fallback:     {_best(after_stdlib, repeats) * per_1k:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Build a binary IOC snapshot for sensors (served from /api/iocs/snapshot/<version>)
+
+Usage: python build_ioc_snapshot.py [--verify]
+  --verify  reopen the file and look every hash record up again
+"""
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import create_app
+from app.ioc_snapshot import IOCSnapshot, build_snapshot, snapshot_path
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        try:
+            directory = app.config['IOC_SNAPSHOT_DIR']
+            meta = build_snapshot(directory, keep=app.config['IOC_SNAPSHOT_KEEP'])
+            print(f"✓ snapshot {meta['version']}: {meta['bytes'] / 1e6:.2f} MB "
+                  f"in {meta['build_seconds']:.1f}s, sha256 {meta['sha256']}")
+            print(f"✓ records: {meta['records']}")
+
+            if '--verify' in sys.argv[1:]:
+                snap = IOCSnapshot(snapshot_path(directory, meta['version']))
+                t0 = time.perf_counter()
+                lookups = 0
+                for name in ('md5', 'sha1', 'sha256', 'sha512'):
+                    offset, size, records = snap.sections[name]
+                    for i in range(records):
+                        digest = snap.buf[offset + i * size:offset + (i + 1) * size - 4].hex()
+                        assert snap.lookup_hash(digest) is not None, digest
+                        lookups += 1
+                elapsed = time.perf_counter() - t0
+                snap.close()
+                print(f"✓ {lookups} hash lookups verified "
+                      f"({elapsed / lookups * 1e6 if lookups else 0:.1f} us each)")
+        except Exception as e:
+            print(f"Error building IOC snapshot: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    main()
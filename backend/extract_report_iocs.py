@@ -0,0 +1,37 @@
+"""Extract IOCs/CVEs from the full text of every report and link them"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import create_app
+from app.extract import backfill
+
+
+def _progress(stats):
+    print(f"  {stats['reports']} reports, {stats['bytes'] / 1e6:.1f} MB, "
+          f"{stats['mb_per_second']:.2f} MB/s")
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        try:
+            stats = backfill(
+                workers=app.config['EXTRACT_WORKERS'] or None,
+                batch_size=app.config['EXTRACT_BATCH_SIZE'],
+                on_batch=_progress,
+            )
+            print(f"✓ {stats['reports']} reports scanned ({stats['bytes'] / 1e6:.1f} MB of text)")
+            print(f"✓ {stats['iocs_inserted']} new IOCs, {stats['report_ioc']} report links, "
+                  f"{stats['malware_vuln']} malware-CVE links")
+            extract_rate = stats['bytes'] / 1e6 / stats['extract_seconds'] if stats['extract_seconds'] else 0
+            print(f"✓ throughput: {stats['mb_per_second']:.2f} MB/s end to end, "
+                  f"{extract_rate:.2f} MB/s extraction only")
+        except Exception as e:
+            print(f"Error extracting IOCs: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    main()
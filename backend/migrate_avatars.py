@@ -0,0 +1,33 @@
+"""Move legacy base64 avatars from user_profiles.avatar into avatar_blobs"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import create_app
+from app.models import db, UserProfile
+from app.avatars import AvatarError, decode_avatar, store_avatar
+
+
+def migrate_avatars():
+    app = create_app()
+    with app.app_context():
+        sizes = app.config['AVATAR_SIZES']
+        max_bytes = app.config['AVATAR_MAX_BYTES']
+        ids = [pid for (pid,) in db.session.query(UserProfile.id).filter(UserProfile.avatar.isnot(None))]
+        moved = skipped = 0
+        for pid in ids:
+            profile = db.session.get(UserProfile, pid)
+            try:
+                raw = decode_avatar(profile.avatar, max_bytes)
+                profile.avatar_hash = store_avatar(raw, sizes)
+                moved += 1
+            except AvatarError as e:
+                print(f"Profile {pid}: {e}, dropping avatar")
+                skipped += 1
+            profile.avatar = None
+            db.session.commit()
+        print(f"✓ Avatars moved: {moved}, dropped: {skipped}")
+
+
+if __name__ == '__main__':
+    migrate_avatars()
@@ -0,0 +1,11 @@
+-- Migration: Composite (created_at, id) indexes for cursor pagination
+-- Date: 2026-10-18
+-- Description: Collection endpoints page with WHERE (created_at, id) < (:ts, :id)
+-- ORDER BY created_at DESC, id DESC; these indexes make every page an index range scan
+
+CREATE INDEX IF NOT EXISTS ix_apt_groups_created_at_id ON apt_groups (created_at, id);
+CREATE INDEX IF NOT EXISTS ix_malware_created_at_id ON malware (created_at, id);
+CREATE INDEX IF NOT EXISTS ix_reports_created_at_id ON reports (created_at, id);
+CREATE INDEX IF NOT EXISTS ix_iocs_created_at_id ON iocs (created_at, id);
+CREATE INDEX IF NOT EXISTS ix_sigma_rules_created_at_id ON sigma_rules (created_at, id);
+CREATE INDEX IF NOT EXISTS ix_alerts_created_at_id ON alerts (created_at, id);
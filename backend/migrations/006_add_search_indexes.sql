@@ -0,0 +1,37 @@
+-- Migration: Indexed full-text and trigram search
+-- Date: 2026-10-18
+-- Description: /api/search uses pg_trgm GIN indexes for substring matches and
+-- generated tsvector columns for ranked word matches instead of sequential ILIKE scans
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- array_to_string is only STABLE, generated columns require IMMUTABLE expressions
+CREATE OR REPLACE FUNCTION klev_array_text(arr text[]) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$ SELECT coalesce(array_to_string(arr, ' '), '') $$;
+
+ALTER TABLE malware ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(family, '') || ' ' || coalesce(type, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+) STORED;
+
+ALTER TABLE apt_groups ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', klev_array_text(aliases)), 'A') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+) STORED;
+
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(summary, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(full_text, '')), 'C')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_malware_name_trgm ON malware USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_apt_groups_name_trgm ON apt_groups USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_iocs_value_trgm ON iocs USING gin (value gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_reports_title_trgm ON reports USING gin (title gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_malware_search_vector ON malware USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS ix_apt_groups_search_vector ON apt_groups USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS ix_reports_search_vector ON reports USING gin (search_vector);
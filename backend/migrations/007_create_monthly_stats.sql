@@ -0,0 +1,24 @@
+-- Migration: Monthly rollup table for /api/stats/overview
+-- Date: 2026-10-18
+-- Description: Per-entity row counts by month, maintained by the API write paths.
+-- The backfill below is the same date_trunc GROUP BY as rebuild_stats.py
+
+CREATE TABLE IF NOT EXISTS monthly_stats (
+    entity VARCHAR(50) NOT NULL,
+    month DATE NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (entity, month)
+);
+
+INSERT INTO monthly_stats (entity, month, count)
+SELECT 'malware', date_trunc('month', created_at)::date, count(*) FROM malware
+WHERE created_at IS NOT NULL GROUP BY 1, 2
+UNION ALL
+SELECT 'iocs', date_trunc('month', created_at)::date, count(*) FROM iocs
+WHERE created_at IS NOT NULL GROUP BY 1, 2
+UNION ALL
+SELECT 'reports', date_trunc('month', created_at)::date, count(*) FROM reports
+WHERE created_at IS NOT NULL GROUP BY 1, 2
+ON CONFLICT (entity, month) DO UPDATE SET count = EXCLUDED.count;
+
+COMMENT ON TABLE monthly_stats IS 'Monthly created-row counts per entity for dashboard charts';
@@ -0,0 +1,18 @@
+-- Migration: Running entity counters for /api/stats/metrics
+-- Date: 2026-10-18
+-- Description: Totals maintained by the API write paths; reconciled against
+-- COUNT(*) by a background timer when older than COUNTERS_RECONCILE_SECONDS
+-- and by rebuild_stats.py (?exact=1 counts without touching them)
+
+CREATE TABLE IF NOT EXISTS entity_counters (
+    entity VARCHAR(50) PRIMARY KEY,
+    count BIGINT NOT NULL DEFAULT 0,
+    reconciled_at TIMESTAMPTZ
+);
+
+INSERT INTO entity_counters (entity, count, reconciled_at)
+SELECT 'reports', count(*), now() FROM reports
+UNION ALL SELECT 'malware', count(*), now() FROM malware
+UNION ALL SELECT 'iocs', count(*), now() FROM iocs
+UNION ALL SELECT 'sigma_rules', count(*), now() FROM sigma_rules
+ON CONFLICT (entity) DO UPDATE SET count = EXCLUDED.count, reconciled_at = EXCLUDED.reconciled_at;
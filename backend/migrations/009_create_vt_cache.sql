@@ -0,0 +1,16 @@
+-- Migration: Persistent VirusTotal result cache
+-- Date: 2026-10-18
+-- Description: Processed /api/virustotal/scan results (found and "not found")
+-- keyed by normalized indicator, with per-entry expiry
+
+CREATE TABLE IF NOT EXISTS vt_cache (
+    indicator TEXT PRIMARY KEY,
+    status SMALLINT NOT NULL,
+    payload JSONB NOT NULL,
+    fetched_at TIMESTAMPTZ DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_vt_cache_expires_at ON vt_cache (expires_at);
+
+COMMENT ON COLUMN vt_cache.status IS '200 = found, 404 = not found in VirusTotal';
@@ -0,0 +1,19 @@
+-- Migration: Content-addressed avatar storage
+-- Date: 2026-10-18
+-- Description: Avatar thumbnails keyed by SHA-256 of the uploaded image;
+-- user_profiles reference them by hash instead of embedding base64.
+-- Existing base64 avatars are converted by `python migrate_avatars.py`
+
+CREATE TABLE IF NOT EXISTS avatar_blobs (
+    hash VARCHAR(64) NOT NULL,
+    size SMALLINT NOT NULL,
+    content_type VARCHAR(50) NOT NULL,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (hash, size)
+);
+
+ALTER TABLE user_profiles ADD COLUMN IF NOT EXISTS avatar_hash VARCHAR(64);
+
+COMMENT ON COLUMN user_profiles.avatar IS 'Legacy base64 avatar, cleared once moved to avatar_blobs';
+COMMENT ON COLUMN user_profiles.avatar_hash IS 'SHA-256 of the uploaded avatar, key into avatar_blobs';
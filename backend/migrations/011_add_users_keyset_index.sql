@@ -0,0 +1,4 @@
+-- Migration: Composite (created_at, id) index on users for admin list paging
+-- Date: 2026-10-18
+
+CREATE INDEX IF NOT EXISTS ix_users_created_at_id ON users (created_at, id);
@@ -0,0 +1,15 @@
+-- Migration: Reverse-direction indexes on association tables
+-- Date: 2026-10-18
+-- Description: The composite primary keys only serve lookups by the first column;
+-- /api/graph walks links in both directions, so index the second column too
+
+CREATE INDEX IF NOT EXISTS ix_apt_malware_malware_id ON apt_malware (malware_id);
+CREATE INDEX IF NOT EXISTS ix_malware_ioc_ioc_id ON malware_ioc (ioc_id);
+CREATE INDEX IF NOT EXISTS ix_report_apt_apt_id ON report_apt (apt_id);
+CREATE INDEX IF NOT EXISTS ix_report_malware_malware_id ON report_malware (malware_id);
+CREATE INDEX IF NOT EXISTS ix_report_ioc_ioc_id ON report_ioc (ioc_id);
+CREATE INDEX IF NOT EXISTS ix_campaign_apt_apt_id ON campaign_apt (apt_id);
+CREATE INDEX IF NOT EXISTS ix_campaign_malware_malware_id ON campaign_malware (malware_id);
+CREATE INDEX IF NOT EXISTS ix_campaign_reports_report_id ON campaign_reports (report_id);
+CREATE INDEX IF NOT EXISTS ix_malware_vuln_vuln_id ON malware_vuln (vuln_id);
+CREATE INDEX IF NOT EXISTS ix_apt_vuln_vuln_id ON apt_vuln (vuln_id);
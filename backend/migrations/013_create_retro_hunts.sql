@@ -0,0 +1,37 @@
+-- Migration: Sigma retro-hunt jobs and their hits
+-- Date: 2026-10-18
+-- Description: Progress of retro-hunts over local JSONL log files and the
+-- rule matches they found
+
+CREATE TABLE IF NOT EXISTS retro_hunts (
+    id SERIAL PRIMARY KEY,
+    path TEXT NOT NULL,
+    logsource JSONB,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    rules INTEGER,
+    total_bytes BIGINT NOT NULL DEFAULT 0,
+    processed_bytes BIGINT NOT NULL DEFAULT 0,
+    events BIGINT NOT NULL DEFAULT 0,
+    hits BIGINT NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS ix_retro_hunts_created_at_id ON retro_hunts (created_at, id);
+
+CREATE TABLE IF NOT EXISTS retro_hunt_hits (
+    id BIGSERIAL PRIMARY KEY,
+    hunt_id INTEGER NOT NULL REFERENCES retro_hunts(id) ON DELETE CASCADE,
+    rule_id INTEGER NOT NULL,
+    file TEXT NOT NULL,
+    line_offset BIGINT NOT NULL,
+    event JSONB,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_retro_hunt_hits_hunt_id_created_at_id ON retro_hunt_hits (hunt_id, created_at, id);
+
+COMMENT ON COLUMN retro_hunts.status IS 'queued, running, done, failed or cancelled';
+COMMENT ON COLUMN retro_hunt_hits.line_offset IS 'Byte offset of the matching line (uncompressed for .gz files)';
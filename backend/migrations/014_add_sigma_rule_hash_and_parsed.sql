@@ -0,0 +1,23 @@
+-- Migration: Content hash and parsed form for Sigma rules
+-- Date: 2026-10-18
+-- Description: sha256 of the rule text for dedupe (bulk import, single POST)
+-- and the validated rule as JSON so it is not re-parsed from YAML on every use
+
+ALTER TABLE sigma_rules ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+ALTER TABLE sigma_rules ADD COLUMN IF NOT EXISTS parsed JSONB;
+
+-- Existing duplicates keep a NULL hash so the unique index can be built;
+-- the oldest copy of each text gets the hash
+UPDATE sigma_rules s
+SET content_hash = h.hash
+FROM (
+    SELECT id,
+           encode(sha256(convert_to(content, 'UTF8')), 'hex') AS hash,
+           row_number() OVER (PARTITION BY md5(content) ORDER BY id) AS rn
+    FROM sigma_rules
+) h
+WHERE s.id = h.id AND h.rn = 1 AND s.content_hash IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS sigma_rules_content_hash_key ON sigma_rules (content_hash);
+
+COMMENT ON COLUMN sigma_rules.parsed IS 'Validated rule as JSON; NULL for rules stored before validation, parsed from content on use';
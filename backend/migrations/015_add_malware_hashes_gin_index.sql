@@ -0,0 +1,7 @@
+-- Migration: GIN index on malware.hashes
+-- Date: 2026-10-18
+-- Description: Serves the array overlap (&&) used by POST /api/malware/lookup-hashes;
+-- IOC hash lookups used the unique index on iocs.value until migration 016,
+-- which moves them to ix_iocs_lookup_value (coalesce(normalized_value, value))
+
+CREATE INDEX IF NOT EXISTS ix_malware_hashes ON malware USING GIN (hashes);
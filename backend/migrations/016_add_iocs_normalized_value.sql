@@ -0,0 +1,48 @@
+-- Migration: Normalized IOC values
+-- Date: 2026-10-18
+-- Description: Canonical spelling of iocs.value (refanged, case-folded, canonical IP/URL),
+-- written on insert; dedupe upserts on it and lookups compare it by equality.
+-- The shapes SQL can normalize exactly like app/normalize.py (hashes, plain IPv4,
+-- plain ASCII domains, verbatim types) are filled here; normalize_iocs.py fills
+-- the rest (URLs, IPv6, CIDRs, refanged values) and merges duplicates.
+-- Until then lookups fall back to the raw value through ix_iocs_lookup_value.
+
+ALTER TABLE iocs ADD COLUMN IF NOT EXISTS normalized_value TEXT;
+
+-- Existing duplicates keep a NULL normalized value so the unique index can be
+-- built; the oldest row of each value gets it, normalize_iocs.py --merge folds the others in
+WITH computed AS (
+    SELECT id,
+           CASE
+               WHEN lower(btrim(coalesce(type, ''))) IN (
+                   'filename', 'file', 'filepath', 'path', 'mutex', 'registry', 'regkey',
+                   'user-agent', 'useragent', 'yara', 'text'
+               ) THEN btrim(value)
+               WHEN btrim(value) ~* '^([0-9a-f]{32}|[0-9a-f]{40}|[0-9a-f]{64}|[0-9a-f]{128})$'
+                   THEN lower(btrim(value))
+               WHEN btrim(value) ~ '^((25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.){3}(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])$'
+                   THEN btrim(value)
+               WHEN btrim(value) ~* '^[a-z0-9_-]+(\.[a-z0-9_-]+)+\.?$'
+                   THEN rtrim(lower(btrim(value)), '.')
+           END AS norm
+    FROM iocs
+    WHERE normalized_value IS NULL
+), ranked AS (
+    SELECT c.id, c.norm, row_number() OVER (PARTITION BY c.norm ORDER BY c.id) AS rn
+    FROM computed c
+    WHERE c.norm IS NOT NULL AND c.norm <> ''
+      AND NOT EXISTS (SELECT 1 FROM iocs o WHERE o.normalized_value = c.norm)
+)
+UPDATE iocs i
+SET normalized_value = r.norm
+FROM ranked r
+WHERE i.id = r.id AND r.rn = 1;
+
+DROP INDEX IF EXISTS ix_iocs_normalized_value;
+CREATE UNIQUE INDEX IF NOT EXISTS iocs_normalized_value_key
+    ON iocs (normalized_value) WHERE normalized_value IS NOT NULL;
+
+-- lookups: the normalized value, or the raw one for rows normalize_iocs.py has not reached
+CREATE INDEX IF NOT EXISTS ix_iocs_lookup_value ON iocs ((coalesce(normalized_value, value)));
+
+COMMENT ON COLUMN iocs.normalized_value IS 'Canonical form of value (app/normalize.py), unique; NULL for older rows normalize_iocs.py has not normalized or merged yet';
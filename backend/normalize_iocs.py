@@ -0,0 +1,48 @@
+"""Fill iocs.normalized_value and merge IOCs that normalize to the same value
+
+Usage: python normalize_iocs.py [--all] [--merge]
+  --all    recompute every row, not only rows without a normalized value
+  --merge  fold duplicates into the row holding their value (links, dates and confidence are kept)
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import create_app
+from app.normalize import backfill, duplicate_groups, merge_duplicates
+
+
+def _progress(stats):
+    print(f"  {stats['scanned']} rows scanned, {stats['updated']} updated "
+          f"({stats['scanned'] / stats['elapsed_seconds']:.0f} rows/s)")
+
+
+def main():
+    args = sys.argv[1:]
+    app = create_app()
+    with app.app_context():
+        try:
+            stats = backfill(only_missing='--all' not in args, on_batch=_progress)
+            print(f"✓ {stats['updated']} of {stats['scanned']} IOCs normalized "
+                  f"in {stats['elapsed_seconds']:.1f}s, {stats['duplicates']} duplicates left unset")
+
+            groups = duplicate_groups()
+            if not groups:
+                print("✓ no duplicates")
+            elif '--merge' in args:
+                merged, deleted = merge_duplicates()
+                print(f"✓ {merged} duplicate groups merged, {deleted} rows removed")
+            else:
+                extra = sum(len(drop) for _, _, drop in groups)
+                print(f"{len(groups)} normalized values are held by several rows ({extra} extra rows); "
+                      f"run with --merge to fold them")
+                for value, keep, drop in groups[:20]:
+                    print(f"  {value}: {keep} <- {drop}")
+        except Exception as e:
+            print(f"Error normalizing IOCs: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    main()
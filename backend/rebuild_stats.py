@@ -0,0 +1,25 @@
+"""Recompute monthly_stats and entity_counters from the base tables"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import create_app
+from app.rollups import rebuild_rollup, reconcile_counters
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        try:
+            rebuild_rollup()
+            print("✓ monthly_stats rebuilt")
+            counts = reconcile_counters()
+            print(f"✓ entity_counters reconciled: {counts}")
+        except Exception as e:
+            print(f"Error rebuilding stats: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    main()
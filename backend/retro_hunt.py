@@ -0,0 +1,52 @@
+"""Run a Sigma retro-hunt over a JSONL log file or directory from the command line
+
+Usage: python retro_hunt.py <path> [workers]
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import create_app
+from app.models import db, RetroHunt
+from app.retrohunt import run_hunt
+
+
+def _progress(hunt):
+    print(f"  {hunt['progress'] or 0:6.1%}  {hunt['events']} events, {hunt['hits']} hits, "
+          f"{hunt['events_per_second'] or 0} events/s")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    path = os.path.abspath(sys.argv[1])
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    app = create_app()
+    with app.app_context():
+        try:
+            hunt = RetroHunt(path=path, status='queued')
+            db.session.add(hunt)
+            db.session.commit()
+            result = run_hunt(
+                hunt.id,
+                workers=workers or app.config['RETRO_HUNT_WORKERS'] or None,
+                chunk_bytes=app.config['RETRO_HUNT_CHUNK_MB'] << 20,
+                max_hits=app.config['RETRO_HUNT_MAX_HITS'],
+                on_progress=_progress,
+            )
+            if result['status'] == 'failed':
+                print(f"Error: retro-hunt {result['id']} failed: {result['error']}")
+            else:
+                print(f"✓ retro-hunt {result['id']} {result['status']}: {result['events']} events, "
+                      f"{result['hits']} hits in {result['elapsed_seconds']}s "
+                      f"({result['events_per_second']} events/s)")
+        except Exception as e:
+            print(f"Error running retro-hunt: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    main()
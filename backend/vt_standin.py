@@ -0,0 +1,105 @@
+"""Local stand-in for the VirusTotal v3 API (files and search endpoints).
+
+Start it and point the backend at it:
+
+    python vt_standin.py --port 8899 --quota 60
+    VT_BASE_URL=http://127.0.0.1:8899/api/v3 VT_API_KEY=test python run.py
+
+Answers are deterministic per indicator: hashes starting with "0000" and
+search queries containing "unknown" are not found; everything else gets a
+file report. With --quota N, more than N requests in a rolling minute get
+429 with a Retry-After header, like the real API.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def fake_attributes(indicator):
+    seed = int(hashlib.sha256(indicator.encode('utf-8')).hexdigest()[:8], 16)
+    malicious = seed % 40
+    return {
+        'last_analysis_stats': {'malicious': malicious, 'suspicious': seed % 3, 'undetected': 70 - malicious},
+        'last_analysis_results': {
+            f'Engine{i}': {'category': 'malicious', 'result': f'Trojan.Gen.{i}'} for i in range(min(malicious, 7))
+        },
+        'last_analysis_date': 1700000000 + seed % 10000000,
+        'reputation': -(seed % 100),
+    }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    quota = 0
+    latency = 0.0
+    _calls = deque()
+    _lock = threading.Lock()
+
+    def _over_quota(self):
+        if not self.quota:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and now - self._calls[0] > 60:
+                self._calls.popleft()
+            if len(self._calls) >= self.quota:
+                return True
+            self._calls.append(now)
+        return False
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if not self.headers.get('x-apikey'):
+            return self._send(401, {'error': {'code': 'WrongCredentialsError'}})
+        if self._over_quota():
+            return self._send(429, {'error': {'code': 'QuotaExceededError'}}, {'Retry-After': '5'})
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(self.path)
+        if url.path.startswith('/api/v3/files/'):
+            file_id = url.path.rsplit('/', 1)[-1]
+            if file_id.startswith('0000'):
+                return self._send(404, {'error': {'code': 'NotFoundError'}})
+            return self._send(200, {'data': {'id': file_id, 'type': 'file', 'attributes': fake_attributes(file_id)}})
+        if url.path == '/api/v3/search':
+            query = (parse_qs(url.query).get('query') or [''])[0]
+            if not query or 'unknown' in query or query.startswith('0000'):
+                return self._send(200, {'data': []})
+            return self._send(200, {'data': [{'id': query, 'type': 'file', 'attributes': fake_attributes(query)}]})
+        return self._send(404, {'error': {'code': 'NotFoundError'}})
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--quota', type=int, default=0, help='requests per minute before 429 (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to sleep per request')
+    args = parser.parse_args()
+
+    StandInHandler.quota = args.quota
+    StandInHandler.latency = args.latency
+    server = ThreadingHTTPServer((args.host, args.port), StandInHandler)
+    print(f"VirusTotal stand-in listening on http://{args.host}:{args.port}/api/v3")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,5 +5,13 @@ export function apiUrl(path) {
   return `${apiBase}${path}`;
 }
 
+// Resolve an asset reference from the API (e.g. /api/avatars/<hash>);
+// inline data: URLs and absolute URLs are returned untouched
+export function assetUrl(src) {
+  if (!src) return src;
+  if (/^(data:|blob:|https?:)/.test(src)) return src;
+  return apiUrl(src);
+}
+
 export default apiUrl;
 
@@ -2,7 +2,7 @@
 import './Sidebar.css';
 import { useState, useEffect } from 'react';
 import { NavLink, useNavigate } from 'react-router-dom';
-import apiUrl from '../apiClient';
+import apiUrl, { assetUrl } from '../apiClient';
 import {
   FiAlertTriangle,
   FiBarChart2,
@@ -190,7 +190,7 @@ function Sidebar() {
         <div className="shadcn-user-profile" style={{position: 'relative'}}>
           <div className="user-avatar-small">
             {currentUser?.profile?.avatar ? (
-              <img src={currentUser.profile.avatar} alt="avatar" className="sidebar-avatar-img" />
+              <img src={assetUrl(currentUser.profile.avatar)} alt="avatar" className="sidebar-avatar-img" />
             ) : (
               <FiUser />
             )}
@@ -1,5 +1,5 @@
 // src/pages/DashboardPage.js
-import { useEffect, useState, useCallback } from 'react';
+import { useEffect, useState, useCallback, useRef } from 'react';
 import { Outlet } from 'react-router-dom';
 import './DashboardPage.css';
 import Sidebar from '../components/Sidebar';
@@ -16,7 +16,6 @@ function DashboardPage() {
     return !hasShownLoading;
   });
   const [notifications, setNotifications] = useState([]);
-  const [lastAlertId, setLastAlertId] = useState(null);
   const [viewedAlerts, setViewedAlerts] = useState(() => {
     try {
       const saved = localStorage.getItem('kc_viewed_alerts');
@@ -63,43 +62,76 @@ function DashboardPage() {
     return true;
   }, [notificationSettings]);
 
-  // Poll for new alerts every 10 seconds
+  // Keep the latest settings/viewed list reachable from the long-lived stream handler
+  const viewedAlertsRef = useRef(viewedAlerts);
+  const shouldShowRef = useRef(shouldShowNotification);
+  useEffect(() => { viewedAlertsRef.current = viewedAlerts; }, [viewedAlerts]);
+  useEffect(() => { shouldShowRef.current = shouldShowNotification; }, [shouldShowNotification]);
+
+  // Receive new alerts over Server-Sent Events (falls back to since_id polling)
   useEffect(() => {
-    const fetchAlerts = () => {
-      fetch(apiUrl('/api/alerts'))
+    let source = null;
+    let pollTimer = null;
+    let lastSeenId = 0;
+    let closed = false;
+
+    const pushAlert = (alert) => {
+      lastSeenId = Math.max(lastSeenId, alert.id);
+      if (viewedAlertsRef.current.includes(alert.id)) return;
+      if (!shouldShowRef.current(alert.type)) return;
+      setNotifications(prev => [
+        {
+          id: alert.id,
+          type: alert.type,
+          message: alert.message,
+          username: alert.username
+        },
+        ...prev.filter(n => n.id !== alert.id).slice(0, 2) // Keep max 3 notifications visible
+      ]);
+    };
+
+    const poll = () => {
+      fetch(apiUrl(`/api/alerts?since_id=${lastSeenId}`))
         .then(r => r.json())
         .then(data => {
-          if (Array.isArray(data) && data.length > 0) {
-            // Only show the latest alert as a toast
-            const latestAlert = data[0];
-            
-            // Check if this is a new alert we haven't shown yet AND not already viewed
-            if (latestAlert.id !== lastAlertId && !viewedAlerts.includes(latestAlert.id)) {
-              setLastAlertId(latestAlert.id);
-              
-              // Check if we should show this type of notification
-              if (shouldShowNotification(latestAlert.type)) {
-                setNotifications(prev => [
-                  {
-                    id: latestAlert.id,
-                    type: latestAlert.type,
-                    message: latestAlert.message,
-                    username: latestAlert.username
-                  },
-                  ...prev.slice(0, 2) // Keep max 3 notifications visible
-                ]);
-              }
-            }
-          }
+          if (Array.isArray(data)) data.forEach(pushAlert);
         })
         .catch(err => console.error('Error fetching alerts:', err));
     };
 
-    fetchAlerts();
-    const interval = setInterval(fetchAlerts, 10000); // Poll every 10 seconds
+    const subscribe = () => {
+      if (closed) return;
+      if (typeof window.EventSource === 'undefined') {
+        pollTimer = setInterval(poll, 10000);
+        return;
+      }
+      // EventSource reconnects on its own and resumes via Last-Event-ID
+      source = new EventSource(apiUrl(`/api/alerts/stream?since_id=${lastSeenId}`));
+      source.addEventListener('alert', (event) => {
+        try {
+          pushAlert(JSON.parse(event.data));
+        } catch (err) {
+          console.error('Malformed alert event:', err);
+        }
+      });
+    };
+
+    // Show the most recent alert once, then listen for newer ones
+    fetch(apiUrl('/api/alerts?limit=1'))
+      .then(r => r.json())
+      .then(data => {
+        const latest = data && Array.isArray(data.items) ? data.items[0] : null;
+        if (latest) pushAlert(latest);
+      })
+      .catch(err => console.error('Error fetching alerts:', err))
+      .finally(subscribe);
 
-    return () => clearInterval(interval);
-  }, [lastAlertId, viewedAlerts, shouldShowNotification]); // Depend on lastAlertId, viewedAlerts and shouldShowNotification
+    return () => {
+      closed = true;
+      if (source) source.close();
+      if (pollTimer) clearInterval(pollTimer);
+    };
+  }, []);
 
   const handleCloseNotification = (id) => {
     // Mark as viewed and save to localStorage
@@ -2,7 +2,7 @@
 import { useEffect, useMemo, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { FiCheckCircle, FiShield } from 'react-icons/fi';
-import apiUrl from '../../apiClient';
+import apiUrl, { assetUrl } from '../../apiClient';
 import { readBookmarks } from '../../utils/bookmarks';
 
 function AccountView() {
@@ -39,7 +39,7 @@ function AccountView() {
       setUser(parsed);
       // Load avatar from profile if exists
       if (parsed.profile?.avatar) {
-        setAvatarPreview(parsed.profile.avatar);
+        setAvatarPreview(assetUrl(parsed.profile.avatar));
       }
       fetch(apiUrl(`/api/users/${parsed.id}`))
         .then((res) => {
@@ -50,7 +50,7 @@ function AccountView() {
           setUser(data);
           // Set avatar from server response
           if (data.profile?.avatar) {
-            setAvatarPreview(data.profile.avatar);
+            setAvatarPreview(assetUrl(data.profile.avatar));
           }
           localStorage.setItem('kc_user', JSON.stringify(data));
         })
@@ -91,10 +91,11 @@ function AccountView() {
         });
         
         if (res.ok) {
-          // Update local storage with new avatar
+          // Server returns the stored avatar URL; keep that instead of the base64 blob
+          const data = await res.json();
           const updatedUser = {
             ...user,
-            profile: { ...user.profile, avatar: base64 }
+            profile: { ...user.profile, avatar: data.avatar }
           };
           setUser(updatedUser);
           localStorage.setItem('kc_user', JSON.stringify(updatedUser));
@@ -3,6 +3,8 @@ import { FiUser, FiTrash2, FiLock, FiUnlock, FiPlus, FiX, FiEdit2 } from 'react-
 import apiUrl from '../../apiClient';
 import './AdminPanel.css';
 
+const USERS_PAGE_SIZE = 200;
+
 function AdminPanel() {
   const [users, setUsers] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -10,11 +12,21 @@ function AdminPanel() {
   const [newUser, setNewUser] = useState({ username: '', email: '', password: '', role: 'user' });
   const [error, setError] = useState('');
 
+  // /api/admin/users is paged; follow next_cursor until every user is loaded
   const fetchUsers = async () => {
     try {
-      const res = await fetch(apiUrl('/api/admin/users'));
-      const data = await res.json();
-      setUsers(data);
+      const all = [];
+      let cursor = null;
+      do {
+        const query = new URLSearchParams({ limit: USERS_PAGE_SIZE });
+        if (cursor) query.set('cursor', cursor);
+        const res = await fetch(apiUrl(`/api/admin/users?${query}`));
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        const data = await res.json();
+        all.push(...data.items);
+        cursor = data.next_cursor;
+      } while (cursor);
+      setUsers(all);
     } catch (err) {
       console.error('Error fetching users:', err);
     } finally {